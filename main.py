@@ -1,7 +1,9 @@
 from src.problem_creator import ProblemManager
+from src.batch_runner import BatchRunner
 
 # Adjust instance and Due Date
-path_data = 'data/sch100k1.csv'
+path_data = 'data/sch100k1.csv' # CSV of p, alpha and beta, OR-Library sch*.txt or binary .bin instance file
+instance = 0 # Instance of multi-instance files (0 for the first one)
 due_date = 454
 
 # Adjust instance name
@@ -16,10 +18,88 @@ stages_stop_criteria = 3
 initial_acceptance = 0.3
 minimum_pct_change = 0.005 # 0.001 for 0.1%
 global_minimum_it = 5
+seed = None # int for reproducible runs
+evaluator_engine = 'incremental' # 'closed_form' re-evaluates the full sequence, 'LP' solves it with Gurobi
+cache_size = 100000 # Objective values of visited sequences kept in memory (0 disables the cache)
+search_space = 'permutation' # 'partition' searches early/tardy partitions of V-shaped sequences instead
+has_v_shape_repair = False # V-shape repair of SA and Fix-and-Optimize solutions
+batch_size = 1 # Moves sampled and evaluated at once by the incremental engine (1 disables batches)
+batch_selection = 'metropolis' # 'metropolis' (first accepted move of the batch) or 'best' (best move of the batch)
+local_search = False # Swap descent over the full swap delta matrix after SA
+operator_selection = 'fixed' # 'fixed' (swaps then insertions in each stage) or 'adaptive_pursuit' (neighborhoods 1-4 chosen by their improvement)
+operator_credit = 'cpu_time' # Adaptive pursuit reward: improvement per 'cpu_time' second or per 'evaluation' (only 'evaluation' repeats runs with a seed or a checkpoint)
+trace_mode = 'memory' # 'memory' (full SA trace), 'ring' (last trace_max_rows moves) or 'stream' (chunks written to outputs/trace)
+stage_kernel = 'python' # 'numba' runs each SA stage as one compiled loop (Python stages if Numba is not installed)
+
+# Exact solver parameters (DP / branch-and-bound instead of SA, for small and medium instances)
+has_exact_solver = False
+exact_time_limit = 60 # secs, best solution found is kept if reached
+
+# Genetic algorithm parameters (population of permutations instead of a single SA chain)
+has_genetic_algorithm = False
+population_size = 50
+mutation_rate = 0.2
+generations_stop_criteria = 50
+improvement = None # None, 'sa' (short SA stage) or 'local_search' (swap descent) on the best children (memetic variant)
+
+# Multi-start SA portfolio parameters (independent chains in a process pool)
+has_portfolio = False
+n_chains = 8
+portfolio_seed = None # int to reproduce all chains
+initial_solutions = ['constructive', 'perturbed', 'random']
+
+# Parallel tempering parameters (replicas at a geometric ladder of temperatures)
+has_parallel_tempering = False
+n_replicas = 8
+coldest_temperature_ratio = 0.01
+rounds_stop_criteria = 10
+
+# Variable neighborhood descent parameters (swap, insertion and Or-opt descent after SA)
+has_vnd = False
+vnd_improvement = 'best' # 'best' or 'first' improvement
+replace_fix_and_optimize = False # VND instead of Fix-and-Optimize
 
 # Fix-and-Optimize parameters
 window_jump = 5
 window_size = 10
+subproblem = 'window' # 'window' (MILP of the window tasks only), 'exact' (solver-free DP of the window tasks) or 'full' (MILP of all tasks)
+parallel_fix_and_optimize = False # Solve non-overlapping windows concurrently
+
+# MILP/LP solver ('gurobi' or 'highs')
+solver_name = 'gurobi'
+persistent_solver = False # Opt-in: APPSI persistent solver (needs gurobipy for 'gurobi') that only receives the changes between solves
+
+# Time budget parameters (anytime mode: every stage stops at its share of the budget with its best solution)
+time_budget = None # secs of wall-clock time for the whole run (None runs every stage to its stop criteria)
+budget_policy = 'adaptive' # 'fixed' (share of the total budget) or 'adaptive' (share of the time left, unused time goes to later stages)
+
+# Lower bound parameters (gap of the solutions to a lower bound of the optimal cost)
+has_lower_bounds = False
+lower_bounds = ['trivial', 'partition_lagrangian'] # any of 'trivial' (any size), 'partition_lagrangian' (up to 200 tasks, integer p and due date), 'lagrangian' (up to 500 tasks) and 'lp_relaxation' (up to 200 tasks, solved by solver_name)
+gap_stop = None # SA and Fix-and-Optimize stop once the gap is at most gap_stop, None disables it
+
+# Checkpoint parameters (SA and Fix-and-Optimize state saved in outputs/<id>_checkpoint)
+has_checkpoints = False
+checkpoint_interval = 1 # SA stages or Fix-and-Optimize windows between checkpoints
+resume = False # Continue the run saved in the checkpoints instead of starting a new one
+
+# Batch parameters (grid of instances x h factors x SA parameters x seeds instead of the single run above)
+has_batch = False
+batch_instances = ['data/sch100k1.csv', 'data/sch200k1.csv'] # CSV, OR-Library sch*.txt (all instances) or binary .bin files
+h_factors = [0.2, 0.4, 0.6, 0.8] # Due date floor(h * sum(p)) of each instance
+batch_heuristic_parameters = [{}] # SA parameters overriding the ones above, e.g. [{'temperature_alpha': 0.8}, {'temperature_alpha': 0.9}]
+batch_seeds = [0, 1, 2]
+batch_workers = None # Processes running cells (None for one per CPU, 1 runs them in this process)
+batch_results_path = 'outputs/batch_results.csv' # Append-only, cells already in it are skipped
+
+# Export parameters
+table_format = 'csv' # 'csv', 'parquet' (requires pyarrow) or 'npz' file per table in outputs/<id> (None for Excel only)
+excel_report = True # output.xlsx with every table
+excel_max_rows = 100000 # Longer tables are sampled to evenly spaced rows in output.xlsx
+
+# Instrumentation parameters
+verbosity = 'stage' # 'silent', 'stage' (stage summaries), 'detail' (every solve) or 'move' (every SA move)
+sinks = ['console'] # any of 'console' (throttled prints), 'jsonl' (outputs/<id>_events.jsonl) and 'memory' (Excel sheet)
 
 id = instance_name      + \
     '_Temp_' + str(temperature_alpha) + \
@@ -34,13 +114,138 @@ heuristic_parameters = {
     'stages_stop_criteria': stages_stop_criteria,
     'initial_acceptance': initial_acceptance,
     'global_minimum_it': global_minimum_it,
-    'minimum_pct_change': minimum_pct_change
+    'minimum_pct_change': minimum_pct_change,
+    'evaluator_engine': evaluator_engine,
+    'cache_size': cache_size,
+    'search_space': search_space,
+    'batch_size': batch_size,
+    'batch_selection': batch_selection,
+    'local_search': local_search,
+    'operator_selection': operator_selection,
+    'operator_credit': operator_credit,
+    'stage_kernel': stage_kernel,
+    'trace_mode': trace_mode,
+    'solver_name': solver_name,
+    'persistent_solver': persistent_solver,
+    'seed': seed
+}
+
+portfolio_parameters = {
+    'n_chains': n_chains,
+    'seed': portfolio_seed,
+    'initial_solutions': initial_solutions
+}
+
+tempering_parameters = {
+    'n_replicas': n_replicas,
+    'coldest_temperature_ratio': coldest_temperature_ratio,
+    'rounds_stop_criteria': rounds_stop_criteria
+}
+
+exact_parameters = {
+    'time_limit': exact_time_limit
+}
+
+genetic_parameters = {
+    'population_size': population_size,
+    'mutation_rate': mutation_rate,
+    'generations_stop_criteria': generations_stop_criteria,
+    'improvement': improvement
+}
+
+vnd_parameters = {
+    'improvement': vnd_improvement,
+    'replace_fix_and_optimize': replace_fix_and_optimize
+}
+
+instrumentation_parameters = {
+    'verbosity': verbosity,
+    'sinks': sinks
+}
+
+budget_parameters = {
+    'total_time': time_budget,
+    'policy': budget_policy
+}
+
+bound_parameters = {
+    'bounds': lower_bounds,
+    'gap_stop': gap_stop,
+    'solver_name': solver_name
+}
+
+checkpoint_parameters = {
+    'interval': checkpoint_interval
 }
 
 fix_and_optimize_parameters = {
     'window_jump': window_jump,
-    'window_size': window_size
+    'window_size': window_size,
+    'subproblem': subproblem,
+    'parallel': parallel_fix_and_optimize,
+    'solver_name': solver_name,
+    'persistent_solver': persistent_solver
+}
+
+export_parameters = {
+    'table_format': table_format,
+    'excel': excel_report,
+    'excel_max_rows': excel_max_rows
+}
+
+batch_grid = {
+    'instances': batch_instances,
+    'h_factors': h_factors,
+    'heuristic_parameters': batch_heuristic_parameters,
+    'seeds': batch_seeds
+}
+
+batch_parameters = {
+    'max_workers': batch_workers,
+    'results_path': batch_results_path
 }
 
-problem_creator = ProblemManager(path_data, due_date, id, heuristic_parameters, fix_and_optimize_parameters, has_constructive_heuristic)
-problem_creator.run()
\ No newline at end of file
+if __name__ == '__main__' and has_batch:
+    batch_runner = BatchRunner(
+        batch_grid,
+        {
+            'heuristic_parameters': heuristic_parameters,
+            'fix_and_optimize_parameters': fix_and_optimize_parameters,
+            'has_constructive_heuristic': has_constructive_heuristic,
+            'portfolio_parameters': portfolio_parameters if has_portfolio else None,
+            'tempering_parameters': tempering_parameters if has_parallel_tempering else None,
+            'has_v_shape_repair': has_v_shape_repair,
+            'exact_parameters': exact_parameters if has_exact_solver else None,
+            'genetic_parameters': genetic_parameters if has_genetic_algorithm else None,
+            'vnd_parameters': vnd_parameters if has_vnd else None,
+            'budget_parameters': budget_parameters if time_budget is not None else None,
+            'bound_parameters': bound_parameters if has_lower_bounds else None
+        },
+        batch_parameters
+    )
+    batch_runner.run()
+elif __name__ == '__main__':
+    problem_creator = ProblemManager(
+        path_data, 
+        due_date, 
+        id, 
+        heuristic_parameters, 
+        fix_and_optimize_parameters, 
+        has_constructive_heuristic, 
+        portfolio_parameters if has_portfolio else None,
+        tempering_parameters if has_parallel_tempering else None,
+        has_v_shape_repair,
+        exact_parameters if has_exact_solver else None,
+        genetic_parameters if has_genetic_algorithm else None,
+        vnd_parameters if has_vnd else None,
+        instrumentation_parameters,
+        budget_parameters if time_budget is not None else None,
+        checkpoint_parameters if has_checkpoints else None,
+        instance,
+        export_parameters=export_parameters,
+        bound_parameters=bound_parameters if has_lower_bounds else None
+    )
+    if resume:
+        problem_creator.resume()
+    else:
+        problem_creator.run()
\ No newline at end of file
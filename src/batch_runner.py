@@ -0,0 +1,168 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import csv
+import json
+import math
+import os
+import time
+from .instance_io import iter_instances
+from .problem_creator import ProblemManager
+
+CELL_COLUMNS = ['INSTANCE', 'PATH', 'INSTANCE_INDEX', 'N', 'H', 'DUE_DATE', 'PARAMETERS', 'SEED']
+SUMMARY_COLUMNS = [
+    'OBJ', 'HEURISTIC_OBJ', 'CONSTRUCTIVE_TIME', 'BOUND_TIME', 'HEURISTIC_TIME', 'VND_TIME', 'FO_TIME', 'TOTAL_TIME',
+    'HEURISTIC_EVALUATIONS', 'VND_MOVES_EVALUATED', 'FO_ITERATIONS', 'LOWER_BOUND', 'GAP', 'INTERRUPTED'
+]
+RESULT_COLUMNS = CELL_COLUMNS + SUMMARY_COLUMNS + ['STATUS', 'ERROR']
+
+
+def run_cell(cell, base_parameters):
+    """
+    Return the result row of a grid cell: the run of its instance, due date, heuristic
+    parameters and seed, without outputs (see ProblemManager.run)
+    """
+    heuristic_parameters = dict(base_parameters['heuristic_parameters'], **json.loads(cell['PARAMETERS']), seed=cell['SEED'])
+    manager_parameters = {
+        key: value for key, value in base_parameters.items()
+        if key not in ('heuristic_parameters', 'fix_and_optimize_parameters', 'has_constructive_heuristic')
+    }
+    manager_parameters.setdefault('instrumentation_parameters', {'verbosity': 'silent', 'sinks': []})
+    try:
+        problem_manager = ProblemManager(
+            cell['PATH'],
+            cell['DUE_DATE'],
+            f"{cell['INSTANCE']}_h{cell['H']}_seed{cell['SEED']}",
+            heuristic_parameters,
+            base_parameters['fix_and_optimize_parameters'],
+            base_parameters.get('has_constructive_heuristic', True),
+            instance=cell['INSTANCE_INDEX'],
+            export_results=False,
+            **manager_parameters
+        )
+        summary = problem_manager.run()
+    except Exception as exception:
+        # One line, so a row cut by a crash never spans lines of the store
+        return dict(cell, STATUS='error', ERROR=f'{type(exception).__name__}: {exception}'.replace('\n', ' '))
+    return dict(cell, **summary, STATUS='interrupted' if summary['INTERRUPTED'] else 'ok', ERROR='')
+
+
+class ResultStore:
+    def __init__(self, path):
+        """
+        Append-only CSV of result rows, one per grid cell. Rows are flushed to disk as they
+        are written, and a row cut by a crash is dropped when the store is opened again.
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.isfile(path):
+            self.drop_partial_row()
+        if not os.path.isfile(path) or (os.path.getsize(path) == 0):
+            with open(path, 'w', newline='') as file:
+                csv.writer(file).writerow(RESULT_COLUMNS)
+
+    def drop_partial_row(self):
+        with open(self.path, 'rb+') as file:
+            content = file.read()
+            if content and not content.endswith(b'\n'):
+                file.truncate(content.rfind(b'\n') + 1)
+
+    def get_completed(self):
+        """
+        Return the keys (see get_cell_key) of the cells with status ok
+        """
+        with open(self.path, newline='') as file:
+            reader = csv.DictReader(file)
+            if reader.fieldnames != RESULT_COLUMNS:
+                raise Exception(f'Error: {self.path} is not a result store of this batch runner version')
+            return {get_cell_key(row) for row in reader if row['STATUS'] == 'ok'}
+
+    def append(self, row):
+        with open(self.path, 'a', newline='') as file:
+            csv.writer(file).writerow(['' if row.get(column) is None else row.get(column) for column in RESULT_COLUMNS])
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def get_cell_key(cell):
+    """
+    Key of a cell, equal for the cell and its row read back from the result store
+    """
+    seed = '' if cell['SEED'] is None else str(cell['SEED'])
+    return (cell['INSTANCE'], cell['PATH'], str(cell['INSTANCE_INDEX']), str(float(cell['H'])), cell['PARAMETERS'], seed)
+
+
+class BatchRunner:
+    def __init__(self, grid, base_parameters, parameters):
+        """
+        Runs of the grid of instances x h_factors x heuristic_parameters x seeds: every
+        instance of the files in grid['instances'] (CSV, OR-Library or binary, see
+        instance_io) with due date floor(h * sum(p)) for each h, each dict of heuristic
+        parameters (overriding base_parameters['heuristic_parameters']) and each seed.
+        base_parameters holds the other ProblemManager arguments of all runs.
+
+        The cells are run in a process pool of max_workers processes (in this process if 1)
+        and each result row (objectives, stage times and evaluation counts, see
+        ProblemManager.run) is appended to the result store at results_path as soon as its
+        cell ends. Cells already in the store with status ok are skipped, so a stopped batch
+        is continued by running it again; failed and interrupted cells are run again.
+        """
+        self.instance_paths = grid['instances']
+        self.h_factors = grid.get('h_factors', [0.2, 0.4, 0.6, 0.8])
+        self.heuristic_parameters = grid.get('heuristic_parameters', [{}])
+        self.seeds = grid.get('seeds', [None])
+        self.base_parameters = base_parameters
+        self.max_workers = parameters.get('max_workers')
+        self.result_store = ResultStore(parameters.get('results_path', 'outputs/batch_results.csv'))
+        if base_parameters.get('checkpoint_parameters') is not None:
+            raise Exception('Error: Checkpoints can not be used in batch runs')
+
+    def get_cells(self):
+        """
+        Yield the cells of the grid, loading one instance at a time
+        """
+        for path in self.instance_paths:
+            for instance, (instance_name, tasks_df) in enumerate(iter_instances([path])):
+                total_p = int(tasks_df['p'].sum())
+                for h in self.h_factors:
+                    for heuristic_parameters in self.heuristic_parameters:
+                        for seed in self.seeds:
+                            yield {
+                                'INSTANCE': instance_name,
+                                'PATH': path,
+                                'INSTANCE_INDEX': instance,
+                                'N': len(tasks_df),
+                                'H': h,
+                                'DUE_DATE': math.floor(h * total_p),
+                                'PARAMETERS': json.dumps(heuristic_parameters, sort_keys=True),
+                                'SEED': seed
+                            }
+
+    def run(self):
+        """
+        Run the cells not completed yet, return the number of cells run
+        """
+        completed = self.result_store.get_completed()
+        cells = [cell for cell in self.get_cells() if get_cell_key(cell) not in completed]
+        print(f'Batch: {len(cells)} cells to run ({len(completed)} completed)')
+        begin = time.time()
+        if self.max_workers == 1:
+            for idx, cell in enumerate(cells):
+                self.store_result(run_cell(cell, self.base_parameters), idx + 1, len(cells), begin)
+            return len(cells)
+
+        executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = [executor.submit(run_cell, cell, self.base_parameters) for cell in cells]
+            for idx, future in enumerate(as_completed(futures)):
+                self.store_result(future.result(), idx + 1, len(cells), begin)
+        except KeyboardInterrupt:
+            print('Batch interrupted, completed cells are in the result store')
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        return len(cells)
+
+    def store_result(self, row, done, total, begin):
+        self.result_store.append(row)
+        print(f"Batch: {done}/{total} | {row['INSTANCE']} h={row['H']} seed={row['SEED']} | {row['STATUS']} {row.get('OBJ', '')} | {round(time.time() - begin, 1)} secs")
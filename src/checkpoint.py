@@ -0,0 +1,57 @@
+import json
+import os
+import numpy as np
+
+CHECKPOINT_MAGIC = b'ETCKPT01'
+
+
+def write_checkpoint(path, state, **arrays):
+    """
+    Write state (a JSON serializable dict of scalars, like RNG states and counters) and the
+    NumPy arrays to path as one binary file: magic, header length, JSON header (state and
+    name, dtype and shape of each array) and the raw bytes of the arrays. The file is
+    written next to path and renamed over it, so a process dying while writing leaves the
+    previous checkpoint intact.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header = {
+        'state': state,
+        'arrays': [[name, array.dtype.str, list(array.shape)] for name, array in arrays.items()]
+    }
+    header_bytes = json.dumps(header).encode()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(CHECKPOINT_MAGIC)
+        file.write(len(header_bytes).to_bytes(8, 'little'))
+        file.write(header_bytes)
+        for array in arrays.values():
+            file.write(array.tobytes())
+    os.replace(temporary_path, path)
+
+
+def read_checkpoint(path):
+    """
+    Return tuple (state, arrays) of the checkpoint written to path by write_checkpoint
+    """
+    if not os.path.isfile(path):
+        raise Exception(f'Error: Checkpoint {path} not found')
+    with open(path, 'rb') as file:
+        content = file.read()
+    if content[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise Exception(f'Error: {path} is not a checkpoint')
+
+    header_begin = len(CHECKPOINT_MAGIC) + 8
+    header_end = header_begin + int.from_bytes(content[len(CHECKPOINT_MAGIC):header_begin], 'little')
+    header = json.loads(content[header_begin:header_end].decode())
+    arrays = {}
+    offset = header_end
+    for name, dtype, shape in header['arrays']:
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays[name] = np.frombuffer(content, dtype=dtype, count=size // dtype.itemsize, offset=offset).reshape(shape).copy()
+        offset += size
+    return header['state'], arrays
@@ -1,78 +1,137 @@
+from bisect import bisect_left, bisect_right
 import numpy as np
 class ConstructiveHeuristicFactory:
     def __init__(self,  task_df, due_date) -> None:
         """
-        This class implements and adaptation of the constructive heurisc: 
+        This class implements and adaptation of the constructive heurisc:
         "Decision Theory for Earliness and Tardiness", published by V. Sridharan and Z. Zhou in 1996
+
+        Every C_k = max(due_date, t0 + p_k, C_j_chapeu + (P - p_k)/2 + p_k) used by the cost
+        kappa is at least the due date, so kappa only sums beta_k * (C_k - due_date) and is
+        non-decreasing in C_j_chapeu: the next task is the one with the lowest C_j_chapeu (lowest
+        task_id on ties), and other tasks tie with it only when C_j_chapeu does not bind any C_k
+        (flat part of kappa). Inside each group of tasks (alpha >= beta and alpha < beta),
+        C_j_chapeu is non-decreasing in p_j, so each step only needs binary searches over the
+        tasks sorted by p and minimum task_id queries over the remaining ones.
         """
         self.due_date = due_date
 
         # Tasks information
         self.tasks = task_df['task_id']
         self.task_parameters = task_df.to_dict()
-        
-        # Control list 
-        self.missing_tasks_to_be_scheduled = set(self.tasks)
 
-        # Task_df 
+        # Running aggregates of the remaining tasks
+        self.remaining_P = float(task_df['p'].sum())
+        self.remaining_count = len(task_df)
+
+        # Groups of tasks sorted by (p, task_id): C_j_chapeu = due_date before due date if alpha >= beta,
+        # and is shifted towards the due date if alpha < beta
+        self.groups = []
+        for group_filter in [task_df['alpha'] >= task_df['beta'], task_df['alpha'] < task_df['beta']]:
+            group_df = task_df[group_filter].sort_values(by=['p', 'task_id'])
+            self.groups.append({
+                'p': group_df['p'].astype(float).to_list(),
+                'task_id': group_df['task_id'].to_list(),
+                'remaining': _SegmentTree(group_df['task_id'].to_list(), min, np.inf),
+                'first': _SegmentTree(list(range(len(group_df))), min, np.inf),
+                'position': {task: idx for idx, task in enumerate(group_df['task_id'])}
+            })
+
+        # Remaining tasks with tardiness cost sorted by p (used to check the flat part of kappa)
+        cost_df = task_df[task_df['beta'] > 0].sort_values(by=['p', 'task_id'])
+        self.cost_p = cost_df['p'].astype(float).to_list()
+        self.cost_position = {task: idx for idx, task in enumerate(cost_df['task_id'])}
+        self.cost_first = _SegmentTree(list(range(len(cost_df))), min, np.inf)
+        self.cost_last = _SegmentTree(list(range(len(cost_df))), max, -np.inf)
+
+        # Task_df
         self.task_df = task_df
-        
-    def calculate_task_cost_and_time(self, task, t0):
-        """ 
-        Return tuple (task_cost, task_completion_time)
+
+    def calculate_shifted_completion(self, t0):
+        """
+        Return the completion time C_shifted of tasks with alpha < beta completed before due date
+        """
+        if self.remaining_count <= 1:
+            return -np.inf
+
+        # Averages of missing tasks duration and completion time
+        P = self.remaining_P
+        R = t0 * self.remaining_count
+        P_barra = P / (self.remaining_count - 1)
+        R_barra = R / (self.remaining_count - 1)
+
+        # Calculating C
+        C_barra = self.due_date + R_barra + (P - P_barra)/2 + P_barra
+        return self.due_date - (C_barra - self.due_date)
+
+    def calculate_task_completion(self, group_idx, p, t0, C_shifted):
+        """
+        Return C_j_chapeu of a task of the given group and duration
         """
-        C_earliest = t0 + self.task_parameters['p'][task]
-        
+        C_earliest = t0 + p
         if C_earliest >= self.due_date:
-            C_j_chapeu = C_earliest
-        else:
-            C_star = max(C_earliest, self.due_date)
+            return C_earliest
+        elif group_idx == 0:
+            return self.due_date
+        return max(C_earliest, C_shifted)
 
-            if self.task_parameters['alpha'][task] >= self.task_parameters['beta'][task]:
-                C_j_chapeu = C_star
+    def is_flat(self, C, t0):
+        """
+        Check if C_j_chapeu = C does not bind C_k for any remaining task with beta > 0. The
+        binding term grows with p_k before the due date and decreases after it, so only
+        the tasks closest to it need to be checked.
+        """
+        split = bisect_right(self.cost_p, self.due_date, key=lambda p: t0 + p)
+        for k in [self.cost_last.query(0, split), self.cost_first.query(split, len(self.cost_p))]:
+            if np.isfinite(k):
+                p_k = self.cost_p[k]
+                if C + (self.remaining_P - p_k)/2 + p_k > max(self.due_date, t0 + p_k):
+                    return False
+        return True
+
+    def select_task(self, t0):
+        """
+        Return tuple (task, C_j_chapeu) with the lowest cost kappa
+        """
+        C_shifted = self.calculate_shifted_completion(t0)
+
+        def completion(group_idx):
+            return lambda p: self.calculate_task_completion(group_idx, p, t0, C_shifted)
+
+        # Lowest C_j_chapeu of each group is its remaining task with lowest p
+        C_min = np.inf
+        for group_idx, group in enumerate(self.groups):
+            first = group['first'].query(0, len(group['p']))
+            if np.isfinite(first):
+                p = group['p'][first]
+                C_min = min(C_min, self.calculate_task_completion(group_idx, p, t0, C_shifted))
+
+        # Tasks that tie with the lowest cost
+        flat = self.is_flat(C_min, t0)
+        task, task_completion = None, None
+        for group_idx, group in enumerate(self.groups):
+            if flat:
+                n_ties = bisect_left(group['p'], True, key=lambda p: not self.is_flat(completion(group_idx)(p), t0))
             else:
+                n_ties = bisect_right(group['p'], C_min, key=completion(group_idx))
+            group_task = group['remaining'].query(0, n_ties)
+            if np.isfinite(group_task) and ((task is None) or (group_task < task)):
+                task = int(group_task)
+                task_completion = completion(group_idx)(group['p'][group['position'][task]])
+
+        return task, task_completion
+
+    def remove_task(self, task):
+        for group in self.groups:
+            if task in group['position']:
+                group['remaining'].update(group['position'][task], np.inf)
+                group['first'].update(group['position'][task], np.inf)
+        if task in self.cost_position:
+            self.cost_first.update(self.cost_position[task], np.inf)
+            self.cost_last.update(self.cost_position[task], -np.inf)
+        self.remaining_P -= self.task_parameters['p'][task]
+        self.remaining_count -= 1
 
-                # Sum missing tasks duration
-                filter_missing_tasks = self.task_df['task_id'].isin(self.missing_tasks_to_be_scheduled)
-                P = self.task_df[filter_missing_tasks]['p'].sum()
-
-                # Sum missing tasks completion time
-                R = t0 * len(self.task_df[filter_missing_tasks])
-
-                # Calculating averages
-                P_barra = P / (len(self.task_df[filter_missing_tasks]) - 1)
-                R_barra = R / (len(self.task_df[filter_missing_tasks]) - 1)
-
-                # Calculating C
-                C_barra = C_star + R_barra + (P - P_barra)/2 + P_barra
-                C_shifted = max(C_earliest, (C_star - (C_barra - self.due_date)))
-
-                C_j_chapeu = C_shifted
-
-        # Calculating C_k
-        C_k = dict()
-        filter_missing_tasks = self.task_df['task_id'].isin(self.missing_tasks_to_be_scheduled)
-        P = self.task_df[filter_missing_tasks]['p'].sum()
-        for k in self.missing_tasks_to_be_scheduled:
-            elements_max = [
-                self.due_date,
-                t0 + self.task_parameters['p'][k],
-                C_j_chapeu + (P - self.task_parameters['p'][k]) / 2 + self.task_parameters['p'][k] 
-            ]
-            C_k[k] = np.max(elements_max)
-        
-        # Calculating Kappa
-        kappa = 0
-        for k in self.missing_tasks_to_be_scheduled:
-            current_kappa = max(0, self.task_parameters['alpha'][k] * (self.due_date - C_k[k])) + \
-                            max(0, self.task_parameters['beta'][k] * (C_k[k] - self.due_date))
-
-            kappa += current_kappa
-
-        
-        return (kappa, C_j_chapeu)
-
-        
     def run(self):
         # Initialize fobj and initial_time
         f = 0
@@ -82,36 +141,53 @@ class ConstructiveHeuristicFactory:
         completion_time = 0
 
         for _ in range(len(self.tasks)):
-            
-            task_cost = dict()
-            task_completion_time = dict()
-            arg_min = None
-            t0 = completion_time
-
-            for j in self.missing_tasks_to_be_scheduled:
-                # Calculate task cost
-                task_cost[j], task_completion_time[j]  = self.calculate_task_cost_and_time(j, completion_time)
-                
-                # if argmin is none initialize it
-                if arg_min == None:
-                    arg_min = j
-                # if new cost is lower than current lowest update it
-                else:
-                    if task_cost[j] < task_cost[arg_min]:
-                        arg_min = j
-            
-            # Update sequence 
-            sequence_output.append(arg_min)
-            self.missing_tasks_to_be_scheduled.remove(arg_min)
-            
-            # Update completion_time
-            completion_time = task_completion_time[arg_min]
-            
+
+            task, completion_time = self.select_task(completion_time)
+
+            # Update sequence
+            sequence_output.append(task)
+            self.remove_task(task)
+
             # Add new task cost to fobj
-            f = f + self.task_parameters['alpha'][arg_min] * max(0, self.due_date - completion_time) + \
-                    self.task_parameters['beta'][arg_min] * max(0, completion_time - self.due_date)
-            
+            f = f + self.task_parameters['alpha'][task] * max(0, self.due_date - completion_time) + \
+                    self.task_parameters['beta'][task] * max(0, completion_time - self.due_date)
+
         return sequence_output, completion_time, f
 
 
-           
+class _SegmentTree:
+    def __init__(self, values, operation, identity) -> None:
+        """
+        Array supporting point updates and range queries of an associative operation (min/max)
+        """
+        self.size = len(values)
+        self.operation = operation
+        self.identity = identity
+        self.tree = [identity] * self.size + list(values)
+        for idx in range(self.size - 1, 0, -1):
+            self.tree[idx] = operation(self.tree[2 * idx], self.tree[2 * idx + 1])
+
+    def update(self, idx, value):
+        idx += self.size
+        self.tree[idx] = value
+        while idx > 1:
+            idx //= 2
+            self.tree[idx] = self.operation(self.tree[2 * idx], self.tree[2 * idx + 1])
+
+    def query(self, begin, end):
+        """
+        Return the operation over values[begin:end]
+        """
+        result = self.identity
+        begin += self.size
+        end += self.size
+        while begin < end:
+            if begin % 2:
+                result = self.operation(result, self.tree[begin])
+                begin += 1
+            if end % 2:
+                end -= 1
+                result = self.operation(result, self.tree[end])
+            begin //= 2
+            end //= 2
+        return result
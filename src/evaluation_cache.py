@@ -0,0 +1,69 @@
+from collections import OrderedDict
+import numpy as np
+
+HASH_MASK = (1 << 64) - 1
+
+
+class PermutationHash:
+    def __init__(self, n_positions, n_tasks, seed=0):
+        """
+        Zobrist-style hash of a permutation: sum over positions of task_key[task] * position_key[position]
+        modulo 2**64. A move only changes the terms of the positions it touches, so the
+        hash of the moved permutation is updated from the changed positions only.
+        """
+        rng = np.random.default_rng(seed)
+        self.task_key = rng.integers(0, np.iinfo(np.uint64).max, size=n_tasks, dtype=np.uint64, endpoint=True)
+        self.position_key = rng.integers(0, np.iinfo(np.uint64).max, size=n_positions, dtype=np.uint64, endpoint=True)
+        self.task_key_values = [int(key) for key in self.task_key]
+        self.position_key_values = [int(key) for key in self.position_key]
+
+    def hash(self, solution):
+        return self.segment_hash(solution, 0)
+
+    def segment_hash(self, segment, begin):
+        """
+        Return the hash terms of the tasks of segment placed from position begin
+        """
+        # uint64 products and sum wrap modulo 2**64
+        return int((self.task_key[segment] * self.position_key[begin:begin + len(segment)]).sum())
+
+    def update_swap(self, solution_hash, solution, position_1, position_2):
+        """
+        Return the hash after swapping positions position_1 and position_2 (solution is already swapped)
+        """
+        task_key, position_key = self.task_key_values, self.position_key_values
+        delta = (task_key[solution[position_1]] - task_key[solution[position_2]]) * (position_key[position_1] - position_key[position_2])
+        return (solution_hash + delta) & HASH_MASK
+
+    def update_segment(self, solution_hash, begin, old_segment, new_segment):
+        """
+        Return the hash after replacing old_segment by new_segment from position begin
+        """
+        return (solution_hash - self.segment_hash(old_segment, begin) + self.segment_hash(new_segment, begin)) & HASH_MASK
+
+
+class EvaluationCache:
+    def __init__(self, max_size):
+        """
+        Objective function values of evaluated permutations by hash, with least recently used
+        eviction once max_size entries are stored
+        """
+        self.max_size = max_size
+        self.values = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.values.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.values[key] = value
+        self.values.move_to_end(key)
+        if len(self.values) > self.max_size:
+            self.values.popitem(last=False)
@@ -0,0 +1,495 @@
+import time
+import numpy as np
+import pandas as pd
+from .sequence_evaluator import SequenceEvaluator
+from .v_shape_search import get_v_shape_orders, v_shape_repair
+from .constructive_heuristic import ConstructiveHeuristicFactory
+from .instrumentation import instrumentation
+
+
+class ExactSolver:
+    def __init__(self, task_df, due_date, exact_parameters=None, initial_solution=None):
+        """
+        Exact solver without external solvers. Some optimal schedule is V-shaped (early tasks by
+        non-increasing p/alpha, tardy tasks by non-decreasing p/beta) and either
+        (a) its early tasks finish at the due date (early processing time <= due date), or
+        (b) it starts at time 0 and a straddling task s starts before and finishes after the
+            due date, with idle time delta = due_date - early processing time in [0, p_s).
+        For a partition, the cost is then a sum of linear terms per task plus pairwise terms
+        between tasks on the same side: min(alpha_i * p_j, alpha_j * p_i) for two early tasks
+        and min(beta_i * p_j, beta_j * p_i) for two tardy tasks.
+
+        If the p/alpha and p/beta orders agree (p and the due date are integer), a single order
+        places every task next to the tasks already placed on its side, and a dynamic
+        programming over the early processing time solves case (a), and case (b) for each
+        straddling task, in O(n * due_date) each. Otherwise, each side is solved by the same
+        dynamic programming in its own order, in the lagrangian relaxation of the partition
+        that lets tasks be used on both sides or on none at the cost of their multipliers
+        (root_iterations subgradient steps at the root, node_iterations at the other nodes of
+        a depth-first branch-and-bound that fixes tasks early or tardy). The relaxations also
+        give heuristic solutions. The initial solution (constructive heuristic by default)
+        after V-shape repair is the first incumbent, which is returned with optimal False if
+        node_limit, time_limit or a KeyboardInterrupt stops the search.
+        """
+        exact_parameters = exact_parameters or {}
+        self.task_df = task_df
+        self.due_date = due_date
+        self.initial_solution = initial_solution
+        self.node_limit = exact_parameters.get('node_limit')
+        self.time_limit = exact_parameters.get('time_limit')
+        self.root_iterations = exact_parameters.get('root_iterations', 300)
+        self.node_iterations = exact_parameters.get('node_iterations', 30)
+        self.sequence_evaluator = SequenceEvaluator(task_df, due_date)
+
+        # Tasks data by position in task_df
+        self.task_ids = task_df['task_id'].to_numpy(dtype=np.int64)
+        self.p = task_df['p'].to_numpy(dtype=np.float64)
+        self.alpha = task_df['alpha'].to_numpy(dtype=np.float64)
+        self.beta = task_df['beta'].to_numpy(dtype=np.float64)
+        self.early_order, self.tardy_order = get_v_shape_orders(task_df)
+
+        # Solution information
+        self.best_obj = np.inf
+        self.best_sequence = None
+        self.optimal = False
+        self.interrupted = False
+        self.nodes = 0
+        self.trace = {'OBJ': [], 'OPTIMAL': [], 'NODES': [], 'TIME': []}
+
+    def get_inner_order(self):
+        """
+        Return task positions sorted by non-decreasing p/alpha, ties by non-decreasing p/beta
+        """
+        early_ratio = np.divide(self.p, self.alpha, out=np.full(len(self.p), np.inf), where=self.alpha > 0)
+        tardy_ratio = np.divide(self.p, self.beta, out=np.full(len(self.p), np.inf), where=self.beta > 0)
+        return np.lexsort((tardy_ratio, early_ratio)), tardy_ratio
+
+    def is_agreeable(self):
+        """
+        Check if sorting by p/alpha (non-decreasing) also sorts by p/beta
+        """
+        inner_order, tardy_ratio = self.get_inner_order()
+        tardy_ratio = tardy_ratio[inner_order]
+        return bool(np.all(tardy_ratio[1:] >= tardy_ratio[:-1]))
+
+    def solve(self):
+        """
+        Return tuple (obj_function, sequence, optimal). optimal is False only if the node or
+        time limit, or an interrupt, stopped the branch-and-bound.
+        """
+        self.start_time = time.time()
+        if not (np.all(self.p == np.round(self.p)) and float(self.due_date).is_integer()):
+            raise Exception('Error: The exact solver needs integer processing times and due date')
+
+        # Heuristic incumbent (V-shape repair of the initial solution)
+        initial_solution = self.initial_solution
+        if initial_solution is None:
+            initial_solution, _, _ = ConstructiveHeuristicFactory(self.task_df, self.due_date).run()
+        self.best_obj, self.best_sequence = v_shape_repair(initial_solution, self.task_df, self.due_date)
+
+        try:
+            if self.is_agreeable():
+                self.solve_dynamic_programming()
+                self.optimal = True
+            else:
+                self.optimal = self.solve_branch_and_bound()
+        except KeyboardInterrupt:
+            # Incumbent kept, re-evaluated below since the interrupt may come between the updates of its objective and sequence
+            self.interrupted = True
+            self.optimal = False
+
+        # Final sequence with its optimal offset
+        self.best_obj, _, _ = self.sequence_evaluator.solve_offset(self.best_sequence)
+        self.trace['OBJ'].append(self.best_obj)
+        self.trace['OPTIMAL'].append(self.optimal)
+        self.trace['NODES'].append(self.nodes)
+        self.trace['TIME'].append(time.time() - self.start_time)
+        return self.best_obj, list(self.best_sequence), self.optimal
+
+    def run(self):
+        obj_function, _, optimal = self.solve()
+        instrumentation.emit('exact_summary', obj=obj_function, optimal=optimal, nodes=self.nodes, interrupted=self.interrupted)
+        return (obj_function, self.get_solution_df())
+
+    def get_trace(self):
+        return pd.DataFrame(self.trace)
+
+    def get_solution_df(self):
+        return pd.DataFrame({'task_id': self.best_sequence}).merge(self.task_df, on='task_id')
+
+    def build_sequence(self, is_early, straddler=None):
+        """
+        V-shaped sequence of a partition (straddling task between early and tardy tasks)
+        """
+        is_tardy = ~is_early
+        if straddler is not None:
+            is_tardy = is_tardy.copy()
+            is_tardy[straddler] = False
+        early = self.early_order[is_early[self.early_order]]
+        tardy = self.tardy_order[is_tardy[self.tardy_order]]
+        middle = [] if straddler is None else [straddler]
+        return self.task_ids[np.concatenate([early, middle, tardy]).astype(np.int64)].tolist()
+
+    def update_incumbent(self, obj_function, is_early, straddler=None):
+        if obj_function < self.best_obj - 1e-9:
+            self.best_obj = obj_function
+            self.best_sequence = self.build_sequence(is_early, straddler)
+
+    # Dynamic programming (agreeable ratios)
+    def solve_dynamic_programming(self):
+        capacity = int(min(self.due_date, self.p.sum()))
+        # Tasks closest to the due date first (non-decreasing ratios)
+        inner_order, _ = self.get_inner_order()
+
+        # Case (a): early tasks finish at the due date
+        costs, choices = self.run_dynamic_programming(inner_order, capacity)
+        early_sum = int(np.argmin(costs))
+        self.update_incumbent(costs[early_sum], self.trace_back(inner_order, choices, early_sum))
+
+        # Case (b): schedule starts at 0 with straddling task s, tasks placed from the edges
+        outer_order = inner_order[::-1]
+        for straddler in range(len(self.p)):
+            order = outer_order[outer_order != straddler]
+            costs, choices = self.run_dynamic_programming(order, capacity, straddler)
+            early_sum = int(np.argmin(costs))
+            if np.isfinite(costs[early_sum]):
+                self.update_incumbent(costs[early_sum], self.trace_back(order, choices, early_sum), straddler)
+
+    def run_dynamic_programming(self, order, capacity, straddler=None):
+        """
+        Return the minimum cost by early processing time E in [0, capacity] and the choices
+        (True if early) of each task of order. Without straddler, tasks are placed from the
+        due date outwards; with straddler, from the schedule edges (0 and the makespan) inwards.
+        """
+        early_sum = np.arange(capacity + 1, dtype=np.float64)
+        costs = np.full(capacity + 1, np.inf)
+        costs[0] = 0
+        choices = np.zeros((len(order), capacity + 1), dtype=bool)
+        makespan = self.p.sum()
+        placed_p = 0.0
+
+        for idx, task in enumerate(order):
+            p, alpha, beta = self.p[task], self.alpha[task], self.beta[task]
+            task_p = int(p)
+            if straddler is None:
+                early_cost = alpha * early_sum
+                tardy_cost = beta * (placed_p - early_sum + p)
+            else:
+                early_cost = alpha * (self.due_date - early_sum - p)
+                tardy_cost = beta * (makespan - placed_p + early_sum - self.due_date)
+
+            new_costs = costs + tardy_cost
+            if task_p <= capacity:
+                early_costs = np.full(capacity + 1, np.inf)
+                early_costs[task_p:] = (costs + early_cost)[:capacity + 1 - task_p]
+                choices[idx] = early_costs < new_costs
+                new_costs = np.minimum(new_costs, early_costs)
+            costs = new_costs
+            placed_p += p
+
+        if straddler is not None:
+            # Straddling task covers the due date: E in (due_date - p_s, due_date]
+            p_s, beta_s = self.p[straddler], self.beta[straddler]
+            costs = costs + beta_s * (early_sum + p_s - self.due_date)
+            costs[early_sum <= self.due_date - p_s] = np.inf
+        return costs, choices
+
+    def trace_back(self, order, choices, early_sum):
+        is_early = np.zeros(len(self.p), dtype=bool)
+        for idx in range(len(order) - 1, -1, -1):
+            if choices[idx, early_sum]:
+                is_early[order[idx]] = True
+                early_sum -= int(self.p[order[idx]])
+        return is_early
+
+    # Branch-and-bound (general ratios)
+    def solve_branch_and_bound(self) -> bool:
+        """
+        Return True if the search was not stopped by a limit. A node fixes some tasks early or
+        tardy and is bounded by the lagrangian relaxation of the partition (see
+        solve_relaxation), with the multipliers of its parent as starting point. It branches on
+        the free task of highest cost that the relaxation does not use exactly once.
+        """
+        self.initialize_relaxation()
+        try:
+            self.branch(np.zeros(len(self.p)), self.root_iterations)
+        except _SearchLimitReached:
+            return False
+        return True
+
+    def initialize_relaxation(self):
+        n = len(self.p)
+        self.fixed_early = np.zeros(n, dtype=bool)
+        self.fixed_tardy = np.zeros(n, dtype=bool)
+        self.integer_costs = bool(np.all(self.alpha == np.round(self.alpha)) and np.all(self.beta == np.round(self.beta)))
+
+    def solve_root_relaxation(self, upper_bound, iterations):
+        """
+        Return the lower bound of the lagrangian relaxation of the partition without fixed
+        tasks (the root of the branch-and-bound), after at most iterations subgradient steps
+        towards upper_bound (or towards the better solutions the relaxations give)
+        """
+        if not (np.all(self.p == np.round(self.p)) and float(self.due_date).is_integer()):
+            raise Exception('Error: The exact solver needs integer processing times and due date')
+        self.start_time = time.time()
+        self.initialize_relaxation()
+        self.best_obj = upper_bound
+        bound, _, _, _ = self.optimize_multipliers(np.zeros(len(self.p)), iterations)
+        # With integer costs, the optimum is an integer at least the bound
+        return float(np.ceil(bound - 1e-6)) if self.integer_costs else float(bound)
+
+    def is_pruned(self, bound) -> bool:
+        # With integer costs, a better solution is at least 1 below the incumbent
+        if self.integer_costs:
+            return bound > self.best_obj - 1 + 1e-6
+        return bound >= self.best_obj - 1e-9
+
+    def check_limits(self):
+        if (self.node_limit is not None) and (self.nodes > self.node_limit):
+            raise _SearchLimitReached()
+        if (self.time_limit is not None) and (time.time() - self.start_time > self.time_limit):
+            raise _SearchLimitReached()
+
+    def branch(self, multipliers, iterations):
+        self.nodes += 1
+        self.check_limits()
+        bound, multipliers, counts, is_early = self.optimize_multipliers(multipliers, iterations)
+        if self.is_pruned(bound):
+            return
+
+        free = ~(self.fixed_early | self.fixed_tardy)
+        if not free.any():
+            self.evaluate_partition(self.fixed_early.copy())
+            return
+        candidates = np.flatnonzero(free & (counts != 1))
+        if len(candidates) == 0:
+            candidates = np.flatnonzero(free)
+        task = candidates[np.argmax(self.p[candidates] * (self.alpha[candidates] + self.beta[candidates]))]
+
+        # Side of the task in the relaxation first
+        for early in ([True, False] if is_early[task] else [False, True]):
+            fixed = self.fixed_early if early else self.fixed_tardy
+            fixed[task] = True
+            self.branch(multipliers, self.node_iterations)
+            fixed[task] = False
+
+    def optimize_multipliers(self, multipliers, iterations):
+        """
+        Subgradient steps towards the incumbent objective (step halved after 10 steps without
+        improvement), stopped when the node is pruned or its relaxation is a partition. Return
+        tuple (bound, multipliers, counts, is_early) of the best multipliers, where counts is
+        the number of times each task is used in the relaxation and is_early its early tasks.
+        """
+        best = (-np.inf, multipliers, None, None)
+        step_scale = 1.0
+        steps_without_improvement = 0
+        for _ in range(iterations):
+            self.check_limits()
+            bound, counts, is_early, straddler = self.solve_relaxation(multipliers)
+            self.evaluate_relaxation(is_early, straddler)
+            if bound > best[0] + 1e-9:
+                best = (bound, multipliers, counts, is_early)
+                steps_without_improvement = 0
+            else:
+                steps_without_improvement += 1
+                if steps_without_improvement >= 10:
+                    step_scale /= 2
+                    steps_without_improvement = 0
+
+            subgradient = 1.0 - counts
+            if self.is_pruned(best[0]) or not subgradient.any():
+                break
+            step = step_scale * max(self.best_obj - bound, 1e-9) / (subgradient @ subgradient)
+            multipliers = multipliers + step * subgradient
+        return best
+
+    def solve_relaxation(self, multipliers):
+        """
+        Lagrangian relaxation of the partition, where each task can be used on both sides (or
+        none) at the cost of its multiplier: the early tasks of case (a), ending at the due date,
+        or of case (b), from time 0 and followed by a straddling task, and then the tardy tasks
+        are chosen by dynamic programming over their processing time, each side in its V-shape
+        order. Fixed tasks are kept off the other side, and early ones are always taken. Return
+        tuple (bound, counts, is_early, straddler) of the best choice.
+        """
+        p, alpha, beta = self.p, self.alpha, self.beta
+        due_date = int(min(self.due_date, self.p.sum()))
+        allowed_early, allowed_tardy = ~self.fixed_tardy, ~self.fixed_early
+        no_task = np.zeros(len(p), dtype=bool)
+
+        # Case (a): early tasks from the due date outwards, tardy tasks start at offset 0
+        early_costs = np.full(due_date + 1, np.inf)
+        early_costs[0] = 0
+        inner_order = self.early_order[::-1]
+        early_costs, early_choices = self.run_side_dynamic_programming(
+            inner_order, early_costs, alpha, np.zeros(len(p)), multipliers, allowed_early, self.fixed_early
+        )
+        tardy_costs = np.full(int(p.sum() + p.max()) + 1, np.inf)
+        tardy_costs[0] = early_costs.min()
+        straddlers = np.full(len(tardy_costs), -1)
+
+        # Case (b): early tasks from time 0, straddler ending at offset in [1, p_s] after the due date
+        if self.due_date < self.p.sum():
+            straddler_costs = np.full(due_date + 1, np.inf)
+            straddler_costs[0] = 0
+            straddler_costs, straddler_choices = self.run_side_dynamic_programming(
+                self.early_order, straddler_costs, -alpha, alpha * (due_date - p), multipliers, allowed_early, self.fixed_early
+            )
+            for straddler in np.flatnonzero(allowed_tardy):
+                task_p = int(p[straddler])
+                offsets = np.arange(max(1, task_p - due_date), task_p + 1)
+                costs = straddler_costs[due_date - task_p + offsets] + beta[straddler] * offsets - multipliers[straddler]
+                better = costs < tardy_costs[offsets]
+                tardy_costs[offsets[better]] = costs[better]
+                straddlers[offsets[better]] = straddler
+
+        # Tardy tasks from the end of the straddler (or the due date) onwards
+        tardy_costs, tardy_choices = self.run_side_dynamic_programming(
+            self.tardy_order, tardy_costs, beta, beta * p, multipliers, allowed_tardy, no_task
+        )
+        end_offset = int(np.argmin(tardy_costs))
+        bound = tardy_costs[end_offset] + multipliers.sum()
+        if not np.isfinite(bound):
+            return np.inf, np.ones(len(p)), self.fixed_early.copy(), None
+
+        is_tardy = self.trace_back(self.tardy_order, tardy_choices, end_offset)
+        start_offset = end_offset - int(p[is_tardy].sum())
+        straddler = None if start_offset == 0 else int(straddlers[start_offset])
+        if straddler is None:
+            is_early = self.trace_back(inner_order, early_choices, int(np.argmin(early_costs)))
+        else:
+            is_early = self.trace_back(self.early_order, straddler_choices, due_date - int(p[straddler]) + start_offset)
+        counts = is_early.astype(np.float64) + is_tardy
+        if straddler is not None:
+            counts[straddler] += 1
+        return bound, counts, is_early, straddler
+
+    def run_side_dynamic_programming(self, order, costs, slope, intercept, multipliers, allowed, forced):
+        """
+        Return the minimum cost by state (processing time placed on the side) and the choices
+        of the tasks of order: task j moves state x to x + p_j for slope_j * x + intercept_j
+        minus its multiplier, and is skipped if not allowed and always taken if forced
+        """
+        size = len(costs)
+        state = np.arange(size)
+        choices = np.zeros((len(order), size), dtype=bool)
+        for idx, task in enumerate(order):
+            if not allowed[task]:
+                continue
+            task_p = int(self.p[task])
+            taken = np.empty(size)
+            taken[:task_p] = np.inf
+            if task_p < size:
+                taken[task_p:] = (costs + slope[task] * state + (intercept[task] - multipliers[task]))[:size - task_p]
+            if forced[task]:
+                choices[idx] = True
+                costs = taken
+            else:
+                choices[idx] = taken < costs
+                costs = np.minimum(costs, taken)
+        return costs, choices
+
+    def evaluate_relaxation(self, is_early, straddler):
+        """
+        Heuristic solution of a relaxation: its early tasks, then its straddler (if not early)
+        and the other tasks in V-shape order
+        """
+        if (straddler is not None) and is_early[straddler]:
+            straddler = None
+        obj_function, _, _ = self.sequence_evaluator.solve_offset(self.build_sequence(is_early, straddler))
+        self.update_incumbent(obj_function, is_early.copy(), straddler)
+
+    def evaluate_partition(self, is_early):
+        """
+        Best schedule of a partition: V-shaped, with each tardy task tried as the straddler
+        """
+        self.evaluate_relaxation(is_early, None)
+        for straddler in np.flatnonzero(~is_early):
+            self.evaluate_relaxation(is_early, straddler)
+
+
+class WindowExactSolver:
+    def __init__(self, task_df, due_date):
+        """
+        Exact solver of the Fix and Optimize window sub-problem (see WindowProblemEvaluator) by
+        dynamic programming over subsets of the window tasks. For a fixed offset, the tasks of
+        a subset placed first in the block finish at block_begin + p(subset) + offset, so
+        the best order of every subset follows from the subsets with one task less. The
+        objective is piecewise linear in the offset for each order, so the optimal offset is
+        either one of its bounds or makes a window task finish at the due date; in the latter
+        case the tasks finishing before it are V-shaped around the due date.
+        """
+        self.task_df = task_df.set_index('task_id')
+        self.due_date = due_date
+
+    def solve_window(self, window_tasks, block_begin, offset_bounds, fixed_cost, fixed_slope, initial_offset=None, time_limit=None):
+        """
+        Return tuple (obj_function, offset, window_sequence) of the best order of window_tasks
+        (time_limit is accepted for compatibility with WindowProblemEvaluator, the windows
+        are small enough to be always solved)
+        """
+        window_df = self.task_df.loc[list(window_tasks)]
+        p = window_df['p'].to_numpy(dtype=np.float64)
+        alpha = window_df['alpha'].to_numpy(dtype=np.float64)
+        beta = window_df['beta'].to_numpy(dtype=np.float64)
+        n = len(p)
+        masks = np.arange(1 << n)
+        in_mask = (masks[:, None] >> np.arange(n)) & 1
+        mask_p = in_mask @ p
+
+        candidates = []
+
+        # Offset at its bounds: dynamic programming over subsets
+        for offset in sorted(set(offset_bounds)):
+            completion = block_begin + mask_p + offset
+            costs = np.full(1 << n, np.inf)
+            costs[0] = 0
+            last = np.zeros(1 << n, dtype=np.int64)
+            for size in range(1, n + 1):
+                layer = masks[in_mask.sum(axis=1) == size]
+                best_cost = np.full(len(layer), np.inf)
+                best_last = np.zeros(len(layer), dtype=np.int64)
+                for task in range(n):
+                    has_task = (layer >> task) & 1 == 1
+                    deviation = completion[layer] - self.due_date
+                    cost = costs[layer ^ (1 << task)] + np.where(deviation > 0, beta[task] * deviation, -alpha[task] * deviation)
+                    better = has_task & (cost < best_cost)
+                    best_cost[better] = cost[better]
+                    best_last[better] = task
+                costs[layer] = best_cost
+                last[layer] = best_last
+
+            order = []
+            mask = (1 << n) - 1
+            while mask:
+                order.append(int(last[mask]))
+                mask ^= 1 << int(last[mask])
+            candidates.append((costs[-1] + fixed_cost + fixed_slope * offset, offset, order[::-1]))
+
+        # A window task finishes at the due date: the tasks finishing until it (subset) and the
+        # others are V-shaped around it, with pairwise costs as in ExactSolver
+        offsets = self.due_date - block_begin - mask_p
+        feasible = (masks > 0) & (offsets > offset_bounds[0]) & (offsets < offset_bounds[1])
+        if np.any(feasible):
+            early_pair = np.triu(np.minimum(np.outer(alpha, p), np.outer(p, alpha)), 1)
+            tardy_pair = np.triu(np.minimum(np.outer(beta, p), np.outer(p, beta)), 1)
+            is_early = in_mask[feasible]
+            is_tardy = 1 - is_early
+            costs = (
+                ((is_early @ early_pair) * is_early).sum(axis=1)
+                + ((is_tardy @ tardy_pair) * is_tardy).sum(axis=1)
+                + is_tardy @ (beta * p)
+                + fixed_cost + fixed_slope * offsets[feasible]
+            )
+            best = int(np.argmin(costs))
+            early_order, tardy_order = get_v_shape_orders(window_df.reset_index())
+            early = early_order[is_early[best][early_order] == 1]
+            tardy = tardy_order[is_tardy[best][tardy_order] == 1]
+            candidates.append((costs[best], offsets[feasible][best], list(early) + list(tardy)))
+
+        obj_function, offset, order = min(candidates, key=lambda candidate: candidate[0])
+        return float(obj_function), float(offset), [window_tasks[k] for k in order]
+
+
+class _SearchLimitReached(Exception):
+    pass
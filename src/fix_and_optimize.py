@@ -1,88 +1,443 @@
+from concurrent.futures import ProcessPoolExecutor
+import math
+import time
 import numpy as np
-from .lp_problem import ProblemEvaluator
+from .lp_problem import ProblemEvaluator, WindowProblemEvaluator
+from .exact_solver import WindowExactSolver
+from .sequence_evaluator import SequenceEvaluator
+from .instrumentation import instrumentation
+from .time_budget import deadline_reached, time_left
+from .checkpoint import write_checkpoint, read_checkpoint
+from .solution_trace import SequenceDiffTrace
+from .lower_bounds import get_gap, gap_reached
 import pandas as pd
 
+# Window solver of each worker process, reused by every window solved in it (see initialize_worker)
+_worker_window_problem = None
+
+
+def initialize_worker(task_df, due_date, subproblem, solver_name, persistent_solver):
+    global _worker_window_problem
+    if subproblem == 'exact':
+        _worker_window_problem = WindowExactSolver(task_df, due_date)
+    else:
+        _worker_window_problem = WindowProblemEvaluator(task_df, due_date, solver_name, persistent_solver)
+
+
+def solve_window(subproblem, deadline=None):
+    """
+    Return the best order of the window tasks of subproblem in a worker process. With a
+    deadline, windows that waited in the pool queue get the time left when they start.
+    """
+    if deadline is not None:
+        subproblem = dict(subproblem, time_limit=min(subproblem['time_limit'], time_left(deadline)))
+    _, _, window_sequence = _worker_window_problem.solve_window(**subproblem)
+    return window_sequence
+
+
 class FixAndOptimize:
+    subproblem_types = {'window', 'exact', 'full'}
 
     def __init__(self, initial_solution_df, due_date, initial_obj, parameters):
+        """
+        Fix and Optimize over windows of window_size consecutive tasks. With subproblem 'window'
+        each window is solved as a MILP over its free tasks only (WindowProblemEvaluator),
+        with 'exact' the same sub-problem is solved without solver by dynamic programming over
+        subsets of the window tasks (WindowExactSolver, for small windows), and with 'full'
+        the free tasks are optimized in the MILP of all tasks with the others fixed by bounds.
+        The current sequence is given as MIP start to every window, and with persistent_solver
+        the models are loaded once in a persistent solver (solver_name 'gurobi' or 'highs')
+        that only receives the changed bounds and parameters.
+
+        With parallel, the windows (starting every window_jump tasks) are split in classes of
+        non-overlapping windows, e.g. even and odd windows when window_jump is half of
+        window_size. The windows of a class are solved concurrently in a process pool from
+        the same current sequence, and their new orders are merged before the next class.
+        Sweeps over all classes are repeated until one does not improve the solution (or
+        max_sweeps), since tasks only move across a few windows per sweep.
+
+        With a deadline (time.time(), see TimeBudget) no window starts after it, and every
+        window solve is limited to the time left (and to window_time_limit secs, if given),
+        keeping the best order found in time. On KeyboardInterrupt the current solution,
+        which only changes between windows, is returned.
+
+        With lower_bound (see LowerBounds) the trace reports the gap of each iteration, and
+        with gap_stop no window starts once the gap is at most gap_stop.
+
+        With checkpoint_path, the state of the run (window offset or sweep and window class,
+        current solution and trace) is saved every checkpoint_interval windows (window
+        classes, if parallel), and resume continues it from the next window.
+        """
         self.task_df = initial_solution_df.copy()
         self.current_solution_df = initial_solution_df      
         self.current_obj = initial_obj  
         self.due_date = due_date
 
-        self.milp_problem_evaluator = ProblemEvaluator(initial_solution_df, due_date, problem_type='MILP')
-
         # Algorithm control attributes
         self.window_size = parameters['window_size']
         self.window_jump = parameters['window_jump']
+        self.subproblem = parameters.get('subproblem', 'window')
+        if self.subproblem not in self.subproblem_types:
+            raise Exception(f'Error: Subproblem {self.subproblem} not implemented')
+        self.solver_name = parameters.get('solver_name', 'gurobi')
+        self.persistent_solver = parameters.get('persistent_solver', False)
+        self.parallel = parameters.get('parallel', False)
+        self.max_workers = parameters.get('max_workers')
+        self.max_sweeps = parameters.get('max_sweeps')
+        self.window_time_limit = parameters.get('window_time_limit')
+        self.deadline = parameters.get('deadline')
+        self.interrupted = False
+        self.checkpoint_path = parameters.get('checkpoint_path')
+        self.checkpoint_interval = parameters.get('checkpoint_interval', 1)
+        self.lower_bound = parameters.get('lower_bound')
+        self.gap_stop = parameters.get('gap_stop')
+        if self.parallel and (self.subproblem == 'full'):
+            raise Exception('Error: Parallel Fix and Optimize is only implemented for window subproblems')
+
+        if self.subproblem == 'full':
+            self.milp_problem_evaluator = ProblemEvaluator(
+                initial_solution_df, due_date, problem_type='MILP',
+                solver_name=self.solver_name, persistent_solver=self.persistent_solver
+            )
+        elif self.subproblem == 'exact':
+            self.window_problem_evaluator = WindowExactSolver(initial_solution_df, due_date)
+        else:
+            self.window_problem_evaluator = WindowProblemEvaluator(initial_solution_df, due_date, self.solver_name, self.persistent_solver)
+        self.sequence_evaluator = SequenceEvaluator(initial_solution_df, due_date)
         self.current_index_offset = 0
-        self.solution_trace_df = self.task_df[['task_id']].rename(columns={'task_id': 'solution_0'})
+        # Current solution of each iteration, stored as the positions changed by the iteration
+        self.solution_trace = SequenceDiffTrace(self.task_df['task_id'])
         self.solution_trace_obj = [initial_obj]
-        self.current_sol_trace = 1
 
-        print(f'Window size: {self.window_size} | Window jump {self.window_jump}')
+        instrumentation.emit('fo_start', subproblem=self.subproblem, window_size=self.window_size, window_jump=self.window_jump)
 
     def get_trace(self):
-        return pd.DataFrame({'Obj_function_trace':self.solution_trace_obj})
+        trace_df = pd.DataFrame({'Obj_function_trace':self.solution_trace_obj})
+        if self.lower_bound is not None:
+            trace_df['Gap'] = [get_gap(obj, self.lower_bound) for obj in self.solution_trace_obj]
+        return trace_df
+
+    def get_solution_trace(self):
+        """
+        Return the current solution of each iteration in long format (see SequenceDiffTrace)
+        """
+        return self.solution_trace.to_dataframe()
+
+    def update_solution_trace(self):
+        self.solution_trace_obj.append(self.current_obj)
+        self.solution_trace.append(self.current_solution_df['task_id'].to_numpy(dtype=np.int64))
 
     def run(self):
-        
+        if self.parallel:
+            return self.run_parallel()
+        return self.run_windows(0)
+
+    def resume(self, checkpoint_path):
+        """
+        Continue the run saved in checkpoint_path (see save_checkpoint) from the next window
+        """
+        state = self.load_checkpoint(checkpoint_path)
+        instrumentation.emit('fo_resume', iterations=len(self.solution_trace_obj) - 1, obj=self.current_obj)
+        if self.parallel:
+            return self.run_parallel(state['sweep'], state['window_class'], state['sweep_obj'])
+        return self.run_windows(state['iteration'])
+
+    def run_windows(self, it):
         # Initialize variable for stop criteria
-        stop = False
-        it = 0
+        stop = self.current_index_offset >= len(self.current_solution_df)
+
+        try:
+            while not stop:
+                if deadline_reached(self.deadline):
+                    instrumentation.emit('fo_stop', window_offset=self.current_index_offset, reason='time_budget', obj=self.current_obj)
+                    break
+                if gap_reached(self.current_obj, self.lower_bound, self.gap_stop):
+                    instrumentation.emit(
+                        'fo_stop', window_offset=self.current_index_offset, reason='gap', obj=self.current_obj,
+                        gap=round(get_gap(self.current_obj, self.lower_bound), 6)
+                    )
+                    break
 
-        while not stop:
+                # Fix from current index offset + window size
+                window_begin = self.current_index_offset
+                window_end = window_begin + self.window_size 
+                window_start_time = time.perf_counter()
+                previous_obj = self.current_obj
 
-            # Fix from current index offset + window size
-            window_begin = self.current_index_offset
-            window_end = window_begin + self.window_size 
+                # Solve model for current window
+                if self.subproblem == 'full':
+                    new_obj, new_solution_df = self.solve_full_window(window_begin, window_end)
+                else:
+                    new_obj, new_solution_df = self.solve_local_window(window_begin, window_end)
 
-            # Get Free and fixed tasks DF
-            self.current_solution_df['current_d'] = self.current_solution_df['p'].cumsum()
-            fixed_tasks = pd.concat([
-                self.current_solution_df[0:window_begin], 
-                self.current_solution_df[window_end:]
-            ])
+                # Update current solution
+                if (new_obj < self.current_obj):
+                    self.current_solution_df = new_solution_df
+                    self.current_obj = new_obj
 
-            # Free all tasks
-            self.milp_problem_evaluator.free_all_tasks()
+                # Update solution trace
+                self.update_solution_trace()
+                
+                # Update window offset
+                self.current_index_offset += self.window_jump
 
-            # Fix tasks of current window
-            for idx, row_to_fix in fixed_tasks.iterrows():
-                task_id = row_to_fix['task_id']
-                task_end = row_to_fix['current_d']
+                # Check for stop criteria
+                if (self.current_index_offset) >= len(self.current_solution_df):
+                    stop = True
+                else:
+                    it += 1
 
-                self.milp_problem_evaluator.fix_task(
-                    task_id=task_id,
-                    task_end=task_end
+                instrumentation.emit(
+                    'fo_window', iteration=it, window_begin=window_begin, window_end=min(window_end, len(self.current_solution_df)),
+                    obj=self.current_obj, improvement=previous_obj - self.current_obj, seconds=round(time.perf_counter() - window_start_time, 4)
                 )
+                if (self.checkpoint_path is not None) and (stop or ((len(self.solution_trace_obj) - 1) % self.checkpoint_interval == 0)):
+                    self.save_checkpoint(self.checkpoint_path, iteration=it)
+        except KeyboardInterrupt:
+            self.stop_by_interrupt()
             
-            # Solve model for current window
-            new_obj, new_offset = self.milp_problem_evaluator.solve_model()
-            new_solution_df = self.milp_problem_evaluator.get_solution_df()
-
-            # Update current solution
-            if (new_obj < self.current_obj):
-                self.current_solution_df = new_solution_df
-                self.current_obj = new_obj
-
-            # Update solution trace
-            self.solution_trace_obj.append(self.current_obj)
-            self.solution_trace_df['solution_' + str(int(self.current_sol_trace))] = list(self.current_solution_df['task_id'])
-            self.current_sol_trace += 1
-            
-            # Update window offset
-            self.current_index_offset += self.window_jump
+        self.emit_summary()
+        return self.current_obj, self.current_solution_df
 
-            # Check for stop criteria
-            if (self.current_index_offset) >= len(self.current_solution_df):
-                stop = True
-            else:
-                it += 1
+    def save_checkpoint(self, path, **counters):
+        """
+        Save the window offset, the loop counters, the current solution and the trace
+        """
+        state = {'current_index_offset': self.current_index_offset, 'current_obj': float(self.current_obj), **counters}
+        trace_arrays = self.solution_trace.get_arrays()
+        write_checkpoint(
+            path, state,
+            sequence=self.current_solution_df['task_id'].to_numpy(dtype=np.int64),
+            trace_obj=np.asarray(self.solution_trace_obj, dtype=np.float64),
+            **{'trace_' + name: array for name, array in trace_arrays.items()}
+        )
 
-            len_df = len(self.current_solution_df)
-            print(f'Iteration: {it} | Obj: {self.current_obj} | Index offset: {self.current_index_offset} | Lenght {len_df}')
-            
+    def load_checkpoint(self, path):
+        """
+        Restore the run saved in path, return the state with its loop counters
+        """
+        state, arrays = read_checkpoint(path)
+        if len(arrays['sequence']) != len(self.current_solution_df):
+            raise Exception('Error: Checkpoint solution does not match the instance')
+        self.current_index_offset = state['current_index_offset']
+        _, self.current_solution_df = self.get_solution_df(arrays['sequence'])
+        self.current_obj = state['current_obj']
+        self.solution_trace_obj = arrays['trace_obj'].tolist()
+        self.solution_trace.load_arrays(
+            {name[len('trace_'):]: array for name, array in arrays.items() if name.startswith('trace_') and (name != 'trace_obj')},
+            len(self.solution_trace_obj) - 1
+        )
+        return state
+
+    def stop_by_interrupt(self):
+        """
+        Keep the current solution at an interrupt, re-evaluated since the interrupt may come
+        between the updates of its objective and sequence
+        """
+        self.interrupted = True
+        self.current_obj, self.current_solution_df = self.get_solution_df(self.current_solution_df['task_id'].to_numpy(dtype=np.int64))
+        instrumentation.emit('fo_stop', reason='interrupt', obj=self.current_obj)
+
+    def get_window_time_limit(self):
+        """
+        Solver time limit of the next window (None if unlimited)
+        """
+        time_limits = [time_limit for time_limit in (self.window_time_limit, time_left(self.deadline)) if time_limit is not None]
+        return min(time_limits) if time_limits else None
+
+    def emit_summary(self):
+        """
+        Emit the 'fo_summary' event: total improvement and model build / solver wall times
+        """
+        evaluator = self.milp_problem_evaluator if self.subproblem == 'full' else self.window_problem_evaluator
+        timing = evaluator.get_timing() if hasattr(evaluator, 'get_timing') else {}
+        instrumentation.emit(
+            'fo_summary', subproblem=self.subproblem, iterations=len(self.solution_trace_obj) - 1, obj=self.current_obj,
+            improvement=self.solution_trace_obj[0] - self.current_obj, **timing
+        )
+
+    def run_parallel(self, sweep=0, first_class=0, sweep_obj=None):
+        n = len(self.current_solution_df)
+        windows = [(window_begin, min(window_begin + self.window_size, n)) for window_begin in range(0, n, self.window_jump)]
+        n_classes = math.ceil(self.window_size / self.window_jump)
+
+        try:
+            self.run_sweeps(windows, n_classes, sweep, first_class, sweep_obj)
+        except KeyboardInterrupt:
+            self.stop_by_interrupt()
+
+        self.emit_summary()
         return self.current_obj, self.current_solution_df
+
+    def run_sweeps(self, windows, n_classes, sweep, first_class, sweep_obj):
+        """
+        Run the sweeps from window class first_class of sweep (sweep_obj is the objective
+        at the beginning of the sweep, when resumed in the middle of it)
+        """
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            initializer=initialize_worker,
+            initargs=(self.task_df, self.due_date, self.subproblem, self.solver_name, self.persistent_solver)
+        ) as executor:
+            improved = True
+            while improved and ((self.max_sweeps is None) or (sweep < self.max_sweeps)):
+                if first_class == 0:
+                    sweep_obj = self.current_obj
+
+                for window_class in range(first_class, n_classes):
+                    if deadline_reached(self.deadline):
+                        instrumentation.emit('fo_stop', sweep=sweep, reason='time_budget', obj=self.current_obj)
+                        return
+                    if gap_reached(self.current_obj, self.lower_bound, self.gap_stop):
+                        instrumentation.emit('fo_stop', sweep=sweep, reason='gap', obj=self.current_obj, gap=round(get_gap(self.current_obj, self.lower_bound), 6))
+                        return
+                    class_start_time = time.perf_counter()
+                    previous_obj = self.current_obj
+                    class_windows = windows[window_class::n_classes]
+                    sequence = self.current_solution_df['task_id'].to_numpy(dtype=np.int64)
+
+                    # Solve windows of the class with the rest of the current sequence fixed
+                    futures = [
+                        executor.submit(solve_window, self.get_window_subproblem(sequence, window_begin, window_end), self.deadline)
+                        for window_begin, window_end in class_windows
+                    ]
+                    window_sequences = [future.result() for future in futures]
+
+                    # Merge window orders
+                    new_sequence = self.merge_windows(sequence, class_windows, window_sequences)
+                    new_obj, _, _ = self.sequence_evaluator.solve_offset(new_sequence)
+                    if new_obj < self.current_obj:
+                        self.current_obj, self.current_solution_df = self.get_solution_df(new_sequence)
+
+                    self.update_solution_trace()
+                    instrumentation.emit(
+                        'fo_window_class', sweep=sweep, window_class=window_class, windows=len(class_windows), obj=self.current_obj,
+                        improvement=previous_obj - self.current_obj, seconds=round(time.perf_counter() - class_start_time, 4)
+                    )
+                    if (self.checkpoint_path is not None) and ((len(self.solution_trace_obj) - 1) % self.checkpoint_interval == 0):
+                        self.save_checkpoint(self.checkpoint_path, sweep=sweep, window_class=window_class + 1, sweep_obj=float(sweep_obj))
+
+                first_class = 0
+                improved = self.current_obj < sweep_obj
+                sweep += 1
+
+    def merge_windows(self, sequence, windows, window_sequences):
+        """
+        Each window order is optimal with the others fixed, but the windows share the offset,
+        so the orders are applied from the best individual improvement on and only kept if
+        the objective of the merged sequence (closed form) improves.
+        """
+        candidates = []
+        for (window_begin, window_end), window_sequence in zip(windows, window_sequences):
+            candidate_sequence = sequence.copy()
+            candidate_sequence[window_begin:window_end] = window_sequence
+            candidate_obj, _, _ = self.sequence_evaluator.solve_offset(candidate_sequence)
+            if candidate_obj < self.current_obj:
+                candidates.append((candidate_obj, window_begin, window_end, window_sequence))
+
+        new_sequence = sequence.copy()
+        new_obj = self.current_obj
+        for _, window_begin, window_end, window_sequence in sorted(candidates, key=lambda candidate: candidate[0]):
+            candidate_sequence = new_sequence.copy()
+            candidate_sequence[window_begin:window_end] = window_sequence
+            candidate_obj, _, _ = self.sequence_evaluator.solve_offset(candidate_sequence)
+            if candidate_obj < new_obj:
+                new_sequence, new_obj = candidate_sequence, candidate_obj
+        return new_sequence
+
+    def solve_full_window(self, window_begin, window_end):
+        # Get Free and fixed tasks DF
+        self.current_solution_df['current_d'] = self.current_solution_df['p'].cumsum()
+        fixed_tasks = pd.concat([
+            self.current_solution_df[0:window_begin], 
+            self.current_solution_df[window_end:]
+        ])
+
+        # Free all tasks
+        self.milp_problem_evaluator.free_all_tasks()
+
+        # Fix tasks of current window
+        for idx, row_to_fix in fixed_tasks.iterrows():
+            task_id = row_to_fix['task_id']
+            task_end = row_to_fix['current_d']
+
+            self.milp_problem_evaluator.fix_task(
+                task_id=task_id,
+                task_end=task_end
+            )
+
+        # Current sequence as MIP start
+        sequence = self.current_solution_df['task_id'].to_list()
+        _, offset, _ = self.sequence_evaluator.solve_offset(sequence)
+        self.milp_problem_evaluator.set_warm_start(sequence, offset)
+
+        new_obj, new_offset = self.milp_problem_evaluator.solve_model(warm_start=True, time_limit=self.get_window_time_limit())
+        if new_obj is None:
+            return self.current_obj, self.current_solution_df
+        return new_obj, self.milp_problem_evaluator.get_solution_df()
+
+    def solve_local_window(self, window_begin, window_end):
+        sequence = self.current_solution_df['task_id'].to_numpy(dtype=np.int64)
+        window_end = min(window_end, len(sequence))
+
+        subproblem = self.get_window_subproblem(sequence, window_begin, window_end)
+        _, _, window_sequence = self.window_problem_evaluator.solve_window(**subproblem)
+
+        new_sequence = np.concatenate([sequence[:window_begin], window_sequence, sequence[window_end:]])
+        return self.get_solution_df(new_sequence)
+
+    def get_window_subproblem(self, sequence, window_begin, window_end):
+        """
+        Return the arguments of WindowProblemEvaluator.solve_window for the window of sequence
+        (with the solver time limit of the window).
+
+        Reordering the window only changes the prefix sums inside it, so the straddling task
+        (see SequenceEvaluator) stays the same if it is outside the window, and otherwise stays
+        inside it: the optimal offset is then the current one, or lies between
+        due_date - S[window_end] and due_date - S[window_begin]. In both cases the fixed tasks
+        are early or tardy for every offset of the range.
+        """
+        n = len(sequence)
+
+        # Offset range of the window sub-problem
+        S, A, B, AS, BS = self.sequence_evaluator.get_prefix_sums(sequence)
+        _, offset, _ = self.sequence_evaluator.solve_offset_from_prefix(S, A, B, AS, BS)
+        k_star = self.sequence_evaluator.get_straddling_position(A, B)
+        if window_begin < k_star <= window_end:
+            offset_bounds = (max(self.due_date - S[window_end], 0), max(self.due_date - S[window_begin], 0))
+        else:
+            offset_bounds = (offset, offset)
+
+        # Cost of fixed tasks as fixed_cost + fixed_slope * offset
+        fixed_positions = np.r_[0:window_begin, window_end:n]
+        fixed_tasks = sequence[fixed_positions]
+        task_end = S[fixed_positions + 1]
+        alpha = self.sequence_evaluator.alpha[fixed_tasks]
+        beta = self.sequence_evaluator.beta[fixed_tasks]
+        early = task_end + offset_bounds[1] <= self.due_date
+        fixed_cost = float(np.where(early, alpha * (self.due_date - task_end), beta * (task_end - self.due_date)).sum())
+        fixed_slope = float(np.where(early, -alpha, beta).sum())
+
+        return {
+            'window_tasks': sequence[window_begin:window_end].tolist(),
+            'block_begin': float(S[window_begin]),
+            'offset_bounds': offset_bounds,
+            'fixed_cost': fixed_cost,
+            'fixed_slope': fixed_slope,
+            'initial_offset': offset,
+            'time_limit': self.get_window_time_limit()
+        }
+
+    def get_solution_df(self, new_sequence):
+        """
+        Return tuple (obj_function, solution_df) of the sequence evaluated in closed form
+        """
+        new_obj, new_offset, _ = self.sequence_evaluator.solve_offset(new_sequence)
+        new_solution_df = (
+            pd.DataFrame({'task_id': new_sequence})
+            .merge(self.task_df[['task_id', 'p', 'alpha', 'beta']], on='task_id')
+        )
+        new_solution_df['task_end'] = new_solution_df['p'].cumsum() + new_offset
+        return new_obj, new_solution_df[['task_id', 'p', 'task_end', 'alpha', 'beta']]
         
         
\ No newline at end of file
@@ -0,0 +1,209 @@
+import numpy as np
+import pandas as pd
+from .sequence_evaluator import SequenceEvaluator
+from .simulated_annealing import SimulatedAnnealing
+from .time_budget import deadline_reached
+from .instrumentation import instrumentation
+
+
+class GeneticAlgorithm:
+    improvement_types = {None, 'sa', 'local_search'}
+
+    def __init__(self, task_df, due_date, initial_solution, heuristic_parameters, genetic_parameters):
+        """
+        Population-based search: population_size permutations are held as rows of a
+        (population_size, n) array and evaluated in one NumPy pass per generation
+        (SequenceEvaluator.evaluate_population). The population is seeded with the initial
+        (constructive) solution plus random permutations. Each generation keeps elite_size
+        best rows, and the other children are bred from tournament-selected parents by order
+        crossover (OX) and mutated with the swap and insertion neighborhoods of the SA.
+
+        With improvement 'sa' (memetic variant), the best improvement_size children of each
+        generation run improvement_moves SA perturbations at improvement_temperature_ratio
+        times the initial SA temperature, and with 'local_search' they run the swap descent
+        of SimulatedAnnealing.run_local_search. Both use the incremental evaluator engine.
+        """
+        self.task_df = task_df
+        self.due_date = due_date
+        self.initial_solution = initial_solution
+        self.heuristic_parameters = heuristic_parameters
+        self.n = len(initial_solution)
+
+        # Algorithm control attributes
+        self.population_size = genetic_parameters.get('population_size', 50)
+        self.elite_size = genetic_parameters.get('elite_size', 2)
+        self.tournament_size = genetic_parameters.get('tournament_size', 2)
+        self.crossover_rate = genetic_parameters.get('crossover_rate', 0.9)
+        self.mutation_rate = genetic_parameters.get('mutation_rate', 0.2)
+        self.generations_stop_criteria = genetic_parameters.get('generations_stop_criteria', 50)
+        self.max_generations = genetic_parameters.get('max_generations', 1000)
+        self.improvement = genetic_parameters.get('improvement')
+        self.improvement_size = genetic_parameters.get('improvement_size', 1)
+        self.improvement_moves = genetic_parameters.get('improvement_moves', self.n)
+        self.improvement_temperature_ratio = genetic_parameters.get('improvement_temperature_ratio', 0.01)
+        if self.improvement not in self.improvement_types:
+            raise Exception(f'Error: Improvement {self.improvement} not implemented')
+        if not (0 <= self.elite_size < self.population_size):
+            raise Exception('Error: Elite size must be smaller than the population size')
+
+        self.rng = np.random.default_rng(genetic_parameters.get('seed', heuristic_parameters.get('seed')))
+        self.sequence_evaluator = SequenceEvaluator(task_df, due_date)
+        self.in_segment = np.zeros(task_df['task_id'].max() + 1, dtype=bool)
+        self.deadline = heuristic_parameters.get('deadline')
+        self.interrupted = False
+
+        # Global best solution and algorithm trace
+        self.global_best_obj = None
+        self.global_best_sol = None
+        self.trace = {'GENERATION': [], 'BEST_OBJ': [], 'MEAN_OBJ': [], 'WORST_OBJ': []}
+
+    def get_trace(self):
+        return pd.DataFrame(self.trace)
+
+    def initialize_population(self):
+        """
+        Initial solution in the first row and random permutations in the others
+        """
+        initial_solution = np.asarray(self.initial_solution, dtype=np.int64)
+        population = np.empty((self.population_size, self.n), dtype=np.int64)
+        population[0] = initial_solution
+        for row in range(1, self.population_size):
+            population[row] = self.rng.permutation(initial_solution)
+        return population
+
+    def create_improver(self):
+        """
+        Return the SA object used to improve children, and its temperature for 'sa'
+        """
+        improver_parameters = {**self.heuristic_parameters, 'evaluator_engine': 'incremental'}
+        improver = SimulatedAnnealing(self.task_df, self.due_date, self.initial_solution, improver_parameters)
+        improvement_temperature = None
+        if self.improvement == 'sa':
+            improvement_temperature = improver.define_initial_temperature() * self.improvement_temperature_ratio
+        return improver, improvement_temperature
+
+    def run(self):
+        population = self.initialize_population()
+        objs, _, _ = self.sequence_evaluator.evaluate_population(population)
+        improver, improvement_temperature = (None, None) if self.improvement is None else self.create_improver()
+        self.update_global_best(population, objs, generation=0)
+
+        generations_without_improvement = 0
+        generation = 0
+        try:
+            while (generations_without_improvement < self.generations_stop_criteria) and (generation < self.max_generations):
+                if deadline_reached(self.deadline):
+                    instrumentation.emit('ga_stop', generation=generation, reason='time_budget', best_obj=self.global_best_obj)
+                    break
+                last_generation_obj = self.global_best_obj
+                generation += 1
+
+                # Elite rows are kept, the others are replaced by children
+                elite = np.argsort(objs, kind='stable')[:self.elite_size]
+                children = self.breed(population, objs, self.population_size - self.elite_size)
+                self.mutate(children)
+                children_objs, _, _ = self.sequence_evaluator.evaluate_population(children)
+
+                # Memetic improvement of the best children
+                if self.improvement is not None:
+                    for row in np.argsort(children_objs, kind='stable')[:self.improvement_size]:
+                        children_objs[row], children[row] = self.improve(improver, improvement_temperature, children[row], generation)
+
+                population = np.concatenate([population[elite], children])
+                objs = np.concatenate([objs[elite], children_objs])
+                self.update_global_best(population, objs, generation)
+
+                if self.global_best_obj < last_generation_obj:
+                    generations_without_improvement = 0
+                else:
+                    generations_without_improvement += 1
+                instrumentation.emit('ga_generation', generation=generation, best_obj=self.global_best_obj, mean_obj=float(objs.mean()))
+        except KeyboardInterrupt:
+            # Best solution re-evaluated, the interrupt may come between the updates of its objective and sequence
+            self.interrupted = True
+            self.global_best_obj, _, _ = self.sequence_evaluator.solve_offset(self.global_best_sol)
+            instrumentation.emit('ga_stop', generation=generation, reason='interrupt', best_obj=self.global_best_obj)
+        if improver is not None:
+            improver.close()
+
+        solution_df = (
+            pd.DataFrame({
+                'task_id':self.global_best_sol.astype(np.int64)
+            })
+            .merge(self.task_df, on='task_id')
+        )
+        return (self.global_best_obj, solution_df)
+
+    def update_global_best(self, population, objs, generation):
+        best_row = int(np.argmin(objs))
+        if (self.global_best_obj is None) or (objs[best_row] < self.global_best_obj):
+            self.global_best_obj = float(objs[best_row])
+            self.global_best_sol = population[best_row].copy()
+
+        self.trace['GENERATION'].append(generation)
+        self.trace['BEST_OBJ'].append(self.global_best_obj)
+        self.trace['MEAN_OBJ'].append(float(objs.mean()))
+        self.trace['WORST_OBJ'].append(float(objs.max()))
+
+    def select_parents(self, objs, n_parents):
+        """
+        Return the rows of n_parents tournament winners (lowest objective of tournament_size rows)
+        """
+        contestants = self.rng.integers(0, len(objs), size=(n_parents, self.tournament_size))
+        winners = np.argmin(objs[contestants], axis=1)
+        return contestants[np.arange(n_parents), winners]
+
+    def breed(self, population, objs, n_children):
+        parents = self.select_parents(objs, 2 * n_children).reshape(n_children, 2)
+        crossover = self.rng.random(n_children) < self.crossover_rate
+        children = population[parents[:, 0]].copy()
+        for row in np.flatnonzero(crossover):
+            children[row] = self.order_crossover(population[parents[row, 0]], population[parents[row, 1]])
+        return children
+
+    def order_crossover(self, parent_1, parent_2):
+        """
+        OX: the tasks of parent_1 between two cut points keep their positions, and the other
+        positions are filled from the second cut point on (wrapping around) with the missing
+        tasks in the order of parent_2
+        """
+        cut_1, cut_2 = np.sort(self.rng.choice(self.n + 1, size=2, replace=False))
+        segment = parent_1[cut_1:cut_2]
+        self.in_segment[segment] = True
+        parent_2_order = np.roll(parent_2, -cut_2)
+        fill = parent_2_order[~self.in_segment[parent_2_order]]
+        self.in_segment[segment] = False
+
+        child = np.empty(self.n, dtype=np.int64)
+        child[cut_1:cut_2] = segment
+        child[np.r_[cut_2:self.n, 0:cut_1]] = fill
+        return child
+
+    def mutate(self, children):
+        """
+        Swap (SA neighborhood 3) or insertion (SA neighborhood 4) of two random positions of
+        each child with probability mutation_rate
+        """
+        mutated = np.flatnonzero(self.rng.random(len(children)) < self.mutation_rate)
+        positions_1, positions_2 = self.rng.integers(0, self.n, size=(2, len(mutated)))
+        is_swap = self.rng.random(len(mutated)) < 0.5
+
+        rows, position_1, position_2 = mutated[is_swap], positions_1[is_swap], positions_2[is_swap]
+        children[rows, position_1], children[rows, position_2] = children[rows, position_2], children[rows, position_1]
+
+        for row, from_position, to_position in zip(mutated[~is_swap], positions_1[~is_swap], positions_2[~is_swap]):
+            if from_position < to_position:
+                children[row, from_position:to_position + 1] = np.roll(children[row, from_position:to_position + 1], -1)
+            elif to_position < from_position:
+                children[row, to_position:from_position + 1] = np.roll(children[row, to_position:from_position + 1], 1)
+
+    def improve(self, improver, temperature, child, generation):
+        """
+        Return tuple (obj_function, solution) of the child improved by the SA object
+        """
+        improver.load_solution(child)
+        if self.improvement == 'sa':
+            improver.run_stage(temperature, generation, self.improvement_moves)
+        else:
+            improver.run_local_search()
+        return improver.global_best_obj, improver.global_best_sol.astype(np.int64)
@@ -0,0 +1,190 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Binary instance files: magic, number of instances K, job offsets of the instances (K + 1
+# int64), then the p, alpha and beta columns of all instances as int32 (little-endian)
+BINARY_MAGIC = b'ETSCH001'
+BINARY_EXTENSION = '.bin'
+ORLIB_EXTENSION = '.txt'
+
+
+def tasks_from_arrays(p, alpha, beta):
+    """
+    Return the tasks DataFrame used by the pipeline (task_id, p, alpha, beta)
+    """
+    return pd.DataFrame({
+        'task_id': np.arange(len(p), dtype=np.int64),
+        'p': np.asarray(p, dtype=np.int64),
+        'alpha': np.asarray(alpha, dtype=np.int64),
+        'beta': np.asarray(beta, dtype=np.int64)
+    })
+
+
+class _IntegerReader:
+    def __init__(self, file, block_size):
+        """
+        Whitespace separated integers of a text file, parsed one block of block_size bytes
+        at a time (the partial token at the end of a block is kept for the next one)
+        """
+        self.file = file
+        self.block_size = block_size
+        self.values = np.empty(0, dtype=np.int64)
+        self.position = 0
+        self.tail = b''
+
+    def read(self, count):
+        """
+        Return the next count integers
+        """
+        chunks = []
+        while count > 0:
+            if (self.position >= len(self.values)) and not self.read_block():
+                raise Exception('Error: Unexpected end of OR-Library file')
+            chunk = self.values[self.position:self.position + count]
+            self.position += len(chunk)
+            count -= len(chunk)
+            chunks.append(chunk)
+        if len(chunks) == 1:
+            return chunks[0]
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+    def read_block(self) -> bool:
+        data = b''
+        while not data.strip():
+            block = self.file.read(self.block_size)
+            if not block:
+                data, self.tail = self.tail, b''
+                if not data.strip():
+                    return False
+                break
+            data = self.tail + block
+            cut = max(data.rfind(whitespace) for whitespace in (b' ', b'\n', b'\t', b'\r')) + 1
+            data, self.tail = data[:cut], data[cut:]
+        self.values = np.fromstring(data.decode('ascii'), dtype=np.int64, sep=' ')
+        self.position = 0
+        return True
+
+
+def iter_orlib_instances(path, block_size=1 << 20):
+    """
+    Yield the instances of an OR-Library scheduling file (number of instances, then for
+    each instance its number of jobs n and n lines 'p alpha beta') as (n, 3) int32 arrays,
+    reading block_size bytes at a time
+    """
+    with open(path, 'rb') as file:
+        reader = _IntegerReader(file, block_size)
+        n_instances = int(reader.read(1)[0])
+        for _ in range(n_instances):
+            n = int(reader.read(1)[0])
+            yield reader.read(3 * n).reshape(n, 3).astype(np.int32)
+
+
+def write_binary_instances(path, instances):
+    """
+    Write the (n, 3) arrays of p, alpha and beta of the instances to a binary instance file
+    """
+    instances = [np.asarray(instance) for instance in instances]
+    for instance in instances:
+        if (instance.ndim != 2) or (instance.shape[1] != 3):
+            raise Exception('Error: Instances must be arrays of p, alpha and beta columns')
+        if (instance.size > 0) and ((instance.min() < 0) or (instance.max() > np.iinfo(np.int32).max)):
+            raise Exception('Error: Instance data out of the int32 range of the binary format')
+    offsets = np.zeros(len(instances) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(instance) for instance in instances])
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(BINARY_MAGIC)
+        file.write(np.asarray([len(instances)], dtype='<i8').tobytes())
+        file.write(offsets.tobytes())
+        for column in range(3):
+            for instance in instances:
+                file.write(np.ascontiguousarray(instance[:, column], dtype='<i4').tobytes())
+
+
+def convert_orlib_file(orlib_path, binary_path):
+    """
+    Convert an OR-Library scheduling file to a binary instance file
+    """
+    write_binary_instances(binary_path, iter_orlib_instances(orlib_path))
+
+
+class BinaryInstances:
+    def __init__(self, path):
+        """
+        Instances of a binary instance file, memory-mapped: opening the file only reads its
+        header, and the p, alpha and beta arrays of an instance are views of the mapped
+        columns, read from disk when used
+        """
+        with open(path, 'rb') as file:
+            if file.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+                raise Exception(f'Error: {path} is not a binary instance file')
+            n_instances = int(np.frombuffer(file.read(8), dtype='<i8')[0])
+            self.offsets = np.frombuffer(file.read(8 * (n_instances + 1)), dtype='<i8')
+        header_size = len(BINARY_MAGIC) + 8 * (n_instances + 2)
+        n_jobs = int(self.offsets[-1])
+        self.path = path
+        self.columns = np.memmap(path, dtype='<i4', mode='r', offset=header_size, shape=(3, n_jobs)) if n_jobs > 0 else np.empty((3, 0), dtype='<i4')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get_arrays(self, instance):
+        """
+        Return tuple (p, alpha, beta) of the instance as read-only memory-mapped arrays
+        """
+        if not (0 <= instance < len(self)):
+            raise Exception(f'Error: Instance {instance} not in {self.path}')
+        begin, end = self.offsets[instance], self.offsets[instance + 1]
+        p, alpha, beta = self.columns[:, begin:end]
+        return p, alpha, beta
+
+    def get_tasks(self, instance):
+        return tasks_from_arrays(*self.get_arrays(instance))
+
+
+def get_instance_name(path, instance):
+    """
+    Name of an instance of a multi-instance file, like sch100k1 for the first instance of sch100.txt
+    """
+    return f'{os.path.splitext(os.path.basename(path))[0]}k{instance + 1}'
+
+
+def load_tasks(path, instance=0):
+    """
+    Return the tasks DataFrame of the instance (index in multi-instance files) of path: a
+    headerless CSV of p, alpha and beta, an OR-Library file or a binary instance file
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == BINARY_EXTENSION:
+        return BinaryInstances(path).get_tasks(instance)
+    elif extension == ORLIB_EXTENSION:
+        for idx, instance_data in enumerate(iter_orlib_instances(path)):
+            if idx == instance:
+                return tasks_from_arrays(*instance_data.T)
+        raise Exception(f'Error: Instance {instance} not in {path}')
+    tasks_df = pd.read_csv(path, header=None)
+    tasks_df.columns = ['p', 'alpha', 'beta']
+    return tasks_from_arrays(tasks_df['p'], tasks_df['alpha'], tasks_df['beta'])
+
+
+def iter_instances(paths):
+    """
+    Yield tuple (instance_name, tasks_df) of every instance of the files in paths, one at
+    a time: multi-instance files are read lazily (streamed or memory-mapped), so only the
+    instance being used is in memory
+    """
+    for path in paths:
+        extension = os.path.splitext(path)[1]
+        if extension == BINARY_EXTENSION:
+            binary_instances = BinaryInstances(path)
+            for instance in range(len(binary_instances)):
+                yield get_instance_name(path, instance), binary_instances.get_tasks(instance)
+        elif extension == ORLIB_EXTENSION:
+            for instance, instance_data in enumerate(iter_orlib_instances(path)):
+                yield get_instance_name(path, instance), tasks_from_arrays(*instance_data.T)
+        else:
+            yield os.path.splitext(os.path.basename(path))[0], load_tasks(path)
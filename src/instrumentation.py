@@ -0,0 +1,121 @@
+from contextlib import contextmanager
+import json
+import os
+import time
+import pandas as pd
+
+
+class ConsoleSink:
+    def __init__(self, min_interval=1.0):
+        """
+        Prints every 'stage' level record, and at most one record per event name every
+        min_interval seconds for the finer levels
+        """
+        self.min_interval = min_interval
+        self.last_print = {}
+
+    def write(self, record):
+        if record['level'] != 'stage':
+            now = time.perf_counter()
+            if now - self.last_print.get(record['event'], -float('inf')) < self.min_interval:
+                return
+            self.last_print[record['event']] = now
+        fields = ' | '.join(f'{key}: {value}' for key, value in record.items() if key not in ('event', 'level', 'time'))
+        print(f'{record["event"]} | {fields}')
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        """
+        Appends every record as one JSON line to path
+        """
+        self.path = path
+        self.file = None
+
+    def write(self, record):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, 'a')
+        self.file.write(json.dumps(record, default=float) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class MemorySink:
+    def __init__(self):
+        self.records = []
+
+    def write(self, record):
+        self.records.append(record)
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.records)
+
+    def close(self):
+        pass
+
+
+class Instrumentation:
+    verbosity_levels = {'silent': 0, 'stage': 1, 'detail': 2, 'move': 3}
+
+    def __init__(self, verbosity='stage', sinks=None):
+        """
+        Performance events of the pipeline (stage timers, SA stage statistics, solver times,
+        Fix-and-Optimize windows) sent to pluggable sinks. Each event has a level: 'stage'
+        (a few per stage), 'detail' (per solve or window) and 'move' (per SA move); events
+        above the verbosity are dropped before any formatting, and the hot loops check
+        is_enabled('move') once per stage, so the default 'stage' verbosity adds no cost per move.
+        """
+        self.configure(verbosity, sinks if sinks is not None else [ConsoleSink()])
+
+    def configure(self, verbosity=None, sinks=None):
+        if verbosity is not None:
+            if verbosity not in self.verbosity_levels:
+                raise Exception(f'Error: Verbosity {verbosity} not implemented')
+            self.verbosity = verbosity
+            self.verbosity_level = self.verbosity_levels[verbosity]
+        if sinks is not None:
+            self.sinks = list(sinks)
+
+    def is_enabled(self, level) -> bool:
+        return self.verbosity_levels[level] <= self.verbosity_level
+
+    def emit(self, event, level='stage', **fields):
+        if self.verbosity_levels[level] > self.verbosity_level:
+            return
+        record = {'event': event, 'level': level, 'time': time.time(), **fields}
+        for sink in self.sinks:
+            sink.write(record)
+
+    @contextmanager
+    def timer(self, stage, level='stage', **fields):
+        """
+        Emit a 'stage_time' event with the wall time of the block
+        """
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.emit('stage_time', level, stage=stage, seconds=round(time.perf_counter() - begin, 4), **fields)
+
+    def get_sink(self, sink_type):
+        for sink in self.sinks:
+            if isinstance(sink, sink_type):
+                return sink
+        return None
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# Instrumentation of the process, configured by ProblemManager (worker processes keep the default)
+instrumentation = Instrumentation()
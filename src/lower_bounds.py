@@ -0,0 +1,159 @@
+import time
+import numpy as np
+import pandas as pd
+import pyomo.environ as pyo
+from .lp_problem import SolverInterface
+from .exact_solver import ExactSolver
+
+
+def get_gap(obj, lower_bound):
+    """
+    Relative optimality gap (obj - lower_bound) / obj (None without lower bound)
+    """
+    if (lower_bound is None) or (obj is None):
+        return None
+    return max(obj - lower_bound, 0.0) / obj if obj > 0 else 0.0
+
+
+def gap_reached(obj, lower_bound, gap_stop) -> bool:
+    gap = get_gap(obj, lower_bound)
+    return (gap_stop is not None) and (gap is not None) and (gap <= gap_stop)
+
+
+class LowerBounds:
+    bound_types = {'trivial', 'lagrangian', 'lp_relaxation', 'partition_lagrangian'}
+
+    def __init__(self, task_df, due_date, parameters):
+        """
+        Lower bounds of the optimal cost of the instance. 'trivial', 'lp_relaxation' and
+        'lagrangian' relax the schedule by positions around the due date. In any schedule,
+        the k-th early job counted back from the due date ends at least S[k-1] before it, and
+        the k-th tardy job at least S[k-1] after it, where S[m] is the sum of the m shortest
+        processing times. Early jobs also fit before the due date, which limits the early
+        positions.
+
+        'trivial' relaxes every alpha and beta to their minimum and drops the due date
+        restriction: the common weight problem is solved in closed form by matching the
+        longest jobs to the smallest positional weights, in O(n log n) for any n.
+        'lp_relaxation' solves the assignment of the jobs to the early and tardy positions
+        as an LP (integral, so it equals the assignment bound) with solver_name, up to
+        lp_max_tasks jobs. 'lagrangian' relaxes the capacity of the positions of the same
+        assignment and runs lagrangian_iterations subgradient steps (Polyak steps towards
+        the upper bound given to compute) without solver, up to lagrangian_max_tasks jobs.
+        These bounds are weak (often below half of the optimum).
+
+        'partition_lagrangian' is the lagrangian relaxation of the early/tardy partition of
+        the exact solver at its root (see ExactSolver.solve_relaxation), with
+        partition_iterations subgradient steps towards the upper bound, for integer
+        processing times and due date up to partition_max_tasks jobs. It is within a few
+        percent of the optimum, so the gap stop criterion can be reached.
+        The relaxation of the big-M MILP is not used: it is 0 for every instance.
+        """
+        self.task_df = task_df
+        self.p = task_df['p'].to_numpy(dtype=np.float64)
+        self.alpha = task_df['alpha'].to_numpy(dtype=np.float64)
+        self.beta = task_df['beta'].to_numpy(dtype=np.float64)
+        self.due_date = due_date
+
+        self.bound_types_used = parameters.get('bounds', ['trivial', 'partition_lagrangian'])
+        for bound_type in self.bound_types_used:
+            if bound_type not in self.bound_types:
+                raise Exception(f'Error: Lower bound {bound_type} not implemented')
+        self.lp_max_tasks = parameters.get('lp_max_tasks', 200)
+        self.lagrangian_max_tasks = parameters.get('lagrangian_max_tasks', 500)
+        self.lagrangian_iterations = parameters.get('lagrangian_iterations', 1000)
+        self.partition_max_tasks = parameters.get('partition_max_tasks', 200)
+        self.partition_iterations = parameters.get('partition_iterations', 300)
+        self.solver_name = parameters.get('solver_name', 'gurobi')
+
+        self.bounds = {'BOUND': [], 'VALUE': [], 'SECONDS': []}
+        self.lower_bound = None
+
+    def compute(self, upper_bound):
+        """
+        Compute the bounds (skipping those above their size limit), return the best one
+        """
+        for bound_type in self.bound_types_used:
+            begin = time.perf_counter()
+            if bound_type == 'trivial':
+                value = self.trivial_bound()
+            elif bound_type == 'lp_relaxation':
+                value = self.lp_relaxation_bound() if len(self.p) <= self.lp_max_tasks else None
+            elif bound_type == 'partition_lagrangian':
+                value = self.partition_lagrangian_bound(upper_bound) if len(self.p) <= self.partition_max_tasks else None
+            else:
+                value = self.lagrangian_bound(upper_bound) if len(self.p) <= self.lagrangian_max_tasks else None
+            self.bounds['BOUND'].append(bound_type)
+            self.bounds['VALUE'].append(value)
+            self.bounds['SECONDS'].append(round(time.perf_counter() - begin, 4))
+            if (value is not None) and ((self.lower_bound is None) or (value > self.lower_bound)):
+                self.lower_bound = value
+        return self.lower_bound
+
+    def get_bounds(self):
+        return pd.DataFrame(self.bounds)
+
+    def trivial_bound(self):
+        n = len(self.p)
+        position = np.arange(1, n + 1)
+        positional_weights = np.minimum(self.alpha.min() * (position - 1), self.beta.min() * (n - position + 1))
+        return float(np.sort(self.p)[::-1] @ np.sort(positional_weights))
+
+    def get_position_costs(self):
+        """
+        Return the (n, early positions + n) cost of each job in each early and tardy position
+        """
+        shortest_sums = np.concatenate([[0.0], np.cumsum(np.sort(self.p))])
+        early_positions = int(np.searchsorted(shortest_sums, self.due_date, side='right')) - 1
+        n = len(self.p)
+        return np.concatenate([
+            self.alpha[:, None] * shortest_sums[None, :early_positions],
+            self.beta[:, None] * shortest_sums[None, :n]
+        ], axis=1)
+
+    def lagrangian_bound(self, upper_bound):
+        costs = self.get_position_costs()
+        jobs = np.arange(len(self.p))
+        multipliers = np.zeros(costs.shape[1])
+        best_bound = 0.0
+        step_scale = 1.0
+        iterations_without_improvement = 0
+        for _ in range(self.lagrangian_iterations):
+            # Each job in its cheapest position with the multipliers (capacities relaxed)
+            reduced_costs = costs + multipliers
+            positions = reduced_costs.argmin(axis=1)
+            bound = reduced_costs[jobs, positions].sum() - multipliers.sum()
+            if bound > best_bound + 1e-9:
+                best_bound = bound
+                iterations_without_improvement = 0
+            else:
+                iterations_without_improvement += 1
+                if iterations_without_improvement >= 10:
+                    step_scale /= 2
+                    iterations_without_improvement = 0
+
+            subgradient = np.bincount(positions, minlength=costs.shape[1]) - 1.0
+            subgradient[(multipliers <= 0) & (subgradient < 0)] = 0.0
+            if not subgradient.any():
+                break
+            step = step_scale * max(upper_bound - bound, 1e-9) / (subgradient @ subgradient)
+            multipliers = np.maximum(multipliers + step * subgradient, 0.0)
+        return float(best_bound)
+
+    def partition_lagrangian_bound(self, upper_bound):
+        # The dynamic programming of the exact solver runs over integer times
+        if not (np.all(self.p == np.round(self.p)) and float(self.due_date).is_integer()):
+            return None
+        return ExactSolver(self.task_df, self.due_date).solve_root_relaxation(upper_bound, self.partition_iterations)
+
+    def lp_relaxation_bound(self):
+        costs = self.get_position_costs()
+        jobs, positions = range(costs.shape[0]), range(costs.shape[1])
+        model = pyo.ConcreteModel()
+        model.x = pyo.Var(jobs, positions, bounds=(0, 1))
+        model.job = pyo.Constraint(jobs, rule=lambda M, i: sum(M.x[i, s] for s in positions) == 1)
+        model.position = pyo.Constraint(positions, rule=lambda M, s: sum(M.x[i, s] for i in jobs) <= 1)
+        model.obj = pyo.Objective(expr=sum(float(costs[i, s]) * model.x[i, s] for i in jobs for s in positions))
+        if not SolverInterface(self.solver_name).solve(model):
+            raise Exception('Error when solving the LP relaxation')
+        return float(pyo.value(model.obj))
@@ -10,21 +10,114 @@ from pyomo.contrib.iis import write_iis
 from pyomo.core import ComponentUID
 from pyomo.opt import SolverFactory
 import itertools
+import time
+from .instrumentation import instrumentation
+
+
+class SolverInterface:
+    persistent_solvers = {'gurobi': appsi.solvers.Gurobi, 'highs': appsi.solvers.Highs}
+    solver_factory_names = {'gurobi': 'gurobi', 'highs': 'appsi_highs'}
+
+    def __init__(self, solver_name='gurobi', persistent=False):
+        """
+        Solves Pyomo models with SolverFactory(solver_name), which writes the whole model on
+        every call, or with a persistent APPSI solver, which loads the model once and then
+        only pushes the changed variable bounds and mutable parameters between solves. The
+        model structure (sets, variables, constraints) must not change after the first
+        solve of a persistent solver.
+        """
+        if solver_name not in self.solver_factory_names:
+            raise Exception(f'Error: Solver {solver_name} not implemented')
+        self.solver_name = solver_name
+        self.persistent = persistent
+        self.model = None
+
+        # Wall time of the solver calls (including loading the model into the solver)
+        self.solves = 0
+        self.solve_time = 0.0
+
+        if persistent:
+            self.solver = self.persistent_solvers[solver_name]()
+            self.solver.update_config.check_for_new_or_removed_constraints = False
+            self.solver.update_config.check_for_new_or_removed_vars = False
+            self.solver.update_config.check_for_new_or_removed_params = False
+            self.solver.update_config.check_for_new_objective = False
+            self.solver.update_config.update_constraints = False
+            self.solver.update_config.update_named_expressions = False
+        else:
+            self.solver = SolverFactory(self.solver_factory_names[solver_name])
+
+    def solve(self, model, warm_start=False, time_limit=None) -> bool:
+        """
+        Solve model and load its solution, returning True if it is optimal. With warm_start,
+        the current values of the model variables are given to the solver as a MIP start.
+        With time_limit (secs), a solve stopped by the limit also returns True if it found a
+        feasible solution, and False without loading anything otherwise.
+        """
+        solve_begin = time.perf_counter()
+        try:
+            return self.solve_model(model, warm_start, time_limit)
+        except RuntimeError:
+            # APPSI solvers raise when asked to load a solution they do not have
+            if time_limit is None:
+                raise
+            return False
+        finally:
+            self.solves += 1
+            self.solve_time += time.perf_counter() - solve_begin
+
+    def solve_model(self, model, warm_start=False, time_limit=None) -> bool:
+        accepted_terminations = {'optimal'} if time_limit is None else {'optimal', 'maxTimeLimit'}
+        if not self.persistent:
+            if time_limit is None:
+                results = self.solver.solve(model, tee=False)
+            else:
+                results = self.solver.solve(model, tee=False, timelimit=time_limit)
+            return str(results['Solver'].Termination_condition.value) in accepted_terminations
+
+        if self.solver_name == 'gurobi':
+            # Gurobi reads the MIP start from the Start attribute of the loaded variables
+            if model is not self.model:
+                self.solver.set_instance(model)
+            if warm_start:
+                for var in model.component_data_objects(pyo.Var):
+                    if var.value is not None:
+                        self.solver.set_var_attr(var, 'Start', var.value)
+        else:
+            self.solver.config.warmstart = warm_start
+        self.model = model
+        self.solver.config.time_limit = time_limit
+
+        results = self.solver.solve(model)
+        return results.termination_condition.name in accepted_terminations
+
 
 class ProblemEvaluator:
-    def __init__(self, task_df, due_date, problem_type='LP'):
+    def __init__(self, task_df, due_date, problem_type='LP', solver_name='gurobi', persistent_solver=False):
         self.task_df = task_df.set_index('task_id')
         self.due_date = due_date
         self.problem_type = problem_type
 
+        # Wall time spent building and updating the model (the solver time is kept by SolverInterface)
+        build_begin = time.perf_counter()
         self.create_initial_model()
-        self.solver = SolverFactory('gurobi')
+        self.build_time = time.perf_counter() - build_begin
+        self.solver = SolverInterface(solver_name, persistent_solver)
+
+    def get_timing(self):
+        return {'solves': self.solver.solves, 'build_time': self.build_time, 'solve_time': self.solver.solve_time}
+
+    def emit_solve(self):
+        instrumentation.emit('lp_solve', 'detail', problem_type=self.problem_type, **self.get_timing())
 
     def evaluate_solution(self, solution_to_evaluate) -> float:
+        build_begin = time.perf_counter()
         solution_df = self.fix_d_solution(solution_to_evaluate)
+        self.build_time += time.perf_counter() - build_begin
         
-        results = self.solver.solve(self.model, tee=False)
-        if str(results['Solver'].Termination_condition.value) == 'optimal':
+        solved = self.solver.solve(self.model)
+        self.emit_solve()
+        if solved:
             obj_function = pyo.value(self.model.obj)
             offset = pyo.value(self.model.offset)
             solution_df['task_deliver_time'] = solution_df['p_cumsum'] + offset
@@ -38,14 +131,17 @@ class ProblemEvaluator:
         for i in self.model.d:
             print(f"d[{i}] lower bound: {self.model.d[i].lb}, upper bound: {self.model.d[i].ub}")
 
-    def solve_model(self):
-        results = self.solver.solve(self.model, tee=False)
-
-        if str(results['Solver'].Termination_condition.value) == 'optimal':
+    def solve_model(self, warm_start=False, time_limit=None):
+        solved = self.solver.solve(self.model, warm_start=warm_start, time_limit=time_limit)
+        self.emit_solve()
+        if solved:
             obj_function = pyo.value(self.model.obj)
             offset = pyo.value(self.model.offset)
             
             return obj_function, offset
+        elif time_limit is not None:
+            # No solution found within the time limit
+            return None, None
         else:
             raise Exception('Error when evaluation solution')
 
@@ -115,13 +211,35 @@ class ProblemEvaluator:
         self.model.offset = pyo.Var(within=pyo.NonNegativeReals, bounds=(0, self.due_date))
     
     def free_all_tasks(self):
+        build_begin = time.perf_counter()
         for task_id in self.task_df.index:
             self.model.d[task_id].setlb(self.model.p[task_id])
             self.model.d[task_id].setub(np.inf)
+        self.build_time += time.perf_counter() - build_begin
 
 
     def fix_task(self, task_id, task_end):
+        build_begin = time.perf_counter()
         self.model.d[task_id].bounds = (task_end, task_end)
+        self.build_time += time.perf_counter() - build_begin
+
+    def set_warm_start(self, solution_to_evaluate, offset):
+        """
+        Set the MILP variables to the schedule of the given sequence (used as MIP start)
+        """
+        build_begin = time.perf_counter()
+        solution_df = pd.DataFrame({'task_id': solution_to_evaluate}).join(self.task_df[['p']], on='task_id')
+        task_end = dict(zip(solution_df['task_id'], solution_df['p'].cumsum()))
+        position = {task_id: idx for idx, task_id in enumerate(solution_df['task_id'])}
+
+        for task_id, task_d in task_end.items():
+            self.model.d[task_id].value = task_d
+            self.model.e[task_id].value = max(self.due_date - task_d - offset, 0)
+            self.model.t[task_id].value = max(task_d - self.due_date + offset, 0)
+        for (i, j) in self.model.Omega:
+            self.model.b[(i,j)].value = int(position[i] < position[j])
+        self.model.offset.value = offset
+        self.build_time += time.perf_counter() - build_begin
 
     def define_parameters(self):
         task_df_dict = self.task_df.to_dict()
@@ -195,3 +313,152 @@ class ProblemEvaluator:
         obj = sum(M.alpha[i] * M.e[i] + M.beta[i] * M.t[i] for i in M.I)
         return obj
 
+
+
+class WindowProblemEvaluator:
+    def __init__(self, task_df, due_date, solver_name='gurobi', persistent_solver=False):
+        """
+        MILP restricted to the free tasks of a Fix and Optimize window. The fixed tasks before
+        and after the window keep their positions, so the free tasks fill the block left
+        between them without idle time, and the completion of each free task is
+        block_begin + p_j + sum of p_i over the tasks ordered before it. Ordering binaries are
+        only needed for the pairs of free tasks (with transitivity constraints on triples),
+        without the big-M disjunctive constraints of the full model. The offset range given by
+        the caller keeps every fixed task on the same side of the due date, so the cost of the
+        fixed tasks is fixed_cost + fixed_slope * offset.
+
+        Tasks are indexed by their position in the window and their data are mutable
+        parameters, so one model (and solver) is kept per window size and reused by every
+        window of that size.
+        """
+        self.task_df = task_df.set_index('task_id')
+        self.due_date = due_date
+        self.solver_name = solver_name
+        self.persistent_solver = persistent_solver
+        self.models = {}
+        self.solvers = {}
+        self.build_time = 0.0
+
+    def get_timing(self):
+        return {
+            'solves': sum(solver.solves for solver in self.solvers.values()),
+            'build_time': self.build_time,
+            'solve_time': sum(solver.solve_time for solver in self.solvers.values())
+        }
+
+    def solve_window(self, window_tasks, block_begin, offset_bounds, fixed_cost, fixed_slope, initial_offset, time_limit=None):
+        """
+        Return tuple (obj_function, offset, window_sequence) of the best order of window_tasks.
+        The current order with initial_offset is given to the solver as MIP start. With
+        time_limit, the best order found in time is returned, or the current order (with
+        obj_function None) if the solver found none.
+        """
+        window_size = len(window_tasks)
+        build_begin = time.perf_counter()
+        if window_size not in self.models:
+            self.models[window_size] = self.create_window_model(window_size)
+            self.solvers[window_size] = SolverInterface(self.solver_name, self.persistent_solver)
+        self.model = self.models[window_size]
+
+        self.set_window_parameters(window_tasks, block_begin, offset_bounds, fixed_cost, fixed_slope)
+        self.set_warm_start(initial_offset)
+        self.build_time += time.perf_counter() - build_begin
+
+        solved = self.solvers[window_size].solve(self.model, warm_start=True, time_limit=time_limit)
+        instrumentation.emit('lp_solve', 'detail', problem_type='window', **self.get_timing())
+        if solved:
+            obj_function = pyo.value(self.model.obj)
+            offset = pyo.value(self.model.offset)
+            window_sequence = [window_tasks[k] for k in sorted(self.model.I, key=lambda k: pyo.value(self.model.d[k]))]
+            return obj_function, offset, window_sequence
+        elif time_limit is not None:
+            return None, initial_offset, list(window_tasks)
+        else:
+            raise Exception('Error when evaluation solution')
+
+    def set_window_parameters(self, window_tasks, block_begin, offset_bounds, fixed_cost, fixed_slope):
+        window_df = self.task_df.loc[list(window_tasks)]
+        for k, (p, alpha, beta) in enumerate(window_df[['p', 'alpha', 'beta']].itertuples(index=False)):
+            self.model.p[k] = p
+            self.model.alpha[k] = alpha
+            self.model.beta[k] = beta
+        self.model.block_begin = block_begin
+        self.model.fixed_cost = fixed_cost
+        self.model.fixed_slope = fixed_slope
+        self.model.offset.bounds = offset_bounds
+
+    def set_warm_start(self, initial_offset):
+        """
+        Set the variables to the current order of the window (used as MIP start)
+        """
+        task_end = pyo.value(self.model.block_begin)
+        for k in self.model.I:
+            task_end += pyo.value(self.model.p[k])
+            self.model.d[k].value = task_end
+            self.model.e[k].value = max(self.due_date - task_end - initial_offset, 0)
+            self.model.t[k].value = max(task_end - self.due_date + initial_offset, 0)
+        for pair in self.model.Omega:
+            self.model.b[pair].value = 1
+        self.model.offset.value = initial_offset
+
+    def create_window_model(self, window_size):
+        model = pyo.ConcreteModel()
+
+        # Window positions, their pairs (b[i, j] = 1 if the task at i is before the task at j) and triples
+        model.I = list(range(window_size))
+        model.Omega = list(itertools.combinations(model.I, 2))
+        model.Theta = list(itertools.combinations(model.I, 3))
+
+        # Parameters
+        model.p = pyo.Param(model.I, mutable=True, initialize=0)
+        model.alpha = pyo.Param(model.I, mutable=True, initialize=0)
+        model.beta = pyo.Param(model.I, mutable=True, initialize=0)
+        model.block_begin = pyo.Param(mutable=True, initialize=0)
+        model.fixed_cost = pyo.Param(mutable=True, initialize=0)
+        model.fixed_slope = pyo.Param(mutable=True, initialize=0)
+        model.due_date = self.due_date
+
+        # Decision variables
+        model.d = pyo.Var(model.I, within=pyo.NonNegativeReals)
+        model.e = pyo.Var(model.I, within=pyo.NonNegativeReals)
+        model.t = pyo.Var(model.I, within=pyo.NonNegativeReals)
+        model.b = pyo.Var(model.Omega, within=pyo.Binary)
+        model.offset = pyo.Var(within=pyo.NonNegativeReals, bounds=(0, self.due_date))
+
+        # Constraints
+        model.C1 = pyo.Constraint(model.I, rule=ProblemEvaluator.rule_constraint_c1_MILP)
+        model.C2 = pyo.Constraint(model.I, rule=ProblemEvaluator.rule_constraint_c2_MILP)
+        model.C3 = pyo.Constraint(model.I, rule=self.rule_constraint_completion)
+        model.C4 = pyo.Constraint(model.Theta, rule=self.rule_constraint_transitivity_lb)
+        model.C5 = pyo.Constraint(model.Theta, rule=self.rule_constraint_transitivity_ub)
+
+        model.obj = pyo.Objective(rule=self.objective_function_rule)
+        return model
+
+    @staticmethod
+    def is_before(M, i, j):
+        # 1 if the task at position i is before the task at position j
+        if i < j:
+            return M.b[(i,j)]
+        return 1 - M.b[(j,i)]
+
+    @staticmethod
+    def rule_constraint_completion(M, j):
+        LHS = M.d[j]
+        RHS = M.block_begin + M.p[j] + sum(M.p[i] * WindowProblemEvaluator.is_before(M, i, j) for i in M.I if i != j)
+        return LHS == RHS
+
+    @staticmethod
+    def rule_constraint_transitivity_lb(M, i, j, k):
+        # i before j and j before k implies i before k
+        return M.b[(i,j)] + M.b[(j,k)] - M.b[(i,k)] <= 1
+
+    @staticmethod
+    def rule_constraint_transitivity_ub(M, i, j, k):
+        # k before j and j before i implies k before i
+        return M.b[(i,k)] - M.b[(i,j)] - M.b[(j,k)] <= 0
+
+    @staticmethod
+    def objective_function_rule(M):
+        obj = sum(M.alpha[i] * M.e[i] + M.beta[i] * M.t[i] for i in M.I)
+        return obj + M.fixed_cost + M.fixed_slope * M.offset
@@ -0,0 +1,101 @@
+import pandas as pd
+
+
+class AdaptivePursuit:
+    operator_credits = {'cpu_time', 'evaluation'}
+
+    def __init__(self, operators, parameters):
+        """
+        Adaptive pursuit operator selection. Each operator has a quality, the exponential
+        recency-weighted average (quality_learning_rate) of its rewards, where the reward of
+        a move is its improvement of the current solution per CPU second spent on it (operator
+        credit 'cpu_time'), or the improvement itself, i.e. per evaluation ('evaluation'). CPU
+        times change between runs, so only 'evaluation' repeats a run with the same seed or
+        from a checkpoint. After
+        each move the selection probabilities are pursued (pursuit_learning_rate) towards
+        max_probability for the best quality and min_probability for the others, so every
+        operator keeps being tested while their usefulness changes between stages.
+        """
+        self.operators = list(operators)
+        n_operators = len(self.operators)
+        self.operator_credit = parameters.get('operator_credit', 'cpu_time')
+        if self.operator_credit not in self.operator_credits:
+            raise Exception(f'Error: Operator credit {self.operator_credit} not implemented')
+        self.quality_learning_rate = parameters.get('quality_learning_rate', 0.1)
+        self.pursuit_learning_rate = parameters.get('pursuit_learning_rate', 0.1)
+        self.min_probability = parameters.get('min_probability', 0.2 / n_operators)
+        self.max_probability = 1 - (n_operators - 1) * self.min_probability
+        if self.max_probability < self.min_probability:
+            raise Exception('Error: Minimum operator probability must be at most 1 / number of operators')
+
+        self.operator_index = {operator: idx for idx, operator in enumerate(self.operators)}
+        self.probabilities = [1 / n_operators] * n_operators
+        self.quality = [0.0] * n_operators
+
+        # Statistics of the current stage, and of all stages
+        self.reset_stage_stats()
+        self.stats = {
+            'K': [], 'NEIGHBORHOOD': [], 'SELECTED': [], 'ACCEPTED': [], 'IMPROVEMENT': [],
+            'CPU_TIME': [], 'REWARD': [], 'QUALITY': [], 'PROBABILITY': []
+        }
+
+    def reset_stage_stats(self):
+        n_operators = len(self.operators)
+        self.stage_selected = [0] * n_operators
+        self.stage_accepted = [0] * n_operators
+        self.stage_improvement = [0.0] * n_operators
+        self.stage_cpu_time = [0.0] * n_operators
+
+    def select(self, random_number):
+        """
+        Return the operator drawn by roulette with the uniform random_number
+        """
+        cumulative = 0.0
+        for operator, probability in zip(self.operators, self.probabilities):
+            cumulative += probability
+            if random_number < cumulative:
+                return operator
+        return self.operators[-1]
+
+    def update(self, operator, improvement, cpu_time, accepted):
+        """
+        Credit operator with the improvement of the current solution obtained in cpu_time
+        """
+        idx = self.operator_index[operator]
+        self.stage_selected[idx] += 1
+        self.stage_accepted[idx] += accepted
+        self.stage_improvement[idx] += improvement
+        self.stage_cpu_time[idx] += cpu_time
+
+        reward = self.get_reward(improvement, cpu_time, 1)
+        self.quality[idx] += self.quality_learning_rate * (reward - self.quality[idx])
+
+        # Pursue the operator of best quality
+        best_idx = max(range(len(self.quality)), key=self.quality.__getitem__)
+        for other_idx in range(len(self.probabilities)):
+            target = self.max_probability if other_idx == best_idx else self.min_probability
+            self.probabilities[other_idx] += self.pursuit_learning_rate * (target - self.probabilities[other_idx])
+
+    def get_reward(self, improvement, cpu_time, evaluations):
+        if self.operator_credit == 'evaluation':
+            return improvement / max(evaluations, 1)
+        return improvement / max(cpu_time, 1e-9)
+
+    def end_stage(self, k):
+        """
+        Store the statistics of stage k and reset them for the next stage
+        """
+        for idx, operator in enumerate(self.operators):
+            self.stats['K'].append(k)
+            self.stats['NEIGHBORHOOD'].append(operator)
+            self.stats['SELECTED'].append(self.stage_selected[idx])
+            self.stats['ACCEPTED'].append(self.stage_accepted[idx])
+            self.stats['IMPROVEMENT'].append(self.stage_improvement[idx])
+            self.stats['CPU_TIME'].append(self.stage_cpu_time[idx])
+            self.stats['REWARD'].append(self.get_reward(self.stage_improvement[idx], self.stage_cpu_time[idx], self.stage_selected[idx]))
+            self.stats['QUALITY'].append(self.quality[idx])
+            self.stats['PROBABILITY'].append(self.probabilities[idx])
+        self.reset_stage_stats()
+
+    def get_stats(self):
+        return pd.DataFrame(self.stats)
@@ -0,0 +1,167 @@
+from concurrent.futures import ProcessPoolExecutor
+import math
+from multiprocessing.util import Finalize
+import numpy as np
+import pandas as pd
+from .simulated_annealing import SimulatedAnnealing
+from .sequence_evaluator import SequenceEvaluator
+from .time_budget import deadline_reached
+from .instrumentation import instrumentation
+
+# SA object of each worker process, reused by every replica run in it (see initialize_worker)
+_worker_annealing = None
+
+
+def initialize_worker(task_df, due_date, initial_solution, heuristic_parameters):
+    global _worker_annealing
+    _worker_annealing = SimulatedAnnealing(task_df, due_date, initial_solution, heuristic_parameters)
+    # Trace files of the worker removed when the worker process exits
+    Finalize(_worker_annealing, _worker_annealing.close, exitpriority=0)
+
+
+def run_replica(solution, temperature, rng_state, round_idx, moves):
+    """
+    Run moves perturbations of one replica at its temperature in a worker process. Only
+    the permutation, objective, temperature and RNG state cross the process boundary.
+    """
+    simulated_annealing_obj = _worker_annealing
+    simulated_annealing_obj.load_solution(solution)
+    simulated_annealing_obj.set_rng_state(rng_state)
+    perturbations_accepted = simulated_annealing_obj.run_stage(temperature, round_idx, moves)
+
+    return {
+        'solution': simulated_annealing_obj.current_solution,
+        'obj': simulated_annealing_obj.current_obj,
+        'best_solution': simulated_annealing_obj.global_best_sol,
+        'best_obj': simulated_annealing_obj.global_best_obj,
+        'rng_state': simulated_annealing_obj.get_rng_state(),
+        'perturbations_accepted': perturbations_accepted
+    }
+
+
+class ParallelTempering:
+    def __init__(self, task_df, due_date, initial_solution, heuristic_parameters, tempering_parameters):
+        """
+        Replica-exchange SA: n_replicas chains run the SA neighborhoods at a geometric ladder of
+        fixed temperatures, from the initial temperature of SimulatedAnnealing down to
+        coldest_temperature_ratio times it. After each round of exchange_moves perturbations,
+        adjacent temperatures try to swap their solutions with the Metropolis criterion
+        min(1, exp((1/T_i - 1/T_j) * (E_i - E_j))).
+        """
+        self.task_df = task_df
+        self.due_date = due_date
+        self.initial_solution = initial_solution
+        self.heuristic_parameters = heuristic_parameters
+
+        # Algorithm control attributes
+        self.n_replicas = tempering_parameters['n_replicas']
+        self.max_workers = tempering_parameters.get('max_workers')
+        self.coldest_temperature_ratio = tempering_parameters.get('coldest_temperature_ratio', 0.01)
+        self.exchange_moves = tempering_parameters.get('exchange_moves', 5 * len(task_df))
+        self.rounds_stop_criteria = tempering_parameters.get('rounds_stop_criteria', 10)
+        self.max_rounds = tempering_parameters.get('max_rounds', 1000)
+        self.deadline = heuristic_parameters.get('deadline')
+        self.interrupted = False
+
+        # Seeds for each temperature and for the exchanges
+        seed_sequences = np.random.SeedSequence(heuristic_parameters.get('seed')).spawn(self.n_replicas + 1)
+        self.rng_states = [np.random.default_rng(seed).bit_generator.state for seed in seed_sequences[:-1]]
+        self.exchange_rng = np.random.default_rng(seed_sequences[-1])
+
+        # Global best solution and algorithm trace
+        self.global_best_obj = None
+        self.global_best_sol = None
+        self.trace = {'ROUND': [], 'TEMPERATURE': [], 'OBJ': [], 'BEST_OBJ': [], 'ACCEPTED': []}
+        self.exchanges_tested = np.zeros(self.n_replicas - 1, dtype=int)
+        self.exchanges_accepted = np.zeros(self.n_replicas - 1, dtype=int)
+
+    def get_trace(self):
+        return pd.DataFrame(self.trace)
+
+    def get_exchange_stats(self):
+        return pd.DataFrame({
+            'TEMPERATURE_HOT': self.temperatures[:-1],
+            'TEMPERATURE_COLD': self.temperatures[1:],
+            'EXCHANGES_TESTED': self.exchanges_tested,
+            'EXCHANGES_ACCEPTED': self.exchanges_accepted
+        })
+
+    def define_temperatures(self, reference_annealing):
+        initial_temperature = reference_annealing.define_initial_temperature()
+        ladder_ratio = self.coldest_temperature_ratio ** (1 / max(self.n_replicas - 1, 1))
+        return [initial_temperature * ladder_ratio ** idx for idx in range(self.n_replicas)]
+
+    def run(self):
+        # Initial temperature and solution of every replica
+        reference_annealing = SimulatedAnnealing(self.task_df, self.due_date, self.initial_solution, self.heuristic_parameters)
+        self.temperatures = self.define_temperatures(reference_annealing)
+        instrumentation.emit('pt_start', temperatures=[float(temperature) for temperature in self.temperatures])
+        solutions = [reference_annealing.current_solution] * self.n_replicas
+        objs = [reference_annealing.current_obj] * self.n_replicas
+        self.global_best_obj = reference_annealing.current_obj
+        self.global_best_sol = reference_annealing.current_solution
+        reference_annealing.close()
+
+        rounds_without_improvement = 0
+        round_idx = 0
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                initializer=initialize_worker,
+                initargs=(self.task_df, self.due_date, self.initial_solution, self.heuristic_parameters)
+            ) as executor:
+                while (rounds_without_improvement < self.rounds_stop_criteria) and (round_idx < self.max_rounds):
+                    if deadline_reached(self.deadline):
+                        instrumentation.emit('pt_stop', round=round_idx, reason='time_budget', best_obj=self.global_best_obj)
+                        break
+                    last_round_obj = self.global_best_obj
+
+                    # Run all replicas at their temperatures
+                    futures = [
+                        executor.submit(run_replica, solutions[idx], self.temperatures[idx], self.rng_states[idx], round_idx, self.exchange_moves)
+                        for idx in range(self.n_replicas)
+                    ]
+                    results = [future.result() for future in futures]
+
+                    for idx, result in enumerate(results):
+                        solutions[idx] = result['solution']
+                        objs[idx] = result['obj']
+                        self.rng_states[idx] = result['rng_state']
+                        if result['best_obj'] < self.global_best_obj:
+                            self.global_best_obj = result['best_obj']
+                            self.global_best_sol = result['best_solution']
+
+                        self.trace['ROUND'].append(round_idx)
+                        self.trace['TEMPERATURE'].append(self.temperatures[idx])
+                        self.trace['OBJ'].append(result['obj'])
+                        self.trace['BEST_OBJ'].append(self.global_best_obj)
+                        self.trace['ACCEPTED'].append(result['perturbations_accepted'])
+
+                    # Exchange solutions between adjacent temperatures (even pairs, then odd pairs)
+                    for idx in range(round_idx % 2, self.n_replicas - 1, 2):
+                        self.exchanges_tested[idx] += 1
+                        delta = (1 / self.temperatures[idx] - 1 / self.temperatures[idx + 1]) * (objs[idx] - objs[idx + 1])
+                        if (delta >= 0) or (self.exchange_rng.random() < math.exp(delta)):
+                            self.exchanges_accepted[idx] += 1
+                            solutions[idx], solutions[idx + 1] = solutions[idx + 1], solutions[idx]
+                            objs[idx], objs[idx + 1] = objs[idx + 1], objs[idx]
+
+                    if self.global_best_obj < last_round_obj:
+                        rounds_without_improvement = 0
+                    else:
+                        rounds_without_improvement += 1
+                    round_idx += 1
+                    instrumentation.emit('pt_round', round=round_idx, best_obj=self.global_best_obj, replicas_obj=[float(obj) for obj in objs])
+        except KeyboardInterrupt:
+            # Best solution re-evaluated, the interrupt may come between the updates of its objective and sequence
+            self.interrupted = True
+            self.global_best_obj, _, _ = SequenceEvaluator(self.task_df, self.due_date).solve_offset(np.asarray(self.global_best_sol))
+            instrumentation.emit('pt_stop', round=round_idx, reason='interrupt', best_obj=self.global_best_obj)
+
+        solution_df = (
+            pd.DataFrame({
+                'task_id':np.asarray(self.global_best_sol).astype(np.int64)
+            })
+            .merge(self.task_df, on='task_id')
+        )
+        return (self.global_best_obj, solution_df)
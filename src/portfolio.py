@@ -0,0 +1,138 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from .simulated_annealing import SimulatedAnnealing
+from .instrumentation import instrumentation
+
+
+def run_chain(task_df, due_date, constructive_solution, heuristic_parameters, initial_solution_type, chain_seed, perturbation_moves):
+    """
+    Run one SA chain. Everything random in the chain (initial solution and SA moves) is derived
+    from chain_seed, so calling this function again with the same arguments reproduces the chain.
+    """
+    initial_seed, sa_seed = np.random.SeedSequence(chain_seed).spawn(2)
+    rng = np.random.default_rng(initial_seed)
+
+    # Create initial solution of the chain
+    if initial_solution_type == 'constructive':
+        initial_solution = np.asarray(constructive_solution)
+    elif initial_solution_type == 'random':
+        initial_solution = rng.permutation(task_df['task_id'].to_numpy())
+    elif initial_solution_type == 'perturbed':
+        initial_solution = np.asarray(constructive_solution).copy()
+        for _ in range(perturbation_moves):
+            position_1, position_2 = rng.integers(0, len(initial_solution), size=2)
+            initial_solution[[position_1, position_2]] = initial_solution[[position_2, position_1]]
+    else:
+        raise Exception(f'Error: Initial solution type {initial_solution_type} not implemented')
+
+    chain_parameters = dict(heuristic_parameters, seed=int(sa_seed.generate_state(1)[0]))
+    simulated_annealing_obj = SimulatedAnnealing(
+        task_df=task_df,
+        due_date=due_date,
+        initial_solution=initial_solution,
+        heuristic_parameters=chain_parameters
+    )
+    SA_obj, SA_solution_df = simulated_annealing_obj.run()
+    trace = simulated_annealing_obj.get_trace()
+    simulated_annealing_obj.close()
+
+    return {
+        'obj': SA_obj,
+        'solution_df': SA_solution_df,
+        'trace': trace
+    }
+
+
+class SimulatedAnnealingPortfolio:
+    initial_solution_types = {'constructive', 'random', 'perturbed'}
+
+    def __init__(self, task_df, due_date, constructive_solution, heuristic_parameters, portfolio_parameters):
+        """
+        Runs independent SA chains in a process pool and keeps the best result. Chain seeds are
+        spawned from a single portfolio seed (np.random.SeedSequence), and are stored with
+        the chain results so that any chain can be reproduced with run_chain.
+        """
+        self.task_df = task_df
+        self.due_date = due_date
+        self.constructive_solution = constructive_solution
+        self.heuristic_parameters = heuristic_parameters
+
+        # Portfolio control attributes
+        self.n_chains = portfolio_parameters['n_chains']
+        self.max_workers = portfolio_parameters.get('max_workers')
+        self.initial_solutions = portfolio_parameters.get('initial_solutions', ['constructive', 'perturbed', 'random'])
+        self.perturbation_moves = portfolio_parameters.get('perturbation_moves', len(task_df) // 10)
+        for initial_solution_type in self.initial_solutions:
+            if initial_solution_type not in self.initial_solution_types:
+                raise Exception(f'Error: Initial solution type {initial_solution_type} not implemented')
+
+        # One seed per chain spawned from the portfolio seed
+        seed_sequence = np.random.SeedSequence(portfolio_parameters.get('seed'))
+        self.seed = seed_sequence.entropy
+        self.chain_seeds = [int(child.generate_state(1)[0]) for child in seed_sequence.spawn(self.n_chains)]
+
+        # Chains results (None for the chains cancelled by an interrupt)
+        self.chain_results = []
+        self.best_chain = None
+        self.interrupted = False
+
+    def get_chain_initial_solution_type(self, chain):
+        return self.initial_solutions[chain % len(self.initial_solutions)]
+
+    def run(self):
+        """
+        Run the chains and return the best one. On KeyboardInterrupt the chains not started
+        are cancelled, and the best of the finished chains is returned (the running chains
+        receive the interrupt too and return their best solution)
+        """
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(
+                    run_chain,
+                    self.task_df,
+                    self.due_date,
+                    self.constructive_solution,
+                    self.heuristic_parameters,
+                    self.get_chain_initial_solution_type(chain),
+                    self.chain_seeds[chain],
+                    self.perturbation_moves
+                )
+                for chain in range(self.n_chains)
+            ]
+            try:
+                self.chain_results = [future.result() for future in futures]
+            except KeyboardInterrupt:
+                self.interrupted = True
+                executor.shutdown(wait=True, cancel_futures=True)
+                self.chain_results = [self.get_finished_result(future) for future in futures]
+
+        finished_chains = [chain for chain, result in enumerate(self.chain_results) if result is not None]
+        if not finished_chains:
+            raise KeyboardInterrupt
+        self.best_chain = min(finished_chains, key=lambda chain: self.chain_results[chain]['obj'])
+        best_result = self.chain_results[self.best_chain]
+        instrumentation.emit('portfolio_summary', best_chain=self.best_chain, obj=best_result['obj'], seed=self.seed)
+        return best_result['obj'], best_result['solution_df']
+
+    @staticmethod
+    def get_finished_result(future):
+        if future.cancelled() or (future.exception() is not None):
+            return None
+        return future.result()
+
+    def get_summary(self):
+        return pd.DataFrame({
+            'CHAIN': range(self.n_chains),
+            'INITIAL_SOLUTION': [self.get_chain_initial_solution_type(chain) for chain in range(self.n_chains)],
+            'SEED': self.chain_seeds,
+            'OBJ': [result['obj'] if result is not None else None for result in self.chain_results],
+            'BEST': [chain == self.best_chain for chain in range(self.n_chains)]
+        })
+
+    def get_trace(self):
+        return pd.concat([
+            result['trace'].assign(CHAIN=chain)
+            for chain, result in enumerate(self.chain_results)
+            if result is not None
+        ], ignore_index=True)
@@ -1,12 +1,26 @@
 import pandas as pd
+import numpy as np
 from .constructive_heuristic import ConstructiveHeuristicFactory
 from .simulated_annealing import SimulatedAnnealing
+from .portfolio import SimulatedAnnealingPortfolio
+from .parallel_tempering import ParallelTempering
 from .fix_and_optimize import FixAndOptimize
+from .v_shape_search import VShapeSearch, v_shape_repair
+from .exact_solver import ExactSolver
+from .genetic_algorithm import GeneticAlgorithm
+from .variable_neighborhood_descent import VariableNeighborhoodDescent
+from .sequence_evaluator import SequenceEvaluator
+from .instrumentation import instrumentation, ConsoleSink, JsonLinesSink, MemorySink
+from .time_budget import TimeBudget, time_left
+from .lower_bounds import LowerBounds, get_gap
+from .instance_io import load_tasks
 from pyomo.opt import SolverFactory
 import time
 import os
 from dotenv import load_dotenv
 from .utils.excel_writer import ExcelWriter
+from .utils.table_writer import TableWriter
+from .solution_trace import sample_rows
 import csv
 
 class ProblemManager:
@@ -16,27 +30,73 @@ class ProblemManager:
                  run_id: str, 
                  heuristic_parameters: dict,
                  fix_and_optimize_parameters: dict, 
-                 has_constructive_heuristic: bool
+                 has_constructive_heuristic: bool,
+                 portfolio_parameters: dict = None,
+                 tempering_parameters: dict = None,
+                 has_v_shape_repair: bool = False,
+                 exact_parameters: dict = None,
+                 genetic_parameters: dict = None,
+                 vnd_parameters: dict = None,
+                 instrumentation_parameters: dict = None,
+                 budget_parameters: dict = None,
+                 checkpoint_parameters: dict = None,
+                 instance: int = 0,
+                 export_results: bool = True,
+                 export_parameters: dict = None,
+                 bound_parameters: dict = None
         ) -> None:
         self.path_data = path_data
+        self.instance = instance
 
-        self.tasks_df = self.initialize_tasks(path_data)
+        self.tasks_df = self.initialize_tasks(path_data, instance)
         self.due_date = due_date
         self.heuristic_parameters = heuristic_parameters
         self.fix_and_optimize_parameters = fix_and_optimize_parameters
 
         self.run_id = run_id
         self.has_constructive_heuristic = has_constructive_heuristic
+        self.portfolio_parameters = portfolio_parameters
+        self.tempering_parameters = tempering_parameters
+        self.has_v_shape_repair = has_v_shape_repair
+        self.exact_parameters = exact_parameters
+        self.genetic_parameters = genetic_parameters
+        self.vnd_parameters = vnd_parameters
+        self.instrumentation_parameters = instrumentation_parameters if instrumentation_parameters is not None else {}
+        self.budget_parameters = budget_parameters
+        self.checkpoint_parameters = checkpoint_parameters
+        self.export_results = export_results
+        self.export_parameters = export_parameters if export_parameters is not None else {}
+        self.bound_parameters = bound_parameters
+        self.lower_bounds = None
+        self.lower_bound = None
+        self.time_budget = None
+        self.interrupted = False
+        self.summary = None
+        if (portfolio_parameters is not None) and (tempering_parameters is not None):
+            raise Exception('Error: SA portfolio and parallel tempering can not be used together')
+        if (exact_parameters is not None) and ((portfolio_parameters is not None) or (tempering_parameters is not None)):
+            raise Exception('Error: Exact solver can not be used with SA portfolio or parallel tempering')
+        if (genetic_parameters is not None) and ((portfolio_parameters is not None) or (tempering_parameters is not None) or (exact_parameters is not None)):
+            raise Exception('Error: Genetic algorithm can not be used with SA portfolio, parallel tempering or exact solver')
+        if (checkpoint_parameters is not None) and (
+            (portfolio_parameters is not None) or (tempering_parameters is not None) or (exact_parameters is not None)
+            or (genetic_parameters is not None) or (heuristic_parameters.get('search_space', 'permutation') == 'partition')
+        ):
+            raise Exception('Error: Checkpoints are only implemented for simulated annealing and Fix-and-Optimize')
 
     @staticmethod
-    def initialize_tasks(path_data):
-        tasks_df = pd.read_csv(path_data, header=None)
-        df_columns = ['p', 'alpha', 'beta']
-        tasks_df.columns = df_columns
-        tasks_df['task_id'] = tasks_df.index
-        return tasks_df[['task_id'] + df_columns]
-
-    def export_resuls(self, SA_trace, FO_trace, results):
+    def initialize_tasks(path_data, instance=0):
+        # CSV (p, alpha, beta), OR-Library sch*.txt or binary .bin file (instance: index in multi-instance files)
+        return load_tasks(path_data, instance)
+
+    def export_resuls(self, SA_trace, FO_trace, results, portfolio_summary=None, exchange_stats=None, VND_trace=None, operator_stats=None, events=None, budget_usage=None, FO_solutions=None, lower_bounds=None):
+        """
+        Export the tables of the run to outputs/<run_id>: with table_format ('csv', 'parquet'
+        or 'npz') one file per table, streamed chunk by chunk for SA traces in stream mode,
+        and with excel (default) output.xlsx, where tables longer than excel_max_rows are
+        sampled to evenly spaced rows. SA_trace is a DataFrame or a SimulatedAnnealing, whose
+        trace is exported with its operator statistics (see SimulatedAnnealing.get_trace).
+        """
         output_directory = 'outputs/' + self.run_id
 
         # new output directory (if already exists, create suffix for folder name)
@@ -46,82 +106,406 @@ class ProblemManager:
             offset_idx += 1
         os.makedirs(output_directory)
 
-        # Create file with both outputs in it
-        output_file = output_directory + '/output.xlsx'
-        excel_writer = ExcelWriter(output_path=output_file)
-        excel_writer.new_sheet(df=results, sheet_name='Final Solution')
-        excel_writer.new_sheet(df=SA_trace, sheet_name='Simulated Annealing Trace')
-        excel_writer.new_sheet(df=FO_trace, sheet_name='Fix and Optimize Trace')
-        excel_writer.export_results()
+        tables = {
+            'Final Solution': results,
+            'Simulated Annealing Trace': SA_trace,
+            'Portfolio Chains': portfolio_summary,
+            'Replica Exchanges': exchange_stats,
+            'Operator Selection': operator_stats,
+            'VND Trace': VND_trace,
+            'Fix and Optimize Trace': FO_trace,
+            'Fix and Optimize Solutions': FO_solutions,
+            'Instrumentation': events,
+            'Time Budget': budget_usage,
+            'Lower Bounds': lower_bounds
+        }
+        tables = {name: table for name, table in tables.items() if table is not None}
+
+        # One file per table, e.g. simulated_annealing_trace.csv
+        table_format = self.export_parameters.get('table_format')
+        if table_format is not None:
+            table_writer = TableWriter(output_directory, table_format)
+            for name, table in tables.items():
+                table_writer.write_table(table.iter_trace_chunks() if isinstance(table, SimulatedAnnealing) else table, name.lower().replace(' ', '_'))
+
+        # Create file with all outputs in it (rows capped below the Excel sheet limit)
+        if self.export_parameters.get('excel', True):
+            max_rows = min(self.export_parameters.get('excel_max_rows', 1048575), 1048575)
+            output_file = output_directory + '/output.xlsx'
+            excel_writer = ExcelWriter(output_path=output_file)
+            for name, table in tables.items():
+                df = table.get_trace(max_rows) if isinstance(table, SimulatedAnnealing) else sample_rows(table, max_rows)
+                excel_writer.new_sheet(df=df, sheet_name=name)
+            excel_writer.export_results()
+
+
+
+    def configure_instrumentation(self):
+        """
+        Set the verbosity and sinks ('console', 'jsonl' and 'memory') of the instrumentation
+        """
+        sink_names = self.instrumentation_parameters.get('sinks', ['console'])
+        sinks = []
+        for sink_name in sink_names:
+            if sink_name == 'console':
+                sinks.append(ConsoleSink(self.instrumentation_parameters.get('console_interval', 1.0)))
+            elif sink_name == 'jsonl':
+                sinks.append(JsonLinesSink(self.instrumentation_parameters.get('jsonl_path', 'outputs/' + self.run_id + '_events.jsonl')))
+            elif sink_name == 'memory':
+                sinks.append(MemorySink())
+            else:
+                raise Exception(f'Error: Instrumentation sink {sink_name} not implemented')
+        instrumentation.configure(self.instrumentation_parameters.get('verbosity', 'stage'), sinks)
+
+    def get_budget_stages(self):
+        """
+        Return the stages of the run that share the time budget, in order
+        """
+        stages = ['constructive'] if self.has_constructive_heuristic else []
+        stages.append('heuristic')
+        if self.vnd_parameters is not None:
+            stages.append('vnd')
+        if (self.vnd_parameters is None) or not self.vnd_parameters.get('replace_fix_and_optimize', False):
+            stages.append('fix_and_optimize')
+        return stages
+
+    def start_budget_stage(self, stage):
+        """
+        Return the deadline of stage (None without time budget)
+        """
+        return self.time_budget.start_stage(stage) if self.time_budget is not None else None
+
+    def end_budget_stage(self, stage):
+        if self.time_budget is not None:
+            self.time_budget.end_stage(stage)
+            instrumentation.emit('budget_stage', **{key.lower(): values[-1] for key, values in self.time_budget.usage.items()})
+
+    @staticmethod
+    def with_deadline(parameters, deadline):
+        return parameters if deadline is None else dict(parameters, deadline=deadline)
+
+    def with_lower_bound(self, parameters):
+        if self.lower_bound is None:
+            return parameters
+        return dict(parameters, lower_bound=self.lower_bound, gap_stop=self.bound_parameters.get('gap_stop'))
+
+    def compute_lower_bound(self, sequence):
+        """
+        Compute the lower bounds of the instance (see LowerBounds), with the objective of
+        sequence as upper bound of the Lagrangian steps. On KeyboardInterrupt the bounds
+        already computed are kept
+        """
+        upper_bound, _, _ = SequenceEvaluator(self.tasks_df, self.due_date).solve_offset(np.asarray(sequence, dtype=np.int64))
+        self.lower_bounds = LowerBounds(self.tasks_df, self.due_date, self.bound_parameters)
+        try:
+            self.lower_bound = self.lower_bounds.compute(upper_bound)
+        except KeyboardInterrupt:
+            # Best of the bounds computed before the interrupt
+            self.interrupted = True
+            self.lower_bound = self.lower_bounds.lower_bound
+        for bound, value, seconds in zip(*self.lower_bounds.bounds.values()):
+            instrumentation.emit('lower_bound', bound=bound, value=value, seconds=seconds)
+        instrumentation.emit('lower_bound_summary', lower_bound=self.lower_bound, initial_gap=get_gap(upper_bound, self.lower_bound))
 
+    def get_bounds_report(self, obj_function):
+        """
+        Return the lower bounds with the gap of the final solution to each of them
+        """
+        bounds_df = self.lower_bounds.get_bounds()
+        bounds_df['OBJ'] = obj_function
+        bounds_df['GAP'] = [get_gap(obj_function, value) for value in bounds_df['VALUE']]
+        return bounds_df
 
+    def resume(self):
+        """
+        Continue the run saved in the checkpoint directory: Fix-and-Optimize from its
+        checkpoint if it had started, otherwise SA from its checkpoint. Both continue
+        exactly as the interrupted run would have, then the run completes as usual.
+        """
+        if self.checkpoint_parameters is None:
+            raise Exception('Error: Resume requires checkpoint parameters')
+        self.run(resume=True)
 
-    def run(self):
+    def get_checkpoint_path(self, stage):
+        directory = self.checkpoint_parameters.get('path', 'outputs/' + self.run_id + '_checkpoint')
+        return os.path.join(directory, stage + '.ckpt')
+
+    def get_resume_stage(self):
+        for stage in ['fix_and_optimize', 'simulated_annealing']:
+            if os.path.isfile(self.get_checkpoint_path(stage)):
+                return stage
+        raise Exception(f'Error: No checkpoint to resume in {os.path.dirname(self.get_checkpoint_path("simulated_annealing"))}')
+
+    def remove_checkpoints(self):
+        """
+        Remove the checkpoints of a previous run, so a resume never mixes runs
+        """
+        for stage in ['fix_and_optimize', 'simulated_annealing']:
+            if os.path.isfile(self.get_checkpoint_path(stage)):
+                os.remove(self.get_checkpoint_path(stage))
+
+    def run(self, resume=False):
+        """
+        Run the pipeline. With budget_parameters the stages stop at their share of the time
+        budget (see TimeBudget), and on KeyboardInterrupt the interrupted stage returns its
+        best solution and the later ones are skipped, so the best solution so far is exported.
+        With checkpoint_parameters, SA and Fix-and-Optimize save checkpoints (see resume).
+        Return the summary of the run (objectives, stage times and evaluation counts), and
+        without export_results nothing is written to outputs (e.g. batch runs).
+        """
+        self.configure_instrumentation()
         begin = time.time()
+        resume_stage = None
+        if resume:
+            resume_stage = self.get_resume_stage()
+        elif self.checkpoint_parameters is not None:
+            self.remove_checkpoints()
+        if self.budget_parameters is not None:
+            self.time_budget = TimeBudget(self.budget_parameters, self.get_budget_stages())
+            self.time_budget.start()
 
         # Create initial solution with constructive heuristic
-        if self.has_constructive_heuristic:
-            constructive_heuristic = ConstructiveHeuristicFactory(self.tasks_df, self.due_date)
-            (sequence_output, completion_time, f) = constructive_heuristic.run()
+        if resume_stage is not None:
+            # Initial solution replaced by the checkpoint
+            after_constructive_time = time.time()
+            sequence_output = self.tasks_df['task_id'].to_list()
+        elif self.has_constructive_heuristic:
+            self.start_budget_stage('constructive')
+            try:
+                constructive_heuristic = ConstructiveHeuristicFactory(self.tasks_df, self.due_date)
+                (sequence_output, completion_time, f) = constructive_heuristic.run()
+            except KeyboardInterrupt:
+                # Tasks in the input order as solution
+                self.interrupted = True
+                sequence_output = self.tasks_df['task_id'].to_list()
             after_constructive_time = time.time()
-            print(f'\nFinished constructive heuristic in {after_constructive_time-begin:.2f} secs')
+            self.end_budget_stage('constructive')
+            instrumentation.emit('stage_time', stage='constructive_heuristic', seconds=round(after_constructive_time-begin, 4))
         else:
             after_constructive_time = time.time()
             sequence_output = self.generate_random_solution()
 
-        # Create SA solver with initial solution previously created
-        simulated_annealing_obj = SimulatedAnnealing(
-            task_df=self.tasks_df, 
-            due_date=self.due_date, 
-            initial_solution=sequence_output, 
-            heuristic_parameters=self.heuristic_parameters
-        )
-        SA_obj, SA_solution_df = simulated_annealing_obj.run()
+        # Lower bounds for the gap of the solutions (and the gap stop criterion)
+        if (self.bound_parameters is not None) and not self.interrupted:
+            self.compute_lower_bound(sequence_output)
+        before_SA_time = time.time()
+
+        # Create SA solver (or portfolio of SA chains) with initial solution previously created
+        simulated_annealing_obj = None
+        SA_obj, SA_solution_df = None, None
         after_SA_time = time.time()
-        print(f'\nFinished simulated annealing in {after_SA_time-after_constructive_time:.2f} secs')
+        if (resume_stage != 'fix_and_optimize') and not self.interrupted:
+            deadline = self.start_budget_stage('heuristic')
+            simulated_annealing_obj = self.create_heuristic(sequence_output, deadline)
+            if resume_stage == 'simulated_annealing':
+                SA_obj, SA_solution_df = simulated_annealing_obj.resume(self.get_checkpoint_path('simulated_annealing'))
+            else:
+                SA_obj, SA_solution_df = simulated_annealing_obj.run()
+            if self.has_v_shape_repair:
+                SA_obj, SA_solution_df = self.repair_solution(SA_solution_df)
+            self.interrupted = simulated_annealing_obj.interrupted
+            after_SA_time = time.time()
+            self.end_budget_stage('heuristic')
+            instrumentation.emit('stage_time', stage='simulated_annealing', seconds=round(after_SA_time-before_SA_time, 4), obj=SA_obj)
     
+        # Run variable neighborhood descent (before or instead of fix-and-optimize)
+        variable_neighborhood_descent = None
+        obj_function, solution = SA_obj, SA_solution_df
+        if self.interrupted and (solution is None):
+            # Interrupted before the heuristic, the initial solution is the result
+            obj_function, solution = self.get_solution(sequence_output)
+        after_VND_time = after_SA_time
+        if (self.vnd_parameters is not None) and (resume_stage != 'fix_and_optimize') and not self.interrupted:
+            deadline = self.start_budget_stage('vnd')
+            variable_neighborhood_descent = VariableNeighborhoodDescent(self.tasks_df, self.due_date, self.with_deadline(self.vnd_parameters, deadline))
+            obj_function, solution = variable_neighborhood_descent.run(SA_solution_df['task_id'].to_list())
+            self.interrupted = variable_neighborhood_descent.interrupted
+            after_VND_time = time.time()
+            self.end_budget_stage('vnd')
+            instrumentation.emit('stage_time', stage='variable_neighborhood_descent', seconds=round(after_VND_time-after_SA_time, 4), obj=obj_function)
+
         # Run fix-and-optimize Matheuristic with MILP problem
-        print(f'\n\nInitializing Fix-and-Optimize algorithm\n')
-        load_dotenv('.env')
-        fix_and_optimize = FixAndOptimize(
-            initial_solution_df=SA_solution_df, 
-            due_date=self.due_date, 
-            initial_obj=SA_obj,
-            parameters=self.fix_and_optimize_parameters    
-        )
-        obj_function, solution = fix_and_optimize.run()
-        after_FO_time = time.time()
-        print(f'\nFinished fix and optimize in {after_FO_time-after_SA_time:.2f} secs')
+        fix_and_optimize = None
+        before_FO_time = after_FO_time = time.time()
+        if ('fix_and_optimize' in self.get_budget_stages()) and not self.interrupted:
+            before_FO_time = time.time()
+            deadline = self.start_budget_stage('fix_and_optimize')
+            load_dotenv('.env')
+            fix_and_optimize_parameters = self.with_lower_bound(self.with_deadline(self.fix_and_optimize_parameters, deadline))
+            if self.checkpoint_parameters is not None:
+                fix_and_optimize_parameters = dict(
+                    fix_and_optimize_parameters,
+                    checkpoint_path=self.get_checkpoint_path('fix_and_optimize'),
+                    checkpoint_interval=self.checkpoint_parameters.get('interval', 1)
+                )
+            fix_and_optimize = FixAndOptimize(
+                # Solution replaced by the checkpoint when resumed
+                initial_solution_df=solution if resume_stage != 'fix_and_optimize' else self.tasks_df, 
+                due_date=self.due_date, 
+                initial_obj=obj_function,
+                parameters=fix_and_optimize_parameters
+            )
+            if resume_stage == 'fix_and_optimize':
+                obj_function, solution = fix_and_optimize.resume(self.get_checkpoint_path('fix_and_optimize'))
+            else:
+                obj_function, solution = fix_and_optimize.run()
+            if self.has_v_shape_repair:
+                obj_function, solution = self.repair_solution(solution)
+            self.interrupted = fix_and_optimize.interrupted
+            after_FO_time = time.time()
+            self.end_budget_stage('fix_and_optimize')
+            instrumentation.emit('stage_time', stage='fix_and_optimize', seconds=round(after_FO_time-before_FO_time, 4), obj=obj_function)
 
         # Export results from SA and fix-and-optimize 
-        print(f'\n\nFinal OBJ function is: {obj_function}')
-        SA_trace = simulated_annealing_obj.get_trace()
-        FO_trace = fix_and_optimize.get_trace()
+        total_time = time.time()
+        instrumentation.emit('stage_time', stage='total', seconds=round(total_time-begin, 4), obj=obj_function, interrupted=self.interrupted)
+        self.summary = {
+            'OBJ': float(obj_function),
+            'HEURISTIC_OBJ': float(SA_obj) if SA_obj is not None else None,
+            'CONSTRUCTIVE_TIME': round(after_constructive_time-begin, 4),
+            'BOUND_TIME': round(before_SA_time-after_constructive_time, 4),
+            'HEURISTIC_TIME': round(after_SA_time-before_SA_time, 4),
+            'VND_TIME': round(after_VND_time-after_SA_time, 4),
+            'FO_TIME': round(after_FO_time-before_FO_time, 4),
+            'TOTAL_TIME': round(total_time-begin, 4),
+            # Sequence evaluations of SA (other engines do not count them)
+            'HEURISTIC_EVALUATIONS': getattr(simulated_annealing_obj, 'evaluations', None),
+            'VND_MOVES_EVALUATED': sum(variable_neighborhood_descent.trace['MOVES_EVALUATED']) if variable_neighborhood_descent is not None else None,
+            'FO_ITERATIONS': len(fix_and_optimize.solution_trace_obj) - 1 if fix_and_optimize is not None else None,
+            'LOWER_BOUND': self.lower_bound,
+            'GAP': get_gap(float(obj_function), self.lower_bound),
+            'INTERRUPTED': self.interrupted
+        }
+        if not self.export_results:
+            if isinstance(simulated_annealing_obj, SimulatedAnnealing):
+                simulated_annealing_obj.close()
+            instrumentation.close()
+            return self.summary
+        budget_usage = self.time_budget.get_usage() if self.time_budget is not None else None
+        if isinstance(simulated_annealing_obj, SimulatedAnnealing):
+            # Trace exported chunk by chunk
+            SA_trace = simulated_annealing_obj
+        else:
+            SA_trace = simulated_annealing_obj.get_trace() if simulated_annealing_obj is not None else None
+        FO_trace = fix_and_optimize.get_trace() if fix_and_optimize is not None else None
+        FO_solutions = fix_and_optimize.get_solution_trace() if fix_and_optimize is not None else None
+        VND_trace = variable_neighborhood_descent.get_trace() if variable_neighborhood_descent is not None else None
+        portfolio_summary = None
+        exchange_stats = None
+        operator_stats = None
+        memory_sink = instrumentation.get_sink(MemorySink)
+        if isinstance(simulated_annealing_obj, SimulatedAnnealing):
+            operator_stats = simulated_annealing_obj.get_operator_stats()
+        if isinstance(simulated_annealing_obj, ParallelTempering):
+            exchange_stats = simulated_annealing_obj.get_exchange_stats()
+        elif isinstance(simulated_annealing_obj, SimulatedAnnealingPortfolio):
+            portfolio_summary = simulated_annealing_obj.get_summary()
         self.export_resuls(
             SA_trace=SA_trace,
             FO_trace=FO_trace,
-            results=solution
+            results=solution,
+            portfolio_summary=portfolio_summary,
+            exchange_stats=exchange_stats,
+            VND_trace=VND_trace,
+            operator_stats=operator_stats,
+            events=memory_sink.to_dataframe() if memory_sink is not None else None,
+            budget_usage=budget_usage,
+            FO_solutions=FO_solutions,
+            lower_bounds=self.get_bounds_report(obj_function) if self.lower_bounds is not None else None
         )
-        breakpoint()
+        if isinstance(simulated_annealing_obj, SimulatedAnnealing):
+            simulated_annealing_obj.close()
+        instrumentation.close()
 
         # Export csv
         list_tasks = solution['task_id'].to_list()
         with open('AguilarMourao.csv', 'w', newline='') as file:
             writer = csv.writer(file)
             writer.writerow(list_tasks)
+        return self.summary
 
         
+    def repair_solution(self, solution_df):
+        """
+        Return tuple (obj_function, solution_df) of the V-shaped version of the solution
+        """
+        obj_function, sequence = v_shape_repair(solution_df['task_id'].to_list(), self.tasks_df, self.due_date)
+        _, repaired_df = self.get_solution(sequence)
+        instrumentation.emit('v_shape_repair', obj=obj_function)
+        return obj_function, repaired_df
+
+    def get_solution(self, sequence):
+        """
+        Return tuple (obj_function, solution_df) of sequence with its optimal offset
+        """
+        obj_function, offset, _ = SequenceEvaluator(self.tasks_df, self.due_date).solve_offset(np.asarray(sequence, dtype=np.int64))
+        solution_df = pd.DataFrame({'task_id': sequence}).merge(self.tasks_df, on='task_id')
+        solution_df['task_end'] = solution_df['p'].cumsum() + offset
+        return obj_function, solution_df
+
+    def create_heuristic(self, sequence_output, deadline):
+        """
+        Return the SA solver (or portfolio of SA chains, or the engine replacing it) starting
+        from sequence_output
+        """
+        heuristic_parameters = self.with_lower_bound(self.with_deadline(self.heuristic_parameters, deadline))
+        if self.checkpoint_parameters is not None:
+            heuristic_parameters = dict(
+                heuristic_parameters,
+                checkpoint_path=self.get_checkpoint_path('simulated_annealing'),
+                checkpoint_interval=self.checkpoint_parameters.get('interval', 1)
+            )
+        if self.exact_parameters is not None:
+            exact_parameters = self.exact_parameters
+            if deadline is not None:
+                time_limit = self.exact_parameters.get('time_limit')
+                exact_parameters = dict(exact_parameters, time_limit=time_left(deadline) if time_limit is None else min(time_limit, time_left(deadline)))
+            return ExactSolver(
+                task_df=self.tasks_df,
+                due_date=self.due_date,
+                exact_parameters=exact_parameters,
+                initial_solution=sequence_output
+            )
+        elif self.genetic_parameters is not None:
+            return GeneticAlgorithm(
+                task_df=self.tasks_df,
+                due_date=self.due_date,
+                initial_solution=sequence_output,
+                heuristic_parameters=heuristic_parameters,
+                genetic_parameters=self.genetic_parameters
+            )
+        elif self.tempering_parameters is not None:
+            return ParallelTempering(
+                task_df=self.tasks_df,
+                due_date=self.due_date,
+                initial_solution=sequence_output,
+                heuristic_parameters=heuristic_parameters,
+                tempering_parameters=self.tempering_parameters
+            )
+        elif self.portfolio_parameters is not None:
+            return SimulatedAnnealingPortfolio(
+                task_df=self.tasks_df,
+                due_date=self.due_date,
+                constructive_solution=sequence_output,
+                heuristic_parameters=heuristic_parameters,
+                portfolio_parameters=self.portfolio_parameters
+            )
+        elif self.heuristic_parameters.get('search_space', 'permutation') == 'partition':
+            return VShapeSearch(
+                task_df=self.tasks_df,
+                due_date=self.due_date,
+                initial_solution=sequence_output,
+                heuristic_parameters=heuristic_parameters
+            )
+        else:
+            return SimulatedAnnealing(
+                task_df=self.tasks_df, 
+                due_date=self.due_date, 
+                initial_solution=sequence_output, 
+                heuristic_parameters=heuristic_parameters
+            )
+
     def generate_random_solution(self):
-        task_df = self.tasks_df
-        df_return = pd.DataFrame()
-        while len(task_df) > 0:
-            # Seleciona uma linha aleatória
-            sample = task_df.sample()
-            
-            # Concatena a linha selecionada ao df_return
-            df_return = pd.concat([df_return, sample])
-            
-            # Remove a linha selecionada do task_df
-            task_df = task_df.drop(sample.index)
-
-        return df_return['task_id'].to_list()
\ No newline at end of file
+        # Random permutation of tasks, seeded by SA seed (if any)
+        rng = np.random.default_rng(self.heuristic_parameters.get('seed'))
+        return rng.permutation(self.tasks_df['task_id'].to_numpy()).tolist()
\ No newline at end of file
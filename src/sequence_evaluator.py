@@ -0,0 +1,481 @@
+from bisect import bisect_right
+import numpy as np
+
+
+class SequenceEvaluator:
+    def __init__(self, task_df, due_date):
+        """
+        Solver-free evaluator for a fixed sequence. For a given order the completion
+        time of the k-th task is S_k + offset (S = cumulative processing time), and the
+        objective is convex piecewise-linear in the offset, with breakpoints where a
+        task completes exactly at the due date. The slope to the right of the breakpoint
+        of task k is sum(beta[k:]) - sum(alpha[:k-1]), so the optimal offset is given by
+        a weighted-median scan over the cumulative alpha + beta weights, clipped to
+        [0, due_date] like the offset variable of the LP model.
+        """
+        self.due_date = due_date
+
+        # Task parameters indexed by task_id
+        array_size = int(task_df['task_id'].max()) + 1
+        task_ids = task_df['task_id'].to_numpy(dtype=np.int64)
+        self.p = np.zeros(array_size, dtype=np.float64)
+        self.alpha = np.zeros(array_size, dtype=np.float64)
+        self.beta = np.zeros(array_size, dtype=np.float64)
+        self.p[task_ids] = task_df['p'].to_numpy(dtype=np.float64)
+        self.alpha[task_ids] = task_df['alpha'].to_numpy(dtype=np.float64)
+        self.beta[task_ids] = task_df['beta'].to_numpy(dtype=np.float64)
+
+    def evaluate_solution(self, solution_to_evaluate) -> float:
+        obj_function, _, tasks_before_dd = self.solve_offset(solution_to_evaluate)
+        return obj_function, tasks_before_dd
+
+    def solve_offset(self, solution_to_evaluate):
+        """
+        Return tuple (obj_function, offset, tasks_before_dd) for the given sequence
+        """
+        return self.solve_offset_from_prefix(*self.get_prefix_sums(solution_to_evaluate))
+
+    def get_prefix_sums(self, solution_to_evaluate):
+        """
+        Return prefix sums (S, A, B, AS, BS) of p, alpha, beta, alpha * S and beta * S with a
+        leading zero (index k holds the sum over the first k tasks)
+        """
+        sequence = np.asarray(solution_to_evaluate, dtype=np.int64)
+        p = self.p[sequence]
+        alpha = self.alpha[sequence]
+        beta = self.beta[sequence]
+
+        S = self.prefix_sum(p)
+        A = self.prefix_sum(alpha)
+        B = self.prefix_sum(beta)
+        AS = self.prefix_sum(alpha * S[1:])
+        BS = self.prefix_sum(beta * S[1:])
+        return S, A, B, AS, BS
+
+    @staticmethod
+    def get_straddling_position(A, B):
+        """
+        Return k (1-indexed) of the task completed at the due date when the offset is not bounded:
+        last k such that alpha + beta of the tasks before it is <= total beta
+        """
+        n = len(A) - 1
+        return min(int(np.searchsorted(A + B, B[n], side='right')), n)
+
+    def solve_offset_from_prefix(self, S, A, B, AS, BS):
+        k_star = self.get_straddling_position(A, B)
+        offset = max(self.due_date - S[k_star], 0)
+
+        # Tasks completed before (or at) due date
+        tasks_before_dd = int(np.searchsorted(S, self.due_date - offset, side='right')) - 1
+        obj_function = self.weighted_deviation(S, A, B, AS, BS, offset, tasks_before_dd)
+        return float(obj_function), float(offset), tasks_before_dd
+
+    def weighted_deviation(self, S, A, B, AS, BS, offset, tasks_before_dd):
+        m = tasks_before_dd
+        n = len(S) - 1
+        start_to_due_date = self.due_date - offset
+        earliness = A[m] * start_to_due_date - AS[m]
+        tardiness = (BS[n] - BS[m]) - (B[n] - B[m]) * start_to_due_date
+        return earliness + tardiness
+
+    def evaluate_population(self, population):
+        """
+        Return arrays (obj_function, offset, tasks_before_dd) of each row of the (P, n)
+        population of sequences, with the closed form applied row-wise in one NumPy pass
+        """
+        population = np.asarray(population, dtype=np.int64)
+        n_rows, n = population.shape
+        rows = np.arange(n_rows)
+        S = self.prefix_sum_rows(self.p[population])
+        A = self.prefix_sum_rows(self.alpha[population])
+        B = self.prefix_sum_rows(self.beta[population])
+        AS = self.prefix_sum_rows(self.alpha[population] * S[:, 1:])
+        BS = self.prefix_sum_rows(self.beta[population] * S[:, 1:])
+
+        # Straddling task (see get_straddling_position) and optimal offset of each row
+        B_total = B[:, n]
+        k_star = np.minimum((A + B <= B_total[:, None]).sum(axis=1), n)
+        offset = np.maximum(self.due_date - S[rows, k_star], 0)
+        start_to_due_date = self.due_date - offset
+
+        # Tasks completed before (or at) due date
+        m = (S <= start_to_due_date[:, None]).sum(axis=1) - 1
+        earliness = A[rows, m] * start_to_due_date - AS[rows, m]
+        tardiness = (BS[:, n] - BS[rows, m]) - (B_total - B[rows, m]) * start_to_due_date
+        return earliness + tardiness, offset, m
+
+    @staticmethod
+    def prefix_sum(values):
+        prefix = np.zeros(len(values) + 1, dtype=np.float64)
+        np.cumsum(values, out=prefix[1:])
+        return prefix
+
+    @staticmethod
+    def prefix_sum_rows(values):
+        prefix = np.zeros((values.shape[0], values.shape[1] + 1), dtype=np.float64)
+        np.cumsum(values, axis=1, out=prefix[:, 1:])
+        return prefix
+
+
+class IncrementalEvaluator(SequenceEvaluator):
+    def __init__(self, task_df, due_date):
+        """
+        Keeps the prefix sums (S, A, B, alpha*S, beta*S) of the current sequence so that a
+        swap or insertion can be evaluated without rebuilding them. Such a move only
+        changes the prefix sums of a contiguous segment [lo, hi), where each entry is the
+        old entry at k + shift plus a constant, and adds a constant to alpha*S and beta*S
+        after it. Both weighted-median searches (straddling task and tasks before the due
+        date) then become binary searches over the old prefix arrays, O(log n) per move.
+        The state is only rebuilt by commit(), when the move is accepted.
+        """
+        super().__init__(task_df, due_date)
+        self.p_values = self.p.tolist()
+        self.alpha_values = self.alpha.tolist()
+        self.beta_values = self.beta.tolist()
+        self.sequence = None
+        self.pending_move = None
+
+    def load_solution(self, solution_to_evaluate):
+        """
+        Reset state to the given sequence and return tuple (obj_function, tasks_before_dd)
+        """
+        sequence = np.asarray(solution_to_evaluate, dtype=np.int64)
+        self.sequence = sequence.tolist()
+        self.pending_move = None
+
+        p = self.p[sequence]
+        alpha = self.alpha[sequence]
+        beta = self.beta[sequence]
+        S = self.prefix_sum(p)
+        A = self.prefix_sum(alpha)
+        B = self.prefix_sum(beta)
+        AS = self.prefix_sum(alpha * S[1:])
+        BS = self.prefix_sum(beta * S[1:])
+
+        # Python lists make scalar access and bisect much cheaper than NumPy indexing
+        W = A + B
+        self.S, self.A, self.B = S.tolist(), A.tolist(), B.tolist()
+        self.W = W.tolist()
+        self.AS, self.BS = AS.tolist(), BS.tolist()
+
+        # NumPy arrays for the batch evaluation of many moves
+        self.prefix_arrays = (S, A, B, W, AS, BS)
+        self.sequence_array = sequence
+        self.current_obj = None
+
+        obj_function, _, tasks_before_dd = self.solve_offset_from_prefix(S, A, B, AS, BS)
+        self.current_obj = obj_function
+        return obj_function, tasks_before_dd
+
+    def commit(self):
+        """
+        Apply the last evaluated move to the current state
+        """
+        if self.pending_move is None:
+            raise Exception('Error: No evaluated move to commit')
+        move_type, position_1, position_2 = self.pending_move
+        sequence = self.sequence
+        if move_type == 'swap':
+            sequence[position_1], sequence[position_2] = sequence[position_2], sequence[position_1]
+        else:
+            sequence.insert(position_2, sequence.pop(position_1))
+        self.load_solution(sequence)
+
+    def evaluate_swap(self, position_1, position_2):
+        """
+        Return tuple (obj_function, tasks_before_dd) of the current sequence with the
+        tasks at positions position_1 and position_2 (0-indexed) swapped
+        """
+        self.pending_move = ('swap', position_1, position_2)
+        i, j = sorted((position_1, position_2))
+        if i == j:
+            return self.evaluate_segment(1, 1, 0, 0, 0, 0, 0, 0, 0, 0)
+
+        S, A, B, AS, BS = self.S, self.A, self.B, self.AS, self.BS
+        p, alpha, beta = self.p_values, self.alpha_values, self.beta_values
+        task_i = self.sequence[i]
+        task_j = self.sequence[j]
+        lo, hi = i + 1, j + 1
+
+        dS = p[task_j] - p[task_i]
+        dA = alpha[task_j] - alpha[task_i]
+        dB = beta[task_j] - beta[task_i]
+
+        # Segment offsets from the new first entry of the segment
+        S_lo = S[lo - 1] + p[task_j]
+        cAS = AS[lo - 1] + alpha[task_j] * S_lo - AS[lo] - dS * A[lo]
+        cBS = BS[lo - 1] + beta[task_j] * S_lo - BS[lo] - dS * B[lo]
+
+        # Tail offsets from the new entry at hi (task_i completes at the old S[hi])
+        tailAS = AS[hi - 1] + dS * A[hi - 1] + cAS + alpha[task_i] * S[hi] - AS[hi]
+        tailBS = BS[hi - 1] + dS * B[hi - 1] + cBS + beta[task_i] * S[hi] - BS[hi]
+        return self.evaluate_segment(lo, hi, 0, dS, dA, dB, cAS, cBS, tailAS, tailBS)
+
+    def evaluate_insertion(self, from_position, to_position):
+        """
+        Return tuple (obj_function, tasks_before_dd) of the current sequence with the task
+        at from_position removed and reinserted so that it ends at to_position (0-indexed)
+        """
+        self.pending_move = ('insertion', from_position, to_position)
+        if from_position == to_position:
+            return self.evaluate_segment(1, 1, 0, 0, 0, 0, 0, 0, 0, 0)
+
+        S, A, B, AS, BS = self.S, self.A, self.B, self.AS, self.BS
+        task = self.sequence[from_position]
+        p, alpha, beta = self.p_values[task], self.alpha_values[task], self.beta_values[task]
+
+        if from_position < to_position:
+            # Tasks in between move one position earlier and finish p earlier
+            lo, hi, shift = from_position + 1, to_position + 1, 1
+            dS, dA, dB = -p, -alpha, -beta
+            cAS = AS[lo - 1] - AS[lo] + p * A[lo]
+            cBS = BS[lo - 1] - BS[lo] + p * B[lo]
+
+            # Task completes at the old S[hi]
+            tailAS = AS[hi] - p * A[hi] + cAS + alpha * S[hi] - AS[hi]
+            tailBS = BS[hi] - p * B[hi] + cBS + beta * S[hi] - BS[hi]
+        else:
+            # Task becomes the first entry of the segment, the others finish p later
+            lo, hi, shift = to_position + 1, from_position + 2, -1
+            dS, dA, dB = p, alpha, beta
+            cAS = alpha * (S[lo - 1] + p) - p * A[lo - 1]
+            cBS = beta * (S[lo - 1] + p) - p * B[lo - 1]
+            tailAS = AS[hi - 2] + p * A[hi - 2] + cAS - AS[hi - 1]
+            tailBS = BS[hi - 2] + p * B[hi - 2] + cBS - BS[hi - 1]
+        return self.evaluate_segment(lo, hi, shift, dS, dA, dB, cAS, cBS, tailAS, tailBS)
+
+    def evaluate_segment(self, lo, hi, shift, dS, dA, dB, cAS, cBS, tailAS, tailBS):
+        """
+        Closed-form evaluation of the sequence whose prefix sums X' are:
+            X'[k] = X[k]                                   for k < lo
+            X'[k] = X[k + shift] + dX                      for lo <= k < hi
+            AS'[k] = AS[k + shift] + dS * A[k + shift] + cAS (same for BS with B)
+            X'[k] = X[k], AS'[k] = AS[k] + tailAS          for k >= hi
+        """
+        S, A, B, W, AS, BS = self.S, self.A, self.B, self.W, self.AS, self.BS
+        n = len(S) - 1
+        B_total = B[n]
+
+        def count_less_equal(X, value, dX):
+            # Number of k in [0, n] with X'[k] <= value (X' is non-decreasing)
+            r = bisect_right(X, value)
+            r_segment = bisect_right(X, value - dX) - shift
+            return min(r, lo) + min(max(r_segment, lo), hi) - lo + max(r - hi, 0)
+
+        def point(X, dX, k):
+            if k < lo:
+                return X[k]
+            elif k < hi:
+                return X[k + shift] + dX
+            return X[k]
+
+        def point_weighted(XS, X, c, tail, k):
+            if k < lo:
+                return XS[k]
+            elif k < hi:
+                return XS[k + shift] + dS * X[k + shift] + c
+            return XS[k] + tail
+
+        # Straddling task and optimal offset
+        k_star = min(count_less_equal(W, B_total, dA + dB), n)
+        offset = max(self.due_date - point(S, dS, k_star), 0)
+        start_to_due_date = self.due_date - offset
+
+        # Tasks completed before (or at) due date
+        m = count_less_equal(S, start_to_due_date, dS) - 1
+
+        earliness = point(A, dA, m) * start_to_due_date - point_weighted(AS, A, cAS, tailAS, m)
+        tardiness = (
+            point_weighted(BS, B, cBS, tailBS, n) - point_weighted(BS, B, cBS, tailBS, m)
+            - (B_total - point(B, dB, m)) * start_to_due_date
+        )
+        return float(earliness + tardiness), m
+
+    def evaluate_swaps(self, positions_1, positions_2):
+        """
+        Batch version of evaluate_swap: return arrays (obj_function, tasks_before_dd) of the
+        current sequence with each pair of positions swapped, in one NumPy pass. The pending
+        move is not changed.
+        """
+        S, A, B, W, AS, BS = self.prefix_arrays
+        i = np.minimum(positions_1, positions_2)
+        j = np.maximum(positions_1, positions_2)
+        task_i = self.sequence_array[i]
+        task_j = self.sequence_array[j]
+        lo, hi = i + 1, j + 1
+
+        dS = self.p[task_j] - self.p[task_i]
+        dA = self.alpha[task_j] - self.alpha[task_i]
+        dB = self.beta[task_j] - self.beta[task_i]
+
+        S_lo = S[lo - 1] + self.p[task_j]
+        cAS = AS[lo - 1] + self.alpha[task_j] * S_lo - AS[lo] - dS * A[lo]
+        cBS = BS[lo - 1] + self.beta[task_j] * S_lo - BS[lo] - dS * B[lo]
+        tailAS = AS[hi - 1] + dS * A[hi - 1] + cAS + self.alpha[task_i] * S[hi] - AS[hi]
+        tailBS = BS[hi - 1] + dS * B[hi - 1] + cBS + self.beta[task_i] * S[hi] - BS[hi]
+        shift = np.zeros(len(i), dtype=np.int64)
+        return self.evaluate_segments(i == j, lo, hi, shift, dS, dA, dB, cAS, cBS, tailAS, tailBS)
+
+    def evaluate_insertions(self, from_positions, to_positions):
+        """
+        Batch version of evaluate_insertion, see evaluate_swaps
+        """
+        S, A, B, W, AS, BS = self.prefix_arrays
+        task = self.sequence_array[from_positions]
+        p, alpha, beta = self.p[task], self.alpha[task], self.beta[task]
+        forward = from_positions < to_positions
+
+        # Forward: tasks in between finish p earlier. Backward: the task starts the segment.
+        lo = np.where(forward, from_positions + 1, to_positions + 1)
+        hi = np.where(forward, to_positions + 1, from_positions + 2)
+        shift = np.where(forward, 1, -1)
+        dS, dA, dB = np.where(forward, -p, p), np.where(forward, -alpha, alpha), np.where(forward, -beta, beta)
+
+        cAS = np.where(forward, AS[lo - 1] - AS[lo] + p * A[lo], alpha * (S[lo - 1] + p) - p * A[lo - 1])
+        cBS = np.where(forward, BS[lo - 1] - BS[lo] + p * B[lo], beta * (S[lo - 1] + p) - p * B[lo - 1])
+        # Indices of both branches are clipped, since np.where evaluates both
+        front = np.minimum(hi, len(S) - 1)
+        back = np.maximum(hi - 2, 0)
+        tailAS = np.where(
+            forward, -p * A[front] + cAS + alpha * S[front],
+            AS[back] + p * A[back] + cAS - AS[hi - 1]
+        )
+        tailBS = np.where(
+            forward, -p * B[front] + cBS + beta * S[front],
+            BS[back] + p * B[back] + cBS - BS[hi - 1]
+        )
+        identity = from_positions == to_positions
+        return self.evaluate_segments(identity, lo, hi, shift, dS, dA, dB, cAS, cBS, tailAS, tailBS)
+
+    def evaluate_segments(self, identity, lo, hi, shift, dS, dA, dB, cAS, cBS, tailAS, tailBS):
+        """
+        Batch version of evaluate_segment, one move per entry of the parameter arrays. Moves
+        flagged by identity leave the sequence unchanged.
+        """
+        S, A, B, W, AS, BS = self.prefix_arrays
+        n = len(S) - 1
+        B_total = B[n]
+
+        # Identity moves as an empty segment
+        lo, hi = np.where(identity, 1, lo), np.where(identity, 1, hi)
+        shift = np.where(identity, 0, shift)
+        dS, dA, dB = [np.where(identity, 0.0, value) for value in (dS, dA, dB)]
+        cAS, cBS, tailAS, tailBS = [np.where(identity, 0.0, value) for value in (cAS, cBS, tailAS, tailBS)]
+
+        def count_less_equal(X, value, dX):
+            r = np.searchsorted(X, value, side='right')
+            r_segment = np.searchsorted(X, value - dX, side='right') - shift
+            return np.minimum(r, lo) + np.minimum(np.maximum(r_segment, lo), hi) - lo + np.maximum(r - hi, 0)
+
+        def segment_index(k):
+            return np.clip(k + shift, 0, n)
+
+        def point(X, dX, k):
+            return np.where((k >= lo) & (k < hi), X[segment_index(k)] + dX, X[k])
+
+        def point_weighted(XS, X, c, tail, k):
+            k_shift = segment_index(k)
+            return np.where(k < lo, XS[k], np.where(k < hi, XS[k_shift] + dS * X[k_shift] + c, XS[k] + tail))
+
+        # Straddling task and optimal offset
+        k_star = np.minimum(count_less_equal(W, B_total, dA + dB), n)
+        offset = np.maximum(self.due_date - point(S, dS, k_star), 0)
+        start_to_due_date = self.due_date - offset
+
+        # Tasks completed before (or at) due date
+        m = count_less_equal(S, start_to_due_date, dS) - 1
+        n_array = np.full(len(lo), n)
+
+        earliness = point(A, dA, m) * start_to_due_date - point_weighted(AS, A, cAS, tailAS, m)
+        tardiness = (
+            point_weighted(BS, B, cBS, tailBS, n_array) - point_weighted(BS, B, cBS, tailBS, m)
+            - (B_total - point(B, dB, m)) * start_to_due_date
+        )
+        return earliness + tardiness, m
+
+    def evaluate_rotations(self, begins, splits, ends):
+        """
+        Return arrays (obj_function, tasks_before_dd) of the current sequence with each range
+        begin..end (inclusive) rotated so that the tasks from split on come first, i.e.
+        sequence[begin:end + 1] = sequence[split:end + 1] + sequence[begin:split], for
+        begin < split <= end. Insertions and block (Or-opt) moves in both directions are
+        rotations. The pending move is not changed.
+
+        The rotated range holds two shifted copies of the old prefix sums: positions
+        begin..begin + len_1 read X[k + split - begin] + d_1 (len_1 = end - split + 1) and the
+        rest X[k - len_1] + d_2, and the weighted sums after end change by a constant.
+        """
+        S, A, B, W, AS, BS = self.prefix_arrays
+        n = len(S) - 1
+        B_total = B[n]
+        begins, splits, ends = (np.asarray(positions, dtype=np.int64) for positions in (begins, splits, ends))
+        len_1 = ends - splits + 1
+        shift_1, shift_2 = splits - begins, -len_1
+        middle = begins + len_1
+
+        # Offsets of S, A and B in each piece, and constants of the weighted sums
+        d_1 = [X[begins] - X[splits] for X in (S, A, B)]
+        d_2 = [X[ends + 1] - X[splits] for X in (S, A, B)]
+        c_1 = [XS[begins] - XS[splits] - d_1[0] * X[splits] for XS, X in ((AS, A), (BS, B))]
+        c_2 = [
+            XS[ends + 1] + d_1[0] * X[ends + 1] + c - XS[begins] - d_2[0] * X[begins]
+            for XS, X, c in ((AS, A, c_1[0]), (BS, B, c_1[1]))
+        ]
+        tail = [XS[splits] + d_2[0] * X[splits] + c - XS[ends + 1] for XS, X, c in ((AS, A, c_2[0]), (BS, B, c_2[1]))]
+
+        def count_less_equal(X, value, dX_1, dX_2):
+            # Number of k in [0, n] with X'[k] <= value, counted in each piece of X'
+            r = np.searchsorted(X, value, side='right')
+            r_1 = np.searchsorted(X, value - dX_1, side='right')
+            r_2 = np.searchsorted(X, value - dX_2, side='right')
+            return (
+                np.minimum(r, begins + 1) + np.maximum(r - ends - 2, 0)
+                + np.clip(r_1 - splits - 1, 0, len_1) + np.clip(r_2 - begins - 1, 0, shift_1)
+            )
+
+        def piece(k):
+            # 0 before the range, 1 and 2 for the rotated pieces, 3 after the range
+            return np.where(k <= begins, 0, np.where(k <= middle, 1, np.where(k <= ends + 1, 2, 3)))
+
+        def point(X, dX_1, dX_2, k, k_piece):
+            index_1, index_2 = np.clip(k + shift_1, 0, n), np.clip(k + shift_2, 0, n)
+            return np.select([k_piece == 1, k_piece == 2], [X[index_1] + dX_1, X[index_2] + dX_2], X[k])
+
+        def point_weighted(XS, X, c_piece_1, c_piece_2, tail_XS, k, k_piece):
+            index_1, index_2 = np.clip(k + shift_1, 0, n), np.clip(k + shift_2, 0, n)
+            return np.select(
+                [k_piece == 0, k_piece == 1, k_piece == 2],
+                [XS[k], XS[index_1] + d_1[0] * X[index_1] + c_piece_1, XS[index_2] + d_2[0] * X[index_2] + c_piece_2],
+                XS[k] + tail_XS
+            )
+
+        # Straddling task and optimal offset
+        k_star = np.minimum(count_less_equal(W, B_total, d_1[1] + d_1[2], d_2[1] + d_2[2]), n)
+        offset = np.maximum(self.due_date - point(S, d_1[0], d_2[0], k_star, piece(k_star)), 0)
+        start_to_due_date = self.due_date - offset
+
+        # Tasks completed before (or at) due date
+        m = count_less_equal(S, start_to_due_date, d_1[0], d_2[0]) - 1
+        m_piece = piece(m)
+        n_array = np.full(len(begins), n)
+        n_piece = piece(n_array)
+
+        earliness = point(A, d_1[1], d_2[1], m, m_piece) * start_to_due_date - point_weighted(AS, A, c_1[0], c_2[0], tail[0], m, m_piece)
+        tardiness = (
+            point_weighted(BS, B, c_1[1], c_2[1], tail[1], n_array, n_piece)
+            - point_weighted(BS, B, c_1[1], c_2[1], tail[1], m, m_piece)
+            - (B_total - point(B, d_1[2], d_2[2], m, m_piece)) * start_to_due_date
+        )
+        return earliness + tardiness, m
+
+    def get_swap_delta_matrix(self):
+        """
+        Return the (n, n) matrix of objective changes of swapping positions i and j of the
+        current sequence (symmetric, zero diagonal)
+        """
+        n = len(self.sequence)
+        positions_1, positions_2 = np.triu_indices(n, 1)
+        obj_function, _ = self.evaluate_swaps(positions_1, positions_2)
+        delta = np.zeros((n, n))
+        delta[positions_1, positions_2] = obj_function - self.current_obj
+        return delta + delta.T
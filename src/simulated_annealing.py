@@ -1,29 +1,59 @@
 import numpy as np
 import pandas as pd
 from .lp_problem import ProblemEvaluator
+from .sequence_evaluator import SequenceEvaluator, IncrementalEvaluator
+from .evaluation_cache import PermutationHash, EvaluationCache
+from .operator_selection import AdaptivePursuit
+from .solution_trace import SolutionTrace, StageStatistics
+from .instrumentation import instrumentation
+from .time_budget import deadline_reached
+from .checkpoint import write_checkpoint, read_checkpoint
+from .lower_bounds import get_gap, gap_reached
+from . import stage_kernel
 import math
+import time
 
 class SimulatedAnnealing:
     neighborhood_types = {1, 2, 3, 4}
+    evaluator_engines = {'LP', 'closed_form', 'incremental'}
+    batch_selections = {'metropolis', 'best'}
+    stage_kernels = {'python', 'numba'}
+    operator_selections = {'fixed', 'adaptive_pursuit'}
+    min_batch_size = 16
+    random_block_size = 4096
+    deadline_check_interval = 1024
     
     def __init__(self, task_df, due_date, initial_solution, heuristic_parameters):
         self.task_df = task_df
         self.due_date = due_date                
 
-        # Initialize Lp ProblemEvaluator
-        self.problem_evaluator = ProblemEvaluator(task_df, due_date, problem_type='LP')
-
-        # Initialize SA algorithm information
-        self.current_obj, self.tasks_before_dd = self.problem_evaluator.evaluate_solution(initial_solution)
-        self.current_solution = initial_solution
-
-        # Global best solution and algorithm trace
-        self.global_best_obj = self.current_obj
-        self.global_best_sol = self.current_solution
-        self.obj_func_trace = [self.current_obj]
-        self.obj_func_trace_k = [0]
-        self.obj_func_trace_n = [0]
-        self.neighborhood_type_trace = [None]
+        # Seeded random generator, numbers are drawn in blocks
+        self.rng = np.random.default_rng(heuristic_parameters.get('seed'))
+        self.random_numbers = []
+        self.random_index = 0
+        self.random_block_state = None
+
+        # Rank of each task by descending alpha (used to sort the after due date part)
+        alpha_order = task_df.sort_values(by='alpha', ascending=False, kind='stable')['task_id'].to_numpy()
+        self.alpha_rank = np.empty(task_df['task_id'].max() + 1, dtype=np.int32)
+        self.alpha_rank[alpha_order] = np.arange(len(alpha_order), dtype=np.int32)
+
+        # Initialize evaluator engine (LP solved by Gurobi or solver-free closed form)
+        self.evaluator_engine = heuristic_parameters.get('evaluator_engine', 'LP')
+        self.solver_name = heuristic_parameters.get('solver_name', 'gurobi')
+        self.persistent_solver = heuristic_parameters.get('persistent_solver', False)
+        self.problem_evaluator = self.create_problem_evaluator(self.evaluator_engine)
+
+        # Objective values of visited permutations by hash (disabled if cache_size is 0)
+        self.cache_size = heuristic_parameters.get('cache_size', 0)
+        self.evaluation_cache = EvaluationCache(self.cache_size) if self.cache_size > 0 else None
+        self.permutation_hash = PermutationHash(len(initial_solution), len(self.alpha_rank))
+
+        # Current solution, global best solution and algorithm trace (in memory, ring buffer or streamed to disk)
+        self.solution_trace = SolutionTrace(['OBJ', 'K', 'N', 'NEIGHBORHOOD', 'CACHE_HITS', 'CACHE_MISSES'], heuristic_parameters)
+        self.evaluations = 0
+        self.stage_tested = {}
+        self.load_solution(initial_solution)
 
         # Algorithm control attributes
         self.temperature_alpha = heuristic_parameters['temperature_alpha']
@@ -32,91 +62,272 @@ class SimulatedAnnealing:
         self.global_minimum_it = heuristic_parameters['global_minimum_it']
         self.minimum_pct_change = heuristic_parameters['minimum_pct_change']
 
+        # Batch mode: batch_size moves sampled and evaluated at once (incremental engine only)
+        self.batch_size = heuristic_parameters.get('batch_size', 1)
+        self.batch_selection = heuristic_parameters.get('batch_selection', 'metropolis')
+        self.local_search = heuristic_parameters.get('local_search', False)
+        if self.batch_selection not in self.batch_selections:
+            raise Exception(f'Error: Batch selection {self.batch_selection} not implemented')
+        if ((self.batch_size > 1) or self.local_search) and (self.evaluator_engine != 'incremental'):
+            raise Exception('Error: Batch evaluation and local search require the incremental evaluator engine')
+
+        # Numba stage kernel: whole stages run as one compiled loop (falls back to Python without Numba)
+        self.stage_kernel = heuristic_parameters.get('stage_kernel', 'python')
+        if self.stage_kernel not in self.stage_kernels:
+            raise Exception(f'Error: Stage kernel {self.stage_kernel} not implemented')
+        if (self.stage_kernel == 'numba') and (self.batch_size > 1):
+            raise Exception('Error: Numba stage kernel can not be used with batch evaluation')
+        if (self.stage_kernel == 'numba') and not stage_kernel.has_numba:
+            print('Numba is not installed, SA stages run in Python')
+            self.stage_kernel = 'python'
+        if self.stage_kernel == 'numba':
+            self.task_arrays = SequenceEvaluator(task_df, due_date)
+
+        # Neighborhood of each move: fixed split (swaps then insertions) or adaptive pursuit over neighborhoods
+        self.operator_selection = heuristic_parameters.get('operator_selection', 'fixed')
+        if self.operator_selection not in self.operator_selections:
+            raise Exception(f'Error: Operator selection {self.operator_selection} not implemented')
+        self.operator_selector = None
+        if self.operator_selection == 'adaptive_pursuit':
+            if (self.stage_kernel == 'numba') or (self.batch_size > 1):
+                raise Exception('Error: Adaptive operator selection can not be used with the stage kernel or batch evaluation')
+            neighborhoods = heuristic_parameters.get('neighborhoods', [1, 2, 3, 4])
+            for neighborhood in neighborhoods:
+                if neighborhood not in self.neighborhood_types:
+                    raise Exception(f'Error: Neighborhood type {neighborhood} not implemented')
+            self.operator_selector = AdaptivePursuit(neighborhoods, heuristic_parameters)
+
+        # Wall-clock deadline (time.time(), see TimeBudget), checked between stages and every
+        # deadline_check_interval moves of the Python stages
+        self.deadline = heuristic_parameters.get('deadline')
+        self.interrupted = False
+
+        # Checkpoint of the chain written every checkpoint_interval stages (disabled without checkpoint_path)
+        self.checkpoint_path = heuristic_parameters.get('checkpoint_path')
+        self.checkpoint_interval = heuristic_parameters.get('checkpoint_interval', 1)
+
+        # Lower bound of the instance (see LowerBounds), the run stops between stages once the gap is at most gap_stop
+        self.lower_bound = heuristic_parameters.get('lower_bound')
+        self.gap_stop = heuristic_parameters.get('gap_stop')
+
+    def load_solution(self, solution):
+        """
+        (Re)start the chain from the given solution: current and global best solution and trace
+        """
+        # Current solution as a permutation array
+        self.current_solution = np.asarray(solution, dtype=np.int32).copy()
+        self.last_move = None
+        self.undo_record = None
+        self.identity_move = False
+        self.solution_hash = self.permutation_hash.hash(self.current_solution) if self.evaluation_cache is not None else None
+        self.undo_hash = self.solution_hash
+
+        # Initialize SA algorithm information
+        if self.evaluator_engine == 'incremental':
+            self.current_obj, self.tasks_before_dd = self.problem_evaluator.load_solution(self.current_solution)
+        else:
+            self.current_obj, self.tasks_before_dd = self.problem_evaluator.evaluate_solution(self.current_solution)
+
+        # Global best solution and algorithm trace
+        self.global_best_obj = self.current_obj
+        self.global_best_sol = self.current_solution.copy()
+        self.solution_trace.clear()
+        self.stage_statistics = StageStatistics()
+        self.append_trace(self.current_obj, 0, 0, 0)
+
+    def get_rng_state(self):
+        return self.rng.bit_generator.state
+
+    def set_rng_state(self, rng_state):
+        # Discard numbers already drawn from the previous state
+        self.rng.bit_generator.state = rng_state
+        self.random_numbers = []
+        self.random_index = 0
+        self.random_block_state = None
+
+    def create_problem_evaluator(self, evaluator_engine):
+        if evaluator_engine not in self.evaluator_engines:
+            raise Exception(f'Error: Evaluator engine {evaluator_engine} not implemented')
+        elif evaluator_engine == 'LP':
+            return ProblemEvaluator(
+                self.task_df, self.due_date, problem_type='LP',
+                solver_name=self.solver_name, persistent_solver=self.persistent_solver
+            )
+        elif evaluator_engine == 'closed_form':
+            return SequenceEvaluator(self.task_df, self.due_date)
+        else:
+            return IncrementalEvaluator(self.task_df, self.due_date)
 
-    def get_trace(self):
-        return pd.DataFrame({
-            'OBJ': self.obj_func_trace,
-            'K': self.obj_func_trace_k,                
-             'N':self.obj_func_trace_n, 
-        })
+    def evaluate_new_solution(self):
+        """
+        Return tuple (obj_function, tasks_before_dd) of the current (moved) solution. Moves that
+        leave the solution unchanged are not evaluated, and with the evaluation cache the
+        value of an already visited permutation is taken from the cache.
+        """
+        self.identity_move = self.is_identity_move()
+        if self.identity_move:
+            return self.current_obj, self.tasks_before_dd
+        elif self.evaluation_cache is None:
+            return self.evaluate_moved_solution()
+
+        cached_value = self.evaluation_cache.get(self.solution_hash)
+        if cached_value is not None:
+            # The incremental state must still be able to commit the move if it is accepted
+            if (self.evaluator_engine == 'incremental') and (self.last_move is not None):
+                self.problem_evaluator.pending_move = self.last_move
+            return cached_value
+
+        new_value = self.evaluate_moved_solution()
+        self.evaluation_cache.put(self.solution_hash, new_value)
+        return new_value
+
+    def is_identity_move(self):
+        if self.undo_record is None:
+            return True
+        elif (self.last_move is not None) and (self.last_move[1] == self.last_move[2]):
+            return True
+        return (self.evaluation_cache is not None) and (self.solution_hash == self.undo_hash)
+
+    def evaluate_moved_solution(self):
+        """
+        Swaps and insertions are evaluated as deltas over the last accepted sequence when the
+        incremental engine is selected
+        """
+        self.evaluations += 1
+        if (self.evaluator_engine == 'incremental') and (self.last_move is not None):
+            move_type, position_1, position_2 = self.last_move
+            if move_type == 'swap':
+                return self.problem_evaluator.evaluate_swap(position_1, position_2)
+            return self.problem_evaluator.evaluate_insertion(position_1, position_2)
+        return self.problem_evaluator.evaluate_solution(self.current_solution)
+
+    def draw_uniform(self) -> float:
+        if self.random_index >= len(self.random_numbers):
+            # Generator state before the block, to draw it again when a checkpoint is loaded
+            self.random_block_state = self.rng.bit_generator.state
+            self.random_numbers = self.rng.random(self.random_block_size).tolist()
+            self.random_index = 0
+        value = self.random_numbers[self.random_index]
+        self.random_index += 1
+        return value
+
+    def draw_position(self, size) -> int:
+        return int(self.draw_uniform() * size)
+
+    def get_cache_hits(self):
+        return self.evaluation_cache.hits if self.evaluation_cache is not None else 0
+
+    def get_cache_misses(self):
+        return self.evaluation_cache.misses if self.evaluation_cache is not None else 0
+
+    def get_trace(self, max_rows=None):
+        """
+        Return the trace (or max_rows evenly spaced rows of it) with the operator statistics
+        of each move (see join_operator_stats)
+        """
+        return self.join_operator_stats(self.solution_trace.to_dataframe(max_rows))
+
+    def iter_trace_chunks(self):
+        for chunk_df in self.solution_trace.iter_chunks():
+            yield self.join_operator_stats(chunk_df)
+
+    def join_operator_stats(self, trace_df):
+        """
+        With adaptive operator selection, add to each row the REWARD (of the stage, see
+        AdaptivePursuit), QUALITY and selection PROBABILITY of its neighborhood at the
+        end of its stage, joined on K and NEIGHBORHOOD (missing for an unfinished stage)
+        """
+        if self.operator_selector is None:
+            return trace_df
+        if len(trace_df) == 0:
+            return trace_df.reindex(columns=list(trace_df.columns) + ['REWARD', 'QUALITY', 'PROBABILITY'])
+        operator_stats = self.operator_selector.get_stats()[['K', 'NEIGHBORHOOD', 'REWARD', 'QUALITY', 'PROBABILITY']]
+        return trace_df.merge(operator_stats, on=['K', 'NEIGHBORHOOD'], how='left')
+
+    def get_stage_stats(self):
+        return self.stage_statistics.get_stats()
+
+    def append_trace(self, obj, k, n, neighborhood):
+        self.solution_trace.append(obj, k, n, neighborhood, self.get_cache_hits(), self.get_cache_misses())
+        self.stage_statistics.update(obj, k, neighborhood)
+
+    def close(self):
+        """
+        Remove the files of the trace (stream mode), once the trace is no longer used
+        """
+        self.solution_trace.close()
+
+    def get_operator_stats(self):
+        """
+        Return the per stage statistics of the adaptive operator selection (None if not used)
+        """
+        return self.operator_selector.get_stats() if self.operator_selector is not None else None
 
     def run(self):
         """
-        Main method for simulated annealing algorithm        
+        Main method for simulated annealing algorithm. Stops at the deadline (if any) or on
+        KeyboardInterrupt, returning the best solution found so far.
         """
         # Initializations
-        k = 0
         temperature = self.define_initial_temperature()
-        print(f'Initial temperature defined as {temperature}')
-        stop = False
-        stages_without_improvement = 0
-        
+        instrumentation.emit('sa_start', temperature=temperature)
+        return self.run_stages(0, temperature, 0, False)
 
-        acceptance_criterion = 0
-        while not (stop):
-            perturbations_accepted = 0
-            last_stage_obj = self.global_best_obj
-            # Calculate perturbations beween temperature changes
-            minimum_perturbations = self.calculate_minimum_perturbations(current_temperature=temperature)
-            minimum_tested = self.calculate_minimum_tested_perturbations()
-            n = 0
-            # while perturbations_accepted < minimum_perturbations:
-            while (n < minimum_tested): #and (perturbations_accepted < minimum_perturbations) :
-                
-                # Testing permutation of neighborhoods 
-                if  n <= (minimum_tested / 2):
-                    neighborhood = 3
-                else:
-                    neighborhood = 4
+    def resume(self, checkpoint_path):
+        """
+        Continue the run saved in checkpoint_path (see save_checkpoint) from the stage after it
+        """
+        k, temperature, stages_without_improvement, stop = self.load_checkpoint(checkpoint_path)
+        instrumentation.emit('sa_resume', k=k, temperature=temperature)
+        return self.run_stages(k, temperature, stages_without_improvement, stop)
+
+    def run_stages(self, k, temperature, stages_without_improvement, stop):
+        try:
+            while not (stop):
+                last_stage_obj = self.global_best_obj
+                # Calculate perturbations beween temperature changes
+                minimum_tested = self.calculate_minimum_tested_perturbations()
+                self.run_stage(temperature, k, minimum_tested)
                     
+                temperature = self.calculate_next_temperature(temperature)
+                k += 1
+                
 
-                new_solution = self.get_new_solution(neighborhood_type = neighborhood)
-                new_solution_obj, new_tasks_before_due_date = self.problem_evaluator.evaluate_solution(new_solution)
-
-                # Calculate delta
-                delta_e = new_solution_obj - self.current_obj
+                
+                # Check if did not improve
+                if (last_stage_obj <= self.global_best_obj) and temperature < 500:
+                    stages_without_improvement += 1
+
+                    # Check if reached minimum improvements for stop criteria
+                    if (stages_without_improvement >= self.stages_stop_criteria) and (temperature < 500):
+                        stop = True
+                        instrumentation.emit('sa_stop', k=k, reason='stagnation', best_obj=self.global_best_obj)
+                    
+                    
 
-                # If improves, store solution
-                if delta_e <= 0:
-                    self.store_solution(new_solution, new_solution_obj, new_tasks_before_due_date, k, n, neighborhood)
-                    perturbations_accepted += 1
-                # If it does not improves, check acceptance criterion
                 else:
-                    acceptance_criterion = np.exp(-delta_e / temperature)
-                    random_number = np.random.uniform(0,1)
-                    if random_number < acceptance_criterion:
-                        self.store_solution(new_solution, new_solution_obj, new_tasks_before_due_date, k, n, neighborhood)
-                        perturbations_accepted += 1
-                
-                print(f'K: {k} | N: {n} | Obj {self.current_obj} | Temperature {temperature} | perturbations_accepted {perturbations_accepted} | minimum tested: {minimum_tested} | minimum perturbations {minimum_perturbations} | neighborhood {neighborhood} | last_acceptance_criterion {acceptance_criterion} | last delta_e {delta_e}')
-                n += 1
+                    stages_without_improvement = 0
                 
-            temperature = self.calculate_next_temperature(temperature)
-            k += 1
-            
-
-            
-            # Check if did not improve
-            if (last_stage_obj <= self.global_best_obj) and temperature < 500:
-                stages_without_improvement += 1
-
-                print(f'Simulated Annealing stopped at iteration {k} after {self.stages_stop_criteria} iterations without improvement.' )
-                print(f'Best global solution {self.global_best_obj}')
-                # Check if reached minimum improvements for stop criteria
-                if (stages_without_improvement >= self.stages_stop_criteria) and (temperature < 500):
+                # Check for relative stop criteria and deadline
+                stop = stop | self.check_relative_stop_criteria()
+                if deadline_reached(self.deadline):
+                    instrumentation.emit('sa_stop', k=k, reason='time_budget', best_obj=self.global_best_obj)
+                    stop = True
+                if gap_reached(self.global_best_obj, self.lower_bound, self.gap_stop):
+                    instrumentation.emit('sa_stop', k=k, reason='gap', best_obj=self.global_best_obj, gap=round(get_gap(self.global_best_obj, self.lower_bound), 6))
                     stop = True
-                
-                
 
-            else:
-                stages_without_improvement = 0
-            
-            # Check for relative stop criteria
-            stop = stop | self.check_relative_stop_criteria()
+                if (self.checkpoint_path is not None) and (stop or (k % self.checkpoint_interval == 0)):
+                    self.save_checkpoint(self.checkpoint_path, k, temperature, stages_without_improvement, stop)
+        except KeyboardInterrupt:
+            self.stop_by_interrupt(k)
+
+        if self.local_search and not (self.interrupted or deadline_reached(self.deadline)):
+            self.run_local_search()
 
         solution_df = (
             pd.DataFrame({
-                'task_id':self.global_best_sol
+                'task_id':self.global_best_sol.astype(np.int64)
             })
             .merge(self.task_df, on='task_id')
         )
@@ -124,19 +335,314 @@ class SimulatedAnnealing:
         # Check relative stop criteria
         return (self.global_best_obj, solution_df)
 
+    def save_checkpoint(self, path, k, temperature, stages_without_improvement, stop):
+        """
+        Save the chain between stages: current and best permutations, temperature, stage
+        counters, RNG state (and its state before the block of numbers in use, drawn again
+        on load), the aggregates of the stop criteria and the adaptive operator selection.
+        The evaluation cache and the trace are not saved: with integer task data a resumed
+        chain takes the same moves and values, and its trace starts at the checkpoint.
+        """
+        statistics = self.stage_statistics
+        accepted = [(k_stage, neighborhood, count) for k_stage, counts in statistics.accepted.items() for neighborhood, count in counts.items()]
+        state = {
+            'k': k, 'temperature': temperature, 'stages_without_improvement': stages_without_improvement, 'stop': stop,
+            'current_obj': float(self.current_obj), 'tasks_before_dd': int(self.tasks_before_dd),
+            'global_best_obj': float(self.global_best_obj), 'evaluations': self.evaluations,
+            'rng_state': self.get_rng_state(), 'random_block_state': self.random_block_state,
+            'random_index': self.random_index
+        }
+        arrays = {
+            'current_solution': self.current_solution, 'global_best_sol': self.global_best_sol,
+            'stage_k': np.asarray(list(statistics.min_obj), dtype=np.int64),
+            'stage_min_obj': np.asarray(list(statistics.min_obj.values()), dtype=np.float64),
+            'stage_rows': np.asarray(list(statistics.rows.values()), dtype=np.int64),
+            'stage_accepted': np.asarray(accepted, dtype=np.int64).reshape(-1, 3)
+        }
+        if self.operator_selector is not None:
+            arrays['operator_quality'] = np.asarray(self.operator_selector.quality)
+            arrays['operator_probabilities'] = np.asarray(self.operator_selector.probabilities)
+        write_checkpoint(path, state, **arrays)
+
+    def load_checkpoint(self, path):
+        """
+        Restore the chain saved in path, return tuple (k, temperature, stages_without_improvement, stop)
+        """
+        state, arrays = read_checkpoint(path)
+        if len(arrays['current_solution']) != len(self.current_solution):
+            raise Exception('Error: Checkpoint solution does not match the instance')
+        self.load_solution(arrays['current_solution'])
+        self.current_obj, self.tasks_before_dd = state['current_obj'], state['tasks_before_dd']
+        self.global_best_obj = state['global_best_obj']
+        self.global_best_sol = arrays['global_best_sol'].astype(np.int32)
+        self.evaluations = state['evaluations']
+        if state['random_block_state'] is not None:
+            # Draw the block in use again, then continue from the saved state
+            self.set_rng_state(state['random_block_state'])
+            self.draw_uniform()
+        self.rng.bit_generator.state = state['rng_state']
+        self.random_index = state['random_index']
+
+        # Stop criteria aggregates (the trace restarts from the checkpoint)
+        self.solution_trace.clear()
+        self.stage_statistics = StageStatistics()
+        for k_stage, min_obj, rows in zip(arrays['stage_k'].tolist(), arrays['stage_min_obj'].tolist(), arrays['stage_rows'].tolist()):
+            self.stage_statistics.min_obj[k_stage] = min_obj
+            self.stage_statistics.rows[k_stage] = rows
+            self.stage_statistics.accepted[k_stage] = {}
+        for k_stage, neighborhood, count in arrays['stage_accepted'].tolist():
+            self.stage_statistics.accepted[k_stage][neighborhood] = count
+
+        if self.operator_selector is not None:
+            self.operator_selector.quality = arrays['operator_quality'].tolist()
+            self.operator_selector.probabilities = arrays['operator_probabilities'].tolist()
+        return state['k'], state['temperature'], state['stages_without_improvement'], state['stop']
+
+    def stop_by_interrupt(self, k):
+        """
+        Keep the global best solution at an interrupt. It is re-evaluated, since the interrupt
+        may come between the updates of its objective and its sequence.
+        """
+        self.interrupted = True
+        self.global_best_obj, _, _ = SequenceEvaluator(self.task_df, self.due_date).solve_offset(self.global_best_sol)
+        instrumentation.emit('sa_stop', k=k, reason='interrupt', best_obj=self.global_best_obj)
+
+    def run_stage(self, temperature, k, minimum_tested) -> int:
+        """
+        Test minimum_tested perturbations at the given temperature, return perturbations accepted
+        """
+        stage_begin = time.perf_counter()
+        evaluations_begin = self.evaluations
+        self.stage_tested = {}
+        if self.stage_kernel == 'numba':
+            perturbations_accepted = self.run_kernel_stage(temperature, k, minimum_tested)
+        elif self.batch_size > 1:
+            perturbations_accepted = self.run_batch_stage(temperature, k, minimum_tested)
+        else:
+            perturbations_accepted = self.run_python_stage(temperature, k, minimum_tested)
+        self.emit_stage_stats(temperature, k, perturbations_accepted, self.evaluations - evaluations_begin, time.perf_counter() - stage_begin)
+        return perturbations_accepted
+
+    def emit_stage_stats(self, temperature, k, perturbations_accepted, evaluations, seconds):
+        """
+        Emit the 'sa_stage' event: moves per second and acceptance rate of each neighborhood
+        """
+        if not instrumentation.is_enabled('stage'):
+            return
+        tested = sum(self.stage_tested.values())
+        accepted_by_neighborhood = self.stage_statistics.accepted.get(k, {})
+        acceptance_rates = {
+            f'acceptance_rate_{neighborhood}': round(accepted_by_neighborhood.get(neighborhood, 0) / max(neighborhood_tested, 1), 4)
+            for neighborhood, neighborhood_tested in sorted(self.stage_tested.items())
+        }
+        gap = {'gap': round(get_gap(self.global_best_obj, self.lower_bound), 6)} if self.lower_bound is not None else {}
+        instrumentation.emit(
+            'sa_stage', k=k, temperature=temperature, obj=self.current_obj, best_obj=self.global_best_obj, **gap,
+            tested=tested, accepted=perturbations_accepted, evaluations=evaluations, seconds=round(seconds, 4),
+            moves_per_second=round(tested / max(seconds, 1e-9)), **acceptance_rates
+        )
+
+    def run_python_stage(self, temperature, k, minimum_tested) -> int:
+        perturbations_accepted = 0
+        acceptance_criterion = 0
+        trace_moves = instrumentation.is_enabled('move')
+        stage_tested = self.stage_tested
+        deadline = self.deadline
+        n = 0
+        # while perturbations_accepted < minimum_perturbations:
+        while (n < minimum_tested): #and (perturbations_accepted < minimum_perturbations) :
+            if (deadline is not None) and (n % self.deadline_check_interval == 0) and deadline_reached(deadline):
+                break
+            
+            # Testing permutation of neighborhoods 
+            if self.operator_selector is not None:
+                neighborhood = self.operator_selector.select(self.draw_uniform())
+                move_begin = time.process_time()
+            elif  n <= (minimum_tested / 2):
+                neighborhood = 3
+            else:
+                neighborhood = 4
+                
+
+            self.apply_move(neighborhood_type = neighborhood)
+            new_solution_obj, new_tasks_before_due_date = self.evaluate_new_solution()
+
+            # Calculate delta
+            delta_e = new_solution_obj - self.current_obj
+
+            # If improves, store solution
+            if delta_e <= 0:
+                self.store_solution(new_solution_obj, new_tasks_before_due_date, k, n, neighborhood)
+                perturbations_accepted += 1
+                accepted = True
+            # If it does not improves, check acceptance criterion
+            else:
+                acceptance_criterion = math.exp(-delta_e / temperature)
+                random_number = self.draw_uniform()
+                accepted = random_number < acceptance_criterion
+                if accepted:
+                    self.store_solution(new_solution_obj, new_tasks_before_due_date, k, n, neighborhood)
+                    perturbations_accepted += 1
+                else:
+                    self.undo_move()
+
+            # Credit the neighborhood with its improvement (per CPU time or per evaluation)
+            if self.operator_selector is not None:
+                self.operator_selector.update(neighborhood, max(-delta_e, 0), time.process_time() - move_begin, accepted)
+            
+            stage_tested[neighborhood] = stage_tested.get(neighborhood, 0) + 1
+            if trace_moves:
+                instrumentation.emit(
+                    'sa_move', 'move', k=k, n=n, obj=self.current_obj, temperature=temperature, neighborhood=neighborhood,
+                    delta_e=delta_e, acceptance_criterion=acceptance_criterion, accepted=accepted
+                )
+            n += 1
+
+        if self.operator_selector is not None:
+            self.operator_selector.end_stage(k)
+        return perturbations_accepted
+
+    def run_batch_stage(self, temperature, k, minimum_tested) -> int:
+        """
+        Batch version of run_stage: batch_size swaps (or insertions) of the current solution
+        are sampled and evaluated in one NumPy pass. With batch_selection 'metropolis' the
+        first move passing the Metropolis test (in sampling order) is applied and the moves
+        after it are discarded, so each tested move is a regular SA step. With 'best', only
+        the best move of the batch is tested.
+
+        Metropolis batches are sized to twice the moves tested since the last acceptance (up
+        to batch_size), so few evaluations are discarded while most moves are accepted, and
+        batches below min_batch_size are tested one move at a time like run_stage.
+        """
+        perturbations_accepted = 0
+        n = 0
+        size = len(self.current_solution)
+        batch_size = self.batch_size if self.batch_selection == 'best' else 1
+        tested_since_accepted = 0
+        while (n < minimum_tested) and not deadline_reached(self.deadline):
+            neighborhood = 3 if n <= (minimum_tested / 2) else 4
+
+            if batch_size < self.min_batch_size:
+                self.apply_move(neighborhood_type=neighborhood)
+                new_obj, new_tasks_before_dd = self.evaluate_new_solution()
+                delta_e = new_obj - self.current_obj
+                accepted = (delta_e <= 0) or (self.draw_uniform() < math.exp(-delta_e / temperature))
+                if accepted:
+                    self.store_solution(new_obj, new_tasks_before_dd, k, n, neighborhood)
+                else:
+                    self.undo_move()
+                tested = 1
+            else:
+                positions_1, positions_2 = self.rng.integers(0, size, size=(2, batch_size))
+                if neighborhood == 3:
+                    new_objs, new_tasks_before_dd = self.problem_evaluator.evaluate_swaps(positions_1, positions_2)
+                else:
+                    new_objs, new_tasks_before_dd = self.problem_evaluator.evaluate_insertions(positions_1, positions_2)
+                self.evaluations += batch_size
+                delta_e = new_objs - self.current_obj
+
+                if self.batch_selection == 'best':
+                    idx = int(np.argmin(delta_e))
+                    accepted = (delta_e[idx] <= 0) or (self.draw_uniform() < math.exp(-delta_e[idx] / temperature))
+                    tested = batch_size
+                else:
+                    acceptance = (delta_e <= 0) | (self.rng.random(batch_size) < np.exp(-np.maximum(delta_e, 0) / temperature))
+                    idx = int(np.argmax(acceptance))
+                    accepted = bool(acceptance[idx])
+                    tested = idx + 1 if accepted else batch_size
+
+                if accepted:
+                    move_type = 'swap' if neighborhood == 3 else 'insertion'
+                    self.apply_given_move(move_type, int(positions_1[idx]), int(positions_2[idx]))
+                    self.store_solution(float(new_objs[idx]), int(new_tasks_before_dd[idx]), k, n + tested - 1, neighborhood)
+
+            n += tested
+            self.stage_tested[neighborhood] = self.stage_tested.get(neighborhood, 0) + tested
+            tested_since_accepted += tested
+            if self.batch_selection == 'metropolis':
+                batch_size = min(2 * tested_since_accepted, self.batch_size)
+            if accepted:
+                perturbations_accepted += 1
+                tested_since_accepted = 0
+
+        return perturbations_accepted
+
+    def run_kernel_stage(self, temperature, k, minimum_tested) -> int:
+        """
+        Compiled version of run_stage (see stage_kernel.run_stage_kernel): the moves are drawn
+        from the SA generator and the accepted ones are added to the trace after the stage.
+        """
+        minimum_tested = int(math.ceil(minimum_tested))
+        random_numbers = self.rng.random((minimum_tested, 3))
+        accepted_obj = np.empty(minimum_tested, dtype=np.float64)
+        accepted_n = np.empty(minimum_tested, dtype=np.int64)
+        accepted_neighborhood = np.empty(minimum_tested, dtype=np.int64)
+        best_solution = self.global_best_sol.copy()
+        self.current_obj, self.tasks_before_dd, self.global_best_obj, perturbations_accepted = stage_kernel.run_stage_kernel(
+            self.current_solution, best_solution, self.task_arrays.p, self.task_arrays.alpha, self.task_arrays.beta,
+            float(self.due_date), float(self.current_obj), int(self.tasks_before_dd), float(self.global_best_obj),
+            float(temperature), random_numbers, accepted_obj, accepted_n, accepted_neighborhood
+        )
+
+        # Resynchronize the Python state with the solution of the kernel
+        self.global_best_sol = best_solution
+        self.last_move = None
+        self.undo_record = None
+        if self.evaluation_cache is not None:
+            self.solution_hash = self.permutation_hash.hash(self.current_solution)
+            self.undo_hash = self.solution_hash
+        if self.evaluator_engine == 'incremental':
+            self.problem_evaluator.load_solution(self.current_solution)
+
+        accepted_obj = accepted_obj[:perturbations_accepted]
+        accepted_neighborhood = accepted_neighborhood[:perturbations_accepted]
+        self.solution_trace.extend(
+            accepted_obj.tolist(), [k] * perturbations_accepted, accepted_n[:perturbations_accepted].tolist(),
+            accepted_neighborhood.tolist(), [self.get_cache_hits()] * perturbations_accepted,
+            [self.get_cache_misses()] * perturbations_accepted
+        )
+        self.stage_statistics.update_stage(accepted_obj, k, accepted_neighborhood)
+        self.evaluations += minimum_tested
+        self.stage_tested = {3: minimum_tested // 2 + 1, 4: minimum_tested - minimum_tested // 2 - 1}
+        return perturbations_accepted
+
+    def run_local_search(self):
+        """
+        Swap descent from the global best solution. All swaps of the solution are evaluated
+        at once (swap delta matrix), then the improving ones are re-evaluated one by one from
+        the best, and applied while they still improve (earlier swaps change the others).
+        """
+        self.current_obj, self.tasks_before_dd = self.problem_evaluator.load_solution(self.global_best_sol)
+        self.current_solution = self.global_best_sol.copy()
+        solution = self.current_solution
+        improved = True
+        while improved:
+            improved = False
+            delta = np.triu(self.problem_evaluator.get_swap_delta_matrix(), 1)
+            positions_1, positions_2 = np.nonzero(delta < -1e-9)
+            for idx in np.argsort(delta[positions_1, positions_2], kind='stable'):
+                position_1, position_2 = int(positions_1[idx]), int(positions_2[idx])
+                new_obj, new_tasks_before_dd = self.problem_evaluator.evaluate_swap(position_1, position_2)
+                if new_obj < self.current_obj - 1e-9:
+                    self.problem_evaluator.commit()
+                    solution[position_1], solution[position_2] = solution[position_2], solution[position_1]
+                    self.current_obj, self.tasks_before_dd = new_obj, new_tasks_before_dd
+                    improved = True
+        instrumentation.emit('sa_local_search', initial_obj=self.global_best_obj, obj=self.current_obj)
+        self.global_best_obj = self.current_obj
+        self.global_best_sol = solution.copy()
+
     def check_relative_stop_criteria(self):
 
-        min_per_K = self.get_trace().groupby('K').agg({'OBJ': 'min'})
+        # Minimum OBJ per K is aggregated while the trace grows (see StageStatistics)
 
         # if minimum is not reached, do not stop algorithm
-        if len(min_per_K) < self.global_minimum_it:
+        if len(self.stage_statistics.min_obj) < self.global_minimum_it:
             return False
         
         # Check if decreased lower than minimum pct change for stop criteria
-        min_per_K['% Reducao'] = abs(min_per_K['OBJ'].pct_change()) 
-
-        last_K_rows = min_per_K[-2:]
-        if all(last_K_rows['% Reducao'] < self.minimum_pct_change):
+        last_K_changes = self.stage_statistics.get_relative_changes(2)
+        if all(change < self.minimum_pct_change for change in last_K_changes):
             return True
 
         return False
@@ -145,119 +651,162 @@ class SimulatedAnnealing:
     def calculate_minimum_tested_perturbations(self):
         return 5 * len(self.current_solution)
 
-    def store_solution(self, new_solution, new_solution_obj, tasks_before_due_date, k, n, neighborhood):
+    def store_solution(self, new_solution_obj, tasks_before_due_date, k, n, neighborhood):
 
         if new_solution_obj < self.global_best_obj:
             self.global_best_obj = new_solution_obj
-            self.global_best_sol = new_solution
+            self.global_best_sol = self.current_solution.copy()
+
+        # Commit accepted move to incremental evaluator state
+        if (self.evaluator_engine == 'incremental') and not self.identity_move:
+            if self.last_move is not None:
+                self.problem_evaluator.commit()
+            else:
+                self.problem_evaluator.load_solution(self.current_solution)
 
-        self.current_solution = new_solution
+        self.undo_record = None
         self.current_obj = new_solution_obj
         self.tasks_before_dd = tasks_before_due_date
-        self.obj_func_trace.append(new_solution_obj)
-        self.obj_func_trace_k.append(k)
-        self.obj_func_trace_n.append(n)
-        self.neighborhood_type_trace.append(neighborhood)
+        self.append_trace(new_solution_obj, k, n, neighborhood)
 
 
-    def get_new_solution(self, neighborhood_type) -> list:
+    def apply_move(self, neighborhood_type):
         """
+        Apply a random move of the given neighborhood in place, keeping an undo record
         """
         if neighborhood_type not in self.neighborhood_types:
             raise Exception(f'Error: Neighborhood type not implemented')
-    
-        elif neighborhood_type == 1:
-            return_value = self.get_new_solution_type_1()
+
+        # Moves 1 and 2 rebuild the after due date part, only 3 and 4 are tracked by position
+        self.last_move = None
+        if neighborhood_type == 1:
+            self.apply_move_type_1()
         elif neighborhood_type == 2:
-            return_value = self.get_new_solution_type_2()
+            self.apply_move_type_2()
         elif neighborhood_type == 3:
-            return_value = self.get_new_solution_type_3()
+            self.apply_move_type_3()
         elif neighborhood_type == 4:
-            return_value = self.get_new_solution_type_4()
+            self.apply_move_type_4()
         else:
             raise Exception('Error: Neighborhood type not implemented')
 
-        return return_value
+        self.undo_hash = self.solution_hash
+        if self.evaluation_cache is not None:
+            self.update_solution_hash()
 
-    def get_new_solution_type_1(self) -> list:
-        current_tasks_before_dd = pd.DataFrame(self.current_solution[:self.tasks_before_dd])
-        current_tasks_before_dd.columns = ['task_id']
-        current_tasks_before_dd = current_tasks_before_dd.merge(self.task_df[['task_id', 'alpha', 'beta']], on='task_id', how='left')
-        
-        current_tasks_after_dd = pd.DataFrame(self.current_solution[self.tasks_before_dd:])
-        current_tasks_after_dd.columns = ['task_id']
-        current_tasks_after_dd = current_tasks_after_dd.merge(self.task_df[['task_id', 'alpha', 'beta']], on='task_id', how='left')
-        
-        # get random task before dd, and put it after dd. Also get a random task after dd, and put it before dd
-        random_row_before = current_tasks_before_dd.sample()
-        random_row_after = current_tasks_after_dd.sample()
+    def update_solution_hash(self):
+        """
+        Update the hash of the current solution from the positions changed by the last move
+        """
+        if self.undo_record is None:
+            return
+        elif self.undo_record[0] == 'swap':
+            _, position_1, position_2 = self.undo_record
+            self.solution_hash = self.permutation_hash.update_swap(self.solution_hash, self.current_solution, position_1, position_2)
+        else:
+            _, begin, old_segment = self.undo_record
+            new_segment = self.current_solution[begin:begin + len(old_segment)]
+            self.solution_hash = self.permutation_hash.update_segment(self.solution_hash, begin, old_segment, new_segment)
 
-        # Delete old task after dd, and add new task brought before dd
-        current_tasks_after_dd = current_tasks_after_dd.drop(random_row_after.index)
-        current_tasks_after_dd = pd.concat([current_tasks_after_dd, random_row_before]).sort_values(by='alpha', ascending=False)
-        
-        # replace task before with task after 
-        current_tasks_before_dd.iloc[random_row_before.index] = random_row_after
-        
-        # append both tasks and return new solution
-        solution = pd.concat([current_tasks_before_dd, current_tasks_after_dd], ignore_index=True)
+    def undo_move(self):
+        """
+        Revert the last applied move
+        """
+        solution = self.current_solution
+        if self.undo_record is None:
+            return
+        elif self.undo_record[0] == 'swap':
+            _, position_1, position_2 = self.undo_record
+            solution[position_1], solution[position_2] = solution[position_2], solution[position_1]
+        else:
+            _, begin, old_segment = self.undo_record
+            end = begin + len(old_segment)
+            solution[begin:end] = old_segment
+        self.undo_record = None
+        self.solution_hash = self.undo_hash
 
-        return solution['task_id'].to_list()
-    
-    def get_new_solution_type_2(self) -> list:
-        current_tasks_before_dd = pd.DataFrame(self.current_solution[:self.tasks_before_dd])
-        current_tasks_before_dd.columns = ['task_id']
-        current_tasks_before_dd = current_tasks_before_dd.merge(self.task_df[['task_id', 'alpha', 'beta']], on='task_id', how='left')
-        
-        current_tasks_after_dd = pd.DataFrame(self.current_solution[self.tasks_before_dd:])
-        current_tasks_after_dd.columns = ['task_id']
-        current_tasks_after_dd = current_tasks_after_dd.merge(self.task_df[['task_id', 'alpha', 'beta']], on='task_id', how='left')
-        
+    def apply_move_type_1(self):
         # get random task before dd, and put it after dd. Also get a random task after dd, and put it before dd
-        random_row_before = current_tasks_before_dd.sample()
-        # random_row_after = current_tasks_after_dd.sample()
-
-        # Delete old task after dd, and add new task brought before dd
-        current_tasks_after_dd = pd.concat([current_tasks_after_dd, random_row_before]).sort_values(by='alpha', ascending=False)
-        
-        # replace task before with task after 
-        current_tasks_before_dd = current_tasks_before_dd.drop(random_row_before.index)
-        
-        # append both tasks and return new solution
-        solution = pd.concat([current_tasks_before_dd, current_tasks_after_dd], ignore_index=True)
-
-        return solution['task_id'].to_list()      
-
-    def get_new_solution_type_3(self) -> list:
+        solution = self.current_solution
+        tasks_before_dd = self.tasks_before_dd
+        if (tasks_before_dd == 0) or (tasks_before_dd == len(solution)):
+            self.undo_record = None
+            return
+        position_before = self.draw_position(tasks_before_dd)
+        position_after = tasks_before_dd + self.draw_position(len(solution) - tasks_before_dd)
+        self.undo_record = ('segment', position_before, solution[position_before:].copy())
+
+        # Task after dd replaces task before dd, which joins the after dd part sorted by alpha
+        task_before = solution[position_before]
+        solution[position_before] = solution[position_after]
+        solution[position_after] = task_before
+        self.sort_after_due_date(tasks_before_dd)
+
+    def apply_move_type_2(self):
+        # get random task before dd, and put it in the after dd part sorted by alpha
+        solution = self.current_solution
+        tasks_before_dd = self.tasks_before_dd
+        if tasks_before_dd == 0:
+            self.undo_record = None
+            return
+        position_before = self.draw_position(tasks_before_dd)
+        self.undo_record = ('segment', position_before, solution[position_before:].copy())
+
+        task_before = solution[position_before]
+        solution[position_before:tasks_before_dd - 1] = solution[position_before + 1:tasks_before_dd]
+        solution[tasks_before_dd - 1] = task_before
+        self.sort_after_due_date(tasks_before_dd - 1)
+
+    def apply_given_move(self, move_type, position_1, position_2):
+        """
+        Apply a swap or insertion already evaluated by the incremental engine (batch mode)
+        """
+        if move_type == 'swap':
+            self.swap_positions(position_1, position_2)
+        else:
+            self.insert_position(position_1, position_2)
+        self.undo_hash = self.solution_hash
+        if self.evaluation_cache is not None:
+            self.update_solution_hash()
+        self.identity_move = position_1 == position_2
+        self.problem_evaluator.pending_move = self.last_move
+
+    def apply_move_type_3(self):
         # change any task between them
-        current_tasks = pd.DataFrame(self.current_solution[:])
-        task_row_1 = current_tasks.sample()
-        task_row_2 = current_tasks.sample()
-
-        task_row_1_index = task_row_1.index.values[0]  # Pega o índice da primeira sample
-        task_row_2_index = task_row_2.index.values[0]  # Pega o índice da segunda sample
-
-        # Aqui, substituímos a primeira sample pela segunda e vice-versa.
-        current_tasks.loc[task_row_1_index] = task_row_2.values[0]
-        current_tasks.loc[task_row_2_index] = task_row_1.values[0]
-
-        return current_tasks[0].to_list()
-
-    def get_new_solution_type_4(self) -> list:
-        current_tasks = pd.DataFrame(self.current_solution[:])
-        
-        random_task = current_tasks.sample()
-
-        # Remove selected tasks from current tasks
-        current_tasks = current_tasks.drop(random_task.index)
-
-        # Reinsere a tarefa removida em uma linha aleatória
-        random_row = np.random.randint(low=0, high=len(current_tasks), size=1)[0]
-        current_tasks = pd.concat([current_tasks.iloc[:random_row], random_task, current_tasks.iloc[random_row:]]).reset_index(drop=True)
-
-        return current_tasks[0].to_list()
-        
+        solution = self.current_solution
+        position_1 = self.draw_position(len(solution))
+        position_2 = self.draw_position(len(solution))
+        self.swap_positions(position_1, position_2)
+
+    def swap_positions(self, position_1, position_2):
+        solution = self.current_solution
+        solution[position_1], solution[position_2] = solution[position_2], solution[position_1]
+        self.undo_record = ('swap', position_1, position_2)
+        self.last_move = ('swap', position_1, position_2)
+
+    def apply_move_type_4(self):
+        # Remove a random task and reinsert it in a random position
+        solution = self.current_solution
+        from_position = self.draw_position(len(solution))
+        to_position = self.draw_position(len(solution))
+        self.insert_position(from_position, to_position)
+
+    def insert_position(self, from_position, to_position):
+        solution = self.current_solution
+        begin, end = min(from_position, to_position), max(from_position, to_position) + 1
+        self.undo_record = ('segment', begin, solution[begin:end].copy())
+
+        task = solution[from_position]
+        if from_position < to_position:
+            solution[from_position:to_position] = solution[from_position + 1:to_position + 1]
+        else:
+            solution[to_position + 1:from_position + 1] = solution[to_position:from_position]
+        solution[to_position] = task
+        self.last_move = ('insertion', from_position, to_position)
 
+    def sort_after_due_date(self, begin):
+        after_dd = self.current_solution[begin:]
+        after_dd[:] = after_dd[np.argsort(self.alpha_rank[after_dd], kind='stable')]
 
     def calculate_minimum_perturbations(self, current_temperature) -> int:
         # Utilizing 1.5n perturbations accepted 
@@ -270,13 +819,15 @@ class SimulatedAnnealing:
     def define_initial_temperature(self) -> float:
         delta_e_array = []
         # Utilize sintetic solution as base obj 
-        new_solution = self.get_new_solution(neighborhood_type = 3)
-        current_obj, _ = self.problem_evaluator.evaluate_solution(new_solution)
+        self.apply_move(neighborhood_type = 3)
+        current_obj, _ = self.evaluate_new_solution()
+        self.undo_move()
 
         # Get 100 solutions in same neighborhood type ans calculate temperature
         for n_try in range(100):
-            new_solution = self.get_new_solution(neighborhood_type = 3)
-            new_solution_obj, _ = self.problem_evaluator.evaluate_solution(new_solution)
+            self.apply_move(neighborhood_type = 3)
+            new_solution_obj, _ = self.evaluate_new_solution()
+            self.undo_move()
 
             # Calculate delta
             delta_e = new_solution_obj - current_obj
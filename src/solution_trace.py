@@ -0,0 +1,248 @@
+from collections import deque
+import math
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+def get_sample_positions(n_rows, max_rows):
+    """
+    Positions of max_rows rows evenly spaced over n_rows rows (first and last included)
+    """
+    if (max_rows is None) or (n_rows <= max_rows):
+        return np.arange(n_rows)
+    return np.unique(np.linspace(0, n_rows - 1, max_rows).round().astype(np.int64))
+
+
+def sample_rows(df, max_rows):
+    """
+    Return df with at most max_rows evenly spaced rows (see get_sample_positions)
+    """
+    return df.iloc[get_sample_positions(len(df), max_rows)].reset_index(drop=True)
+
+
+class SolutionTrace:
+    trace_modes = {'memory', 'ring', 'stream'}
+
+    def __init__(self, columns, parameters):
+        """
+        Append-only trace of the accepted moves with one list per column. With trace_mode
+        'memory' every row is kept, with 'ring' only the last trace_max_rows rows, and with
+        'stream' the rows are written to trace_path in columnar chunks of trace_chunk_size
+        rows (one .npz file per chunk, in a new directory under trace_path for each trace so
+        parallel chains do not collide), so memory stays flat over long runs, and close
+        removes them once the trace is used. to_dataframe returns the full (or last, for
+        'ring') trace in all modes.
+        """
+        self.columns = list(columns)
+        self.trace_mode = parameters.get('trace_mode', 'memory')
+        if self.trace_mode not in self.trace_modes:
+            raise Exception(f'Error: Trace mode {self.trace_mode} not implemented')
+        self.max_rows = parameters.get('trace_max_rows', 100000)
+        self.chunk_size = parameters.get('trace_chunk_size', 65536)
+        self.chunk_files = []
+        self.chunk_rows = []
+        if self.trace_mode == 'stream':
+            trace_path = parameters.get('trace_path', 'outputs/trace')
+            os.makedirs(trace_path, exist_ok=True)
+            self.trace_path = tempfile.mkdtemp(prefix='sa_trace_', dir=trace_path)
+        self.clear()
+
+    def clear(self):
+        if self.trace_mode == 'ring':
+            self.values = {column: deque(maxlen=self.max_rows) for column in self.columns}
+        else:
+            self.values = {column: [] for column in self.columns}
+        for chunk_file in self.chunk_files:
+            os.remove(chunk_file)
+        self.chunk_files = []
+        self.chunk_rows = []
+
+    def close(self):
+        """
+        Empty the trace and, in stream mode, remove its chunk files and directory
+        """
+        self.clear()
+        if (self.trace_mode == 'stream') and os.path.isdir(self.trace_path):
+            os.rmdir(self.trace_path)
+
+    def append(self, *row):
+        for column, value in zip(self.columns, row):
+            self.values[column].append(value)
+        if (self.trace_mode == 'stream') and (len(self.values[self.columns[0]]) >= self.chunk_size):
+            self.flush()
+
+    def extend(self, *columns):
+        for column, values in zip(self.columns, columns):
+            self.values[column].extend(values)
+        if (self.trace_mode == 'stream') and (len(self.values[self.columns[0]]) >= self.chunk_size):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows in memory as a new chunk file (stream mode)
+        """
+        chunk_df = pd.DataFrame(self.values)
+        chunk_file = os.path.join(self.trace_path, f'chunk_{len(self.chunk_files):06d}.npz')
+        np.savez(chunk_file, **{column: chunk_df[column].to_numpy() for column in self.columns})
+        self.chunk_files.append(chunk_file)
+        self.chunk_rows.append(len(chunk_df))
+        self.values = {column: [] for column in self.columns}
+
+    def __len__(self):
+        return sum(self.chunk_rows) + len(self.values[self.columns[0]])
+
+    def iter_chunks(self):
+        """
+        Yield the trace as DataFrames, one per chunk file and then the rows in memory, so
+        a streamed trace can be exported without loading it at once
+        """
+        for chunk_file in self.chunk_files:
+            with np.load(chunk_file) as chunk:
+                yield pd.DataFrame({column: chunk[column] for column in self.columns})
+        yield pd.DataFrame({column: list(values) for column, values in self.values.items()})
+
+    def to_dataframe(self, max_rows=None):
+        """
+        Return the trace, or max_rows evenly spaced rows of it, loading one chunk at a time
+        """
+        positions = get_sample_positions(len(self), max_rows)
+        chunk_dfs = []
+        chunk_begin = 0
+        for chunk_df in self.iter_chunks():
+            chunk_positions = positions[(positions >= chunk_begin) & (positions < chunk_begin + len(chunk_df))]
+            chunk_dfs.append(chunk_df.iloc[chunk_positions - chunk_begin])
+            chunk_begin += len(chunk_df)
+        return pd.concat(chunk_dfs, ignore_index=True) if len(chunk_dfs) > 1 else chunk_dfs[0].reset_index(drop=True)
+
+
+class SequenceDiffTrace:
+    def __init__(self, initial_sequence):
+        """
+        Trace of the sequences of an iterative search (e.g. the current solution of each
+        Fix-and-Optimize window) stored as the initial sequence and, for each iteration that
+        changed it, its changed positions and their new tasks, so the trace grows with the
+        changes instead of by n tasks per iteration
+        """
+        self.initial_sequence = np.array(initial_sequence, dtype=np.int64)
+        self.last_sequence = self.initial_sequence.copy()
+        self.iterations = 0
+        self.diff_iterations = []
+        self.diff_positions = []
+        self.diff_tasks = []
+
+    def append(self, sequence):
+        sequence = np.asarray(sequence, dtype=np.int64)
+        self.iterations += 1
+        positions = np.flatnonzero(sequence != self.last_sequence)
+        if len(positions) > 0:
+            self.diff_iterations.append(self.iterations)
+            self.diff_positions.append(positions)
+            self.diff_tasks.append(sequence[positions])
+            self.last_sequence[positions] = sequence[positions]
+
+    def get_sequence(self, iteration):
+        """
+        Return the sequence after iteration (0 for the initial sequence)
+        """
+        sequence = self.initial_sequence.copy()
+        for diff_iteration, positions, tasks in zip(self.diff_iterations, self.diff_positions, self.diff_tasks):
+            if diff_iteration > iteration:
+                break
+            sequence[positions] = tasks
+        return sequence
+
+    def get_arrays(self):
+        """
+        Return the trace as a dict of flat arrays (see load_arrays), in long format: one
+        element per changed position with its iteration
+        """
+        return {
+            'initial_sequence': self.initial_sequence,
+            'diff_iteration': np.repeat(np.asarray(self.diff_iterations, dtype=np.int64), [len(positions) for positions in self.diff_positions]),
+            'diff_position': np.concatenate(self.diff_positions) if self.diff_positions else np.empty(0, dtype=np.int64),
+            'diff_task': np.concatenate(self.diff_tasks) if self.diff_tasks else np.empty(0, dtype=np.int64)
+        }
+
+    def load_arrays(self, arrays, iterations):
+        """
+        Restore the trace of iterations iterations from the arrays of get_arrays
+        """
+        self.initial_sequence = np.array(arrays['initial_sequence'], dtype=np.int64)
+        self.iterations = iterations
+        self.diff_iterations, self.diff_positions, self.diff_tasks = [], [], []
+        diff_iteration = np.asarray(arrays['diff_iteration'], dtype=np.int64)
+        bounds = np.flatnonzero(np.diff(diff_iteration)) + 1
+        for positions, tasks, iteration in zip(
+            np.split(arrays['diff_position'], bounds), np.split(arrays['diff_task'], bounds), np.split(diff_iteration, bounds)
+        ):
+            if len(iteration) > 0:
+                self.diff_iterations.append(int(iteration[0]))
+                self.diff_positions.append(np.array(positions, dtype=np.int64))
+                self.diff_tasks.append(np.array(tasks, dtype=np.int64))
+        self.last_sequence = self.get_sequence(iterations)
+
+    def to_dataframe(self):
+        """
+        Return the trace in long format: ITERATION, POSITION and TASK_ID of the initial
+        sequence (iteration 0) and of every changed position
+        """
+        arrays = self.get_arrays()
+        return pd.DataFrame({
+            'ITERATION': np.concatenate([np.zeros(len(self.initial_sequence), dtype=np.int64), arrays['diff_iteration']]),
+            'POSITION': np.concatenate([np.arange(len(self.initial_sequence), dtype=np.int64), arrays['diff_position']]),
+            'TASK_ID': np.concatenate([self.initial_sequence, arrays['diff_task']])
+        })
+
+
+class StageStatistics:
+    def __init__(self):
+        """
+        Running aggregates of the trace by stage K: minimum objective, rows and accepted
+        moves per neighborhood (0 for rows that are not moves, like the initial solution),
+        updated in O(1) per row instead of grouping the trace
+        """
+        self.min_obj = {}
+        self.rows = {}
+        self.accepted = {}
+
+    def update(self, obj, k, neighborhood):
+        if k in self.min_obj:
+            self.min_obj[k] = min(self.min_obj[k], obj)
+            self.rows[k] += 1
+        else:
+            self.min_obj[k] = obj
+            self.rows[k] = 1
+            self.accepted[k] = {}
+        if neighborhood:
+            self.accepted[k][neighborhood] = self.accepted[k].get(neighborhood, 0) + 1
+
+    def update_stage(self, objs, k, neighborhoods):
+        """
+        Aggregate the rows of stage k given as arrays (stage kernel)
+        """
+        if len(objs) == 0:
+            return
+        self.update(float(np.min(objs)), k, 0)
+        self.rows[k] += len(objs) - 1
+        for neighborhood, count in zip(*np.unique(neighborhoods, return_counts=True)):
+            self.accepted[k][int(neighborhood)] = self.accepted[k].get(int(neighborhood), 0) + int(count)
+
+    def get_relative_changes(self, last_stages):
+        """
+        Return the relative changes of the minimum objective of the last_stages stages with
+        rows, as pct_change of the trace grouped by K (inf when undefined)
+        """
+        min_objs = list(self.min_obj.values())[-(last_stages + 1):]
+        changes = [math.inf] * (last_stages + 1 - len(min_objs))
+        for previous, current in zip(min_objs[:-1], min_objs[1:]):
+            changes.append(abs(current / previous - 1) if previous != 0 else math.inf)
+        return changes[-last_stages:]
+
+    def get_stats(self):
+        neighborhoods = sorted({neighborhood for accepted in self.accepted.values() for neighborhood in accepted})
+        stats = {'K': list(self.min_obj), 'MIN_OBJ': list(self.min_obj.values()), 'ROWS': list(self.rows.values())}
+        for neighborhood in neighborhoods:
+            stats[f'ACCEPTED_{neighborhood}'] = [self.accepted[k].get(neighborhood, 0) for k in self.min_obj]
+        return pd.DataFrame(stats)
@@ -0,0 +1,186 @@
+import numpy as np
+
+# Numba is optional, without it SimulatedAnnealing runs its stages in Python (see run_stage)
+try:
+    from numba import njit
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+
+def load_prefix_sums(sequence, p, alpha, beta, S, A, B, AS, BS):
+    """
+    Fill the prefix sums of sequence (as in SequenceEvaluator.get_prefix_sums) in place
+    """
+    for position in range(len(sequence)):
+        task = sequence[position]
+        S[position + 1] = S[position] + p[task]
+        A[position + 1] = A[position] + alpha[task]
+        B[position + 1] = B[position] + beta[task]
+        AS[position + 1] = AS[position] + alpha[task] * S[position + 1]
+        BS[position + 1] = BS[position] + beta[task] * S[position + 1]
+
+
+def count_less_equal(X, X_segment, lo, hi, tail, value):
+    """
+    Number of k in [0, n] with X'[k] <= value, where X'[k] is X_segment[k - lo] for
+    lo <= k <= hi and X[k] + tail otherwise after hi (X' is non-decreasing)
+    """
+    low, high = 0, len(X)
+    while low < high:
+        middle = (low + high) // 2
+        if middle < lo:
+            x = X[middle]
+        elif middle <= hi:
+            x = X_segment[middle - lo]
+        else:
+            x = X[middle] + tail
+        if x <= value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def point(X, X_segment, lo, hi, tail, k):
+    if k < lo:
+        return X[k]
+    elif k <= hi:
+        return X_segment[k - lo]
+    return X[k] + tail
+
+
+def evaluate_segment(segment, begin, end, p, alpha, beta, due_date, S, A, B, AS, BS, S_seg, A_seg, B_seg, W_seg, AS_seg, BS_seg):
+    """
+    Closed-form objective of the current sequence with positions begin..end (inclusive)
+    replaced by the tasks of segment. Only the prefix sums lo = begin + 1 .. hi = end + 1
+    change (S, A and B are the same after the segment, AS and BS change by a constant),
+    so they are recomputed in the segment buffers and the rest is read from the current
+    prefix sums. Return tuple (obj_function, tasks_before_dd).
+    """
+    n = len(S) - 1
+    lo, hi = begin + 1, end + 1
+    S_k, A_k, B_k, AS_k, BS_k = S[begin], A[begin], B[begin], AS[begin], BS[begin]
+    for idx in range(hi - lo + 1):
+        task = segment[idx]
+        S_k += p[task]
+        A_k += alpha[task]
+        B_k += beta[task]
+        AS_k += alpha[task] * S_k
+        BS_k += beta[task] * S_k
+        S_seg[idx], A_seg[idx], B_seg[idx], AS_seg[idx], BS_seg[idx] = S_k, A_k, B_k, AS_k, BS_k
+        W_seg[idx] = A_k + B_k
+    tail_AS = AS_seg[hi - lo] - AS[hi]
+    tail_BS = BS_seg[hi - lo] - BS[hi]
+
+    # Straddling task (W = A + B, see SequenceEvaluator.get_straddling_position) and optimal offset
+    B_total = B[n]
+    low, high = 0, n + 1
+    while low < high:
+        middle = (low + high) // 2
+        if middle < lo:
+            w = A[middle] + B[middle]
+        elif middle <= hi:
+            w = W_seg[middle - lo]
+        else:
+            w = A[middle] + B[middle]
+        if w <= B_total:
+            low = middle + 1
+        else:
+            high = middle
+    k_star = min(low, n)
+    offset = max(due_date - point(S, S_seg, lo, hi, 0.0, k_star), 0.0)
+    start_to_due_date = due_date - offset
+
+    # Tasks completed before (or at) due date
+    m = count_less_equal(S, S_seg, lo, hi, 0.0, start_to_due_date) - 1
+    earliness = point(A, A_seg, lo, hi, 0.0, m) * start_to_due_date - point(AS, AS_seg, lo, hi, tail_AS, m)
+    tardiness = (
+        point(BS, BS_seg, lo, hi, tail_BS, n) - point(BS, BS_seg, lo, hi, tail_BS, m)
+        - (B_total - point(B, B_seg, lo, hi, 0.0, m)) * start_to_due_date
+    )
+    return earliness + tardiness, m
+
+
+def run_stage_kernel(
+    sequence, best_sequence, p, alpha, beta, due_date, current_obj, tasks_before_dd, best_obj,
+    temperature, random_numbers, accepted_obj, accepted_n, accepted_neighborhood
+):
+    """
+    Run the len(random_numbers) perturbations of one SA stage (see SimulatedAnnealing.run_stage):
+    swaps (neighborhood 3) in the first half and insertions (neighborhood 4) in the second,
+    each move drawing its positions and acceptance test from a row of random_numbers.
+    sequence and best_sequence are updated in place and the accepted moves are written to
+    the accepted_* buffers. Return tuple (current_obj, tasks_before_dd, best_obj, accepted).
+    """
+    n = len(sequence)
+    minimum_tested = len(random_numbers)
+    S, A, B = np.zeros(n + 1), np.zeros(n + 1), np.zeros(n + 1)
+    AS, BS = np.zeros(n + 1), np.zeros(n + 1)
+    load_prefix_sums(sequence, p, alpha, beta, S, A, B, AS, BS)
+    segment = np.empty(n, dtype=sequence.dtype)
+    S_seg, A_seg, B_seg, W_seg = np.empty(n), np.empty(n), np.empty(n), np.empty(n)
+    AS_seg, BS_seg = np.empty(n), np.empty(n)
+
+    accepted = 0
+    for move in range(minimum_tested):
+        neighborhood = 3 if move <= minimum_tested / 2 else 4
+        position_1 = int(random_numbers[move, 0] * n)
+        position_2 = int(random_numbers[move, 1] * n)
+        if position_1 == position_2:
+            # Identity move, accepted like in run_stage
+            new_obj, new_tasks_before_dd = current_obj, tasks_before_dd
+            begin, end = position_1, position_1
+        else:
+            # Tasks of positions begin..end after the move
+            begin, end = min(position_1, position_2), max(position_1, position_2)
+            length = end - begin + 1
+            if neighborhood == 3:
+                segment[:length] = sequence[begin:end + 1]
+                segment[0], segment[length - 1] = sequence[end], sequence[begin]
+            elif position_1 < position_2:
+                segment[:length - 1] = sequence[begin + 1:end + 1]
+                segment[length - 1] = sequence[begin]
+            else:
+                segment[0] = sequence[end]
+                segment[1:length] = sequence[begin:end]
+            new_obj, new_tasks_before_dd = evaluate_segment(
+                segment, begin, end, p, alpha, beta, due_date, S, A, B, AS, BS,
+                S_seg, A_seg, B_seg, W_seg, AS_seg, BS_seg
+            )
+
+        # Metropolis criterion
+        delta_e = new_obj - current_obj
+        if (delta_e > 0) and (random_numbers[move, 2] >= np.exp(-delta_e / temperature)):
+            continue
+
+        if position_1 != position_2:
+            length = end - begin + 1
+            sequence[begin:end + 1] = segment[:length]
+            tail_AS = AS_seg[length - 1] - AS[end + 1]
+            tail_BS = BS_seg[length - 1] - BS[end + 1]
+            S[begin + 1:end + 2] = S_seg[:length]
+            A[begin + 1:end + 2] = A_seg[:length]
+            B[begin + 1:end + 2] = B_seg[:length]
+            AS[begin + 1:end + 2] = AS_seg[:length]
+            BS[begin + 1:end + 2] = BS_seg[:length]
+            AS[end + 2:] += tail_AS
+            BS[end + 2:] += tail_BS
+        current_obj, tasks_before_dd = new_obj, new_tasks_before_dd
+        if current_obj < best_obj:
+            best_obj = current_obj
+            best_sequence[:] = sequence
+        accepted_obj[accepted] = current_obj
+        accepted_n[accepted] = move
+        accepted_neighborhood[accepted] = neighborhood
+        accepted += 1
+
+    return current_obj, tasks_before_dd, best_obj, accepted
+
+
+if has_numba:
+    load_prefix_sums = njit(cache=True)(load_prefix_sums)
+    count_less_equal = njit(cache=True)(count_less_equal)
+    point = njit(cache=True)(point)
+    evaluate_segment = njit(cache=True)(evaluate_segment)
+    run_stage_kernel = njit(cache=True)(run_stage_kernel)
@@ -0,0 +1,81 @@
+import time
+import pandas as pd
+
+
+def deadline_reached(deadline) -> bool:
+    return (deadline is not None) and (time.time() >= deadline)
+
+
+def time_left(deadline):
+    """
+    Seconds left until deadline (None if there is no deadline)
+    """
+    return None if deadline is None else max(deadline - time.time(), 0.0)
+
+
+class TimeBudget:
+    budget_policies = {'fixed', 'adaptive'}
+    default_shares = {'constructive': 0.05, 'heuristic': 0.6, 'vnd': 0.05, 'fix_and_optimize': 0.3}
+
+    def __init__(self, parameters, stages):
+        """
+        Wall-clock budget of total_time seconds split over the stages of the pipeline, run in
+        the given order, by their shares. With policy 'fixed' each stage gets its share of
+        the total budget, and with 'adaptive' its share of the time left when it starts
+        relative to the stages still to run, so the time left over by a stage that stops
+        early (e.g. SA by its own stop criteria) goes to the next ones. Deadlines are
+        time.time() values, so they hold in worker processes too.
+        """
+        self.total_time = parameters['total_time']
+        self.policy = parameters.get('policy', 'adaptive')
+        if self.policy not in self.budget_policies:
+            raise Exception(f'Error: Budget policy {self.policy} not implemented')
+        shares = parameters.get('shares', self.default_shares)
+        for stage in stages:
+            if stage not in shares:
+                raise Exception(f'Error: Budget share of stage {stage} not defined')
+        self.stages = list(stages)
+        self.shares = {stage: shares[stage] for stage in self.stages}
+
+        self.start_time = None
+        self.deadline = None
+        self.stage_begin = {}
+        self.stage_deadline = {}
+        self.usage = {'STAGE': [], 'ALLOTTED': [], 'USED': [], 'STOPPED_BY_DEADLINE': []}
+
+    def start(self):
+        self.start_time = time.time()
+        self.deadline = self.start_time + self.total_time
+
+    def start_stage(self, stage):
+        """
+        Return the deadline of stage, which starts now
+        """
+        now = time.time()
+        remaining = max(self.deadline - now, 0.0)
+        if self.policy == 'fixed':
+            allotted = min(self.total_time * self.shares[stage], remaining)
+        else:
+            pending_shares = sum(self.shares[pending] for pending in self.stages[self.stages.index(stage):])
+            allotted = remaining * self.shares[stage] / pending_shares
+        self.stage_begin[stage] = now
+        self.stage_deadline[stage] = now + allotted
+        return self.stage_deadline[stage]
+
+    def end_stage(self, stage):
+        now = time.time()
+        self.usage['STAGE'].append(stage)
+        self.usage['ALLOTTED'].append(round(self.stage_deadline[stage] - self.stage_begin[stage], 4))
+        self.usage['USED'].append(round(now - self.stage_begin[stage], 4))
+        self.usage['STOPPED_BY_DEADLINE'].append(now >= self.stage_deadline[stage])
+
+    def get_usage(self):
+        """
+        Return the allotted and used seconds of each stage, and of the whole budget
+        """
+        usage_df = pd.DataFrame(self.usage)
+        total_df = pd.DataFrame({
+            'STAGE': ['total'], 'ALLOTTED': [self.total_time], 'USED': [round(time.time() - self.start_time, 4)],
+            'STOPPED_BY_DEADLINE': [deadline_reached(self.deadline)]
+        })
+        return pd.concat([usage_df, total_df], ignore_index=True)
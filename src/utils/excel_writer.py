@@ -1,6 +1,9 @@
 import pandas as pd
 import logging
 class ExcelWriter:
+    # Column widths are fitted to the first rows only, so sizing long sheets stays cheap
+    width_rows = 1000
+
     def __init__(self, output_path):
         self.output_path = output_path
         self.writer = pd.ExcelWriter(self.output_path, engine='xlsxwriter')
@@ -9,9 +12,9 @@ class ExcelWriter:
         df.to_excel(self.writer, sheet_name=sheet_name, index=index)
         worksheet = self.writer.sheets[sheet_name]  # pull worksheet object
         for idx, col in enumerate(df):  # loop through all columns
-            series = df[col]
+            series = df[col].iloc[:self.width_rows]
             max_len = max((
-                series.astype(str).map(len).max(),  # len of largest item
+                series.map(str).map(len).max(),  # len of largest item
                 len(str(series.name))  # len of column name/header
                 )) + 1  # adding a little extra space
             worksheet.set_column(idx, idx, max_len)  # set column width
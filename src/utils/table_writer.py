@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pandas as pd
+
+# PyArrow is optional, without it Parquet tables are written as CSV
+try:
+    import pyarrow
+    import pyarrow.parquet
+    has_pyarrow = True
+except ImportError:
+    has_pyarrow = False
+
+
+class TableWriter:
+    table_formats = {'csv', 'parquet', 'npz'}
+
+    def __init__(self, output_directory, table_format):
+        """
+        Writes each table as one file (csv, parquet or npz with one array per column) of
+        output_directory. Tables are DataFrames or iterables of DataFrame chunks (e.g.
+        SolutionTrace.iter_chunks), appended to csv and parquet files one chunk at a time,
+        so a streamed trace is never loaded at once.
+        """
+        if table_format not in self.table_formats:
+            raise Exception(f'Error: Table format {table_format} not implemented')
+        if (table_format == 'parquet') and not has_pyarrow:
+            print('PyArrow is not installed, tables are written as CSV')
+            table_format = 'csv'
+        self.output_directory = output_directory
+        self.table_format = table_format
+
+    def write_table(self, table, name):
+        chunks = [table] if isinstance(table, pd.DataFrame) else table
+        path = os.path.join(self.output_directory, f'{name}.{self.table_format}')
+        if self.table_format == 'csv':
+            self.write_csv(chunks, path)
+        elif self.table_format == 'parquet':
+            self.write_parquet(chunks, path)
+        else:
+            self.write_npz(chunks, path)
+        return path
+
+    @staticmethod
+    def write_csv(chunks, path):
+        with open(path, 'w', newline='') as file:
+            for idx, chunk in enumerate(chunks):
+                chunk.to_csv(file, index=False, header=(idx == 0))
+
+    @staticmethod
+    def write_parquet(chunks, path):
+        writer = None
+        for chunk in chunks:
+            arrow_table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, arrow_table.schema)
+            writer.write_table(arrow_table.cast(writer.schema))
+        if writer is not None:
+            writer.close()
+
+    @staticmethod
+    def write_npz(chunks, path):
+        columns = {}
+        for chunk in chunks:
+            for column in chunk.columns:
+                columns.setdefault(column, []).append(chunk[column].to_numpy())
+        arrays = {}
+        for column, arrays_of_chunks in columns.items():
+            array = np.concatenate(arrays_of_chunks)
+            # Object columns (e.g. event names) as strings, so the file loads without pickle
+            arrays[str(column)] = array.astype(str) if array.dtype == object else array
+        np.savez(path, **arrays)
@@ -0,0 +1,353 @@
+import math
+import numpy as np
+import pandas as pd
+from .sequence_evaluator import SequenceEvaluator
+from .time_budget import deadline_reached
+from .instrumentation import instrumentation
+
+
+def get_v_shape_orders(task_df):
+    """
+    Return task positions (in task_df) sorted for the early part (non-increasing p/alpha)
+    and for the tardy part (non-decreasing p/beta), ties broken by task_id
+    """
+    p = task_df['p'].to_numpy(dtype=np.float64)
+    alpha = task_df['alpha'].to_numpy(dtype=np.float64)
+    beta = task_df['beta'].to_numpy(dtype=np.float64)
+    task_ids = task_df['task_id'].to_numpy()
+
+    # Tasks without cost on one side are free there (first early tasks, last tardy tasks)
+    early_ratio = np.divide(p, alpha, out=np.full(len(p), np.inf), where=alpha > 0)
+    tardy_ratio = np.divide(p, beta, out=np.full(len(p), np.inf), where=beta > 0)
+    early_order = np.lexsort((task_ids, -early_ratio))
+    tardy_order = np.lexsort((task_ids, tardy_ratio))
+    return early_order, tardy_order
+
+
+def v_shape_repair(solution, task_df, due_date):
+    """
+    Return tuple (obj_function, sequence) of the V-shaped version of solution: tasks
+    completed before the due date sorted by non-increasing p/alpha and the others by
+    non-decreasing p/beta (also tried with the straddling task kept first). The sorting
+    and the optimal offset are repeated while the objective improves, so the result is never
+    worse than the given solution.
+    """
+    sequence_evaluator = SequenceEvaluator(task_df, due_date)
+    early_order, tardy_order = get_v_shape_orders(task_df)
+    task_ids = task_df['task_id'].to_numpy(dtype=np.int64)
+    early_rank = np.empty(sequence_evaluator.p.shape, dtype=np.int64)
+    tardy_rank = np.empty(sequence_evaluator.p.shape, dtype=np.int64)
+    early_rank[task_ids[early_order]] = np.arange(len(task_ids))
+    tardy_rank[task_ids[tardy_order]] = np.arange(len(task_ids))
+
+    sequence = np.asarray(solution, dtype=np.int64)
+    obj_function, _, tasks_before_dd = sequence_evaluator.solve_offset(sequence)
+    while True:
+        early = sequence[:tasks_before_dd]
+        early = early[np.argsort(early_rank[early], kind='stable')]
+        tardy = sequence[tasks_before_dd:]
+        candidates = [
+            np.concatenate([early, tardy[np.argsort(tardy_rank[tardy], kind='stable')]]),
+            np.concatenate([early, tardy[:1], tardy[1:][np.argsort(tardy_rank[tardy[1:]], kind='stable')]])
+        ]
+        candidate_values = [sequence_evaluator.solve_offset(candidate) for candidate in candidates]
+        best = int(np.argmin([value[0] for value in candidate_values]))
+        if candidate_values[best][0] >= obj_function:
+            break
+        sequence = candidates[best]
+        obj_function, _, tasks_before_dd = candidate_values[best]
+
+    return obj_function, sequence.tolist()
+
+
+class VShapeSearch:
+    random_block_size = 4096
+
+    def __init__(self, task_df, due_date, initial_solution, heuristic_parameters):
+        """
+        Simulated annealing over early/tardy partitions instead of permutations. A partition is
+        sequenced as its early tasks by non-increasing p/alpha, finishing at the due date, then
+        its tardy tasks by non-decreasing p/beta, which is optimal for that partition when the
+        due date is not restrictive (early processing time <= due date, kept as a constraint).
+
+        Early tasks are indexed by their rank in the early order and tardy tasks by their rank
+        in the tardy order, in Fenwick trees of p, alpha and beta. Moving a task across the
+        due date changes the cost of its own side and of the tasks before (early) or after
+        (tardy) it by prefix sums, so a flip is evaluated in O(log n) and an exchange of an
+        early and a tardy task as two flips.
+        """
+        self.task_df = task_df
+        self.due_date = due_date
+        self.sequence_evaluator = SequenceEvaluator(task_df, due_date)
+
+        # Seeded random generator, numbers are drawn in blocks
+        self.rng = np.random.default_rng(heuristic_parameters.get('seed'))
+        self.random_numbers = []
+        self.random_index = 0
+
+        # Tasks data by position in task_df and their ranks in the early and tardy orders
+        self.task_ids = task_df['task_id'].to_numpy(dtype=np.int64)
+        self.p = task_df['p'].astype(float).to_list()
+        self.alpha = task_df['alpha'].astype(float).to_list()
+        self.beta = task_df['beta'].astype(float).to_list()
+        self.early_order, self.tardy_order = get_v_shape_orders(task_df)
+        self.early_rank = np.empty(len(task_df), dtype=np.int64)
+        self.tardy_rank = np.empty(len(task_df), dtype=np.int64)
+        self.early_rank[self.early_order] = np.arange(len(task_df))
+        self.tardy_rank[self.tardy_order] = np.arange(len(task_df))
+        self.early_rank = self.early_rank.tolist()
+        self.tardy_rank = self.tardy_rank.tolist()
+
+        # Algorithm control attributes
+        self.temperature_alpha = heuristic_parameters['temperature_alpha']
+        self.stages_stop_criteria = heuristic_parameters['stages_stop_criteria']
+        self.initial_acceptance = heuristic_parameters['initial_acceptance']
+        self.exchange_probability = heuristic_parameters.get('exchange_probability', 0.5)
+        self.deadline = heuristic_parameters.get('deadline')
+        self.interrupted = False
+
+        self.load_solution(initial_solution)
+
+    def load_solution(self, solution):
+        """
+        Start from the partition of the given sequence (tasks completed before the due date
+        with its optimal offset)
+        """
+        index_by_task = pd.Series(np.arange(len(self.task_ids)), index=self.task_ids)
+        sequence = np.asarray(solution, dtype=np.int64)
+        _, _, tasks_before_dd = self.sequence_evaluator.solve_offset(sequence)
+        self.is_early = [False] * len(self.task_ids)
+        for idx in index_by_task[sequence[:tasks_before_dd]]:
+            self.is_early[idx] = True
+
+        # Prefix sums of each side and members of each side (for random picks)
+        n = len(self.task_ids)
+        self.early_p, self.early_alpha = _FenwickTree(n), _FenwickTree(n)
+        self.tardy_p, self.tardy_beta = _FenwickTree(n), _FenwickTree(n)
+        self.P_early = self.A_early = self.P_tardy = self.B_tardy = 0.0
+        self.members = [[], []]
+        self.member_index = [0] * n
+        for idx in range(n):
+            self.add_task(idx, self.is_early[idx])
+
+        self.current_obj = self.calculate_partition_cost()
+        self.global_best_obj = self.current_obj
+        self.global_best_partition = self.is_early.copy()
+        self.trace = {'STAGE': [], 'TEMPERATURE': [], 'OBJ': [], 'BEST_OBJ': [], 'ACCEPTED': []}
+
+    def get_trace(self):
+        return pd.DataFrame(self.trace)
+
+    def get_sequence(self, is_early=None):
+        """
+        Merge the early and tardy tasks of the partition in their presorted orders
+        """
+        is_early = np.asarray(self.is_early if is_early is None else is_early)
+        early = self.early_order[is_early[self.early_order]]
+        tardy = self.tardy_order[~is_early[self.tardy_order]]
+        return self.task_ids[np.concatenate([early, tardy])]
+
+    def calculate_partition_cost(self):
+        """
+        Cost of the partition with the early tasks finishing at the due date, from scratch
+        """
+        sequence = self.get_sequence()
+        n_early = sum(self.is_early)
+        p = self.sequence_evaluator.p[sequence]
+        earliness = np.cumsum(p[:n_early][::-1])[::-1] - p[:n_early]
+        tardiness = np.cumsum(p[n_early:])
+        return float(
+            (self.sequence_evaluator.alpha[sequence[:n_early]] * earliness).sum()
+            + (self.sequence_evaluator.beta[sequence[n_early:]] * tardiness).sum()
+        )
+
+    def add_task(self, idx, early):
+        members = self.members[int(early)]
+        self.member_index[idx] = len(members)
+        members.append(idx)
+        self.is_early[idx] = early
+        if early:
+            self.early_p.add(self.early_rank[idx], self.p[idx])
+            self.early_alpha.add(self.early_rank[idx], self.alpha[idx])
+            self.P_early += self.p[idx]
+            self.A_early += self.alpha[idx]
+        else:
+            self.tardy_p.add(self.tardy_rank[idx], self.p[idx])
+            self.tardy_beta.add(self.tardy_rank[idx], self.beta[idx])
+            self.P_tardy += self.p[idx]
+            self.B_tardy += self.beta[idx]
+
+    def remove_task(self, idx):
+        early = self.is_early[idx]
+        members = self.members[int(early)]
+        last = members.pop()
+        if last != idx:
+            members[self.member_index[idx]] = last
+            self.member_index[last] = self.member_index[idx]
+        if early:
+            self.early_p.add(self.early_rank[idx], -self.p[idx])
+            self.early_alpha.add(self.early_rank[idx], -self.alpha[idx])
+            self.P_early -= self.p[idx]
+            self.A_early -= self.alpha[idx]
+        else:
+            self.tardy_p.add(self.tardy_rank[idx], -self.p[idx])
+            self.tardy_beta.add(self.tardy_rank[idx], -self.beta[idx])
+            self.P_tardy -= self.p[idx]
+            self.B_tardy -= self.beta[idx]
+
+    def flip(self, idx):
+        early = self.is_early[idx]
+        self.remove_task(idx)
+        self.add_task(idx, not early)
+
+    def early_cost(self, idx):
+        # Cost of idx in the early part plus the earliness it adds to early tasks before it
+        rank = self.early_rank[idx]
+        after_p = self.P_early - self.early_p.prefix(rank + 1)
+        return self.alpha[idx] * after_p + self.p[idx] * self.early_alpha.prefix(rank)
+
+    def tardy_cost(self, idx):
+        # Cost of idx in the tardy part plus the tardiness it adds to tardy tasks after it
+        rank = self.tardy_rank[idx]
+        before_p = self.tardy_p.prefix(rank)
+        after_beta = self.B_tardy - self.tardy_beta.prefix(rank + 1)
+        return self.beta[idx] * (before_p + self.p[idx]) + self.p[idx] * after_beta
+
+    def flip_delta(self, idx):
+        """
+        Return the cost change of moving idx to the other side of the due date (None if the
+        early tasks would not fit before the due date)
+        """
+        if self.is_early[idx]:
+            return self.tardy_cost(idx) - self.early_cost(idx)
+        elif self.P_early + self.p[idx] > self.due_date:
+            return None
+        return self.early_cost(idx) - self.tardy_cost(idx)
+
+    def draw_uniform(self) -> float:
+        if self.random_index >= len(self.random_numbers):
+            self.random_numbers = self.rng.random(self.random_block_size).tolist()
+            self.random_index = 0
+        value = self.random_numbers[self.random_index]
+        self.random_index += 1
+        return value
+
+    def draw_member(self, early):
+        members = self.members[int(early)]
+        if not members:
+            return None
+        return members[int(self.draw_uniform() * len(members))]
+
+    def accept(self, delta, temperature):
+        return (delta <= 0) or (self.draw_uniform() < math.exp(-delta / temperature))
+
+    def run_move(self, temperature) -> bool:
+        """
+        Test a random flip or exchange at the given temperature, return True if accepted
+        """
+        if self.draw_uniform() >= self.exchange_probability:
+            idx = int(self.draw_uniform() * len(self.task_ids))
+            delta = self.flip_delta(idx)
+            if (delta is None) or not self.accept(delta, temperature):
+                return False
+            self.flip(idx)
+        else:
+            early_idx = self.draw_member(True)
+            tardy_idx = self.draw_member(False)
+            if (early_idx is None) or (tardy_idx is None):
+                return False
+            delta = self.flip_delta(early_idx)
+            self.flip(early_idx)
+            tardy_delta = self.flip_delta(tardy_idx)
+            if (tardy_delta is None) or not self.accept(delta + tardy_delta, temperature):
+                self.flip(early_idx)
+                return False
+            self.flip(tardy_idx)
+            delta += tardy_delta
+
+        self.current_obj += delta
+        if self.current_obj < self.global_best_obj:
+            self.global_best_obj = self.current_obj
+            self.global_best_partition = self.is_early.copy()
+        return True
+
+    def define_initial_temperature(self) -> float:
+        delta_e_array = []
+        for _ in range(100):
+            delta = self.flip_delta(int(self.draw_uniform() * len(self.task_ids)))
+            if delta is not None:
+                delta_e_array.append(delta)
+        mean_delta = np.mean(np.abs(delta_e_array)) if delta_e_array else 0
+        return max(mean_delta, 1e-9) / - math.log(self.initial_acceptance)
+
+    def run(self):
+        temperature = self.define_initial_temperature()
+        instrumentation.emit('partition_start', temperature=temperature)
+        moves_per_stage = 5 * len(self.task_ids)
+
+        stage = 0
+        stages_without_improvement = 0
+        try:
+            while (stages_without_improvement < self.stages_stop_criteria) and not deadline_reached(self.deadline):
+                last_stage_obj = self.global_best_obj
+                perturbations_accepted = sum(self.run_move(temperature) for _ in range(moves_per_stage))
+                self.current_obj = self.calculate_partition_cost()
+
+                self.trace['STAGE'].append(stage)
+                self.trace['TEMPERATURE'].append(temperature)
+                self.trace['OBJ'].append(self.current_obj)
+                self.trace['BEST_OBJ'].append(self.global_best_obj)
+                self.trace['ACCEPTED'].append(perturbations_accepted)
+                instrumentation.emit(
+                    'partition_stage', stage=stage, temperature=temperature, obj=self.current_obj, best_obj=self.global_best_obj,
+                    accepted=perturbations_accepted
+                )
+
+                if self.global_best_obj < last_stage_obj:
+                    stages_without_improvement = 0
+                else:
+                    stages_without_improvement += 1
+                temperature = self.calculate_next_temperature(temperature)
+                stage += 1
+        except KeyboardInterrupt:
+            self.interrupted = True
+            instrumentation.emit('partition_stop', stage=stage, reason='interrupt', best_obj=self.global_best_obj)
+
+        # Best partition evaluated with its optimal offset
+        sequence = self.get_sequence(self.global_best_partition)
+        obj_function, _, _ = self.sequence_evaluator.solve_offset(sequence)
+        solution_df = (
+            pd.DataFrame({
+                'task_id': sequence
+            })
+            .merge(self.task_df, on='task_id')
+        )
+        return (obj_function, solution_df)
+
+    def calculate_next_temperature(self, current_temperature) -> float:
+        return self.temperature_alpha * current_temperature
+
+
+class _FenwickTree:
+    def __init__(self, size) -> None:
+        """
+        Array of sums supporting point additions and prefix sums in O(log n)
+        """
+        self.size = size
+        self.tree = [0.0] * (size + 1)
+
+    def add(self, idx, value):
+        idx += 1
+        while idx <= self.size:
+            self.tree[idx] += value
+            idx += idx & -idx
+
+    def prefix(self, end):
+        """
+        Return the sum of values[:end]
+        """
+        result = 0.0
+        while end > 0:
+            result += self.tree[end]
+            end -= end & -end
+        return result
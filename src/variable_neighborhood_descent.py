@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+from .sequence_evaluator import IncrementalEvaluator
+from .time_budget import deadline_reached
+from .instrumentation import instrumentation
+
+
+class VariableNeighborhoodDescent:
+    neighborhood_types = {'swap', 'insertion', 'or_opt'}
+    improvement_types = {'best', 'first'}
+
+    def __init__(self, task_df, due_date, parameters):
+        """
+        Deterministic descent over the swap, insertion and block move (Or-opt, blocks of 2 to
+        max_block_length tasks moved in both directions) neighborhoods, in the given order.
+        All moves of a neighborhood are evaluated by the incremental evaluator in chunks of
+        chunk_size moves: with improvement 'best' the best move of the whole neighborhood is
+        applied, and with 'first' the best move of the first chunk that improves. After an
+        improving move the descent restarts from the first neighborhood, and it stops at a
+        local optimum of all neighborhoods (or max_iterations moves).
+
+        Runs between SA and Fix-and-Optimize, or instead of it with replace_fix_and_optimize
+        (see ProblemManager).
+        """
+        self.task_df = task_df
+        self.due_date = due_date
+
+        # Algorithm control attributes
+        self.neighborhoods = parameters.get('neighborhoods', ['swap', 'insertion', 'or_opt'])
+        self.improvement = parameters.get('improvement', 'best')
+        self.max_block_length = parameters.get('max_block_length', 3)
+        self.chunk_size = parameters.get('chunk_size', 2 ** 16)
+        self.max_iterations = parameters.get('max_iterations')
+        self.replace_fix_and_optimize = parameters.get('replace_fix_and_optimize', False)
+        self.deadline = parameters.get('deadline')
+        self.interrupted = False
+        for neighborhood in self.neighborhoods:
+            if neighborhood not in self.neighborhood_types:
+                raise Exception(f'Error: Neighborhood {neighborhood} not implemented')
+        if self.improvement not in self.improvement_types:
+            raise Exception(f'Error: Improvement {self.improvement} not implemented')
+
+        self.problem_evaluator = IncrementalEvaluator(task_df, due_date)
+        self.trace = {'ITERATION': [], 'NEIGHBORHOOD': [], 'OBJ': [], 'MOVES_EVALUATED': []}
+
+    def get_trace(self):
+        return pd.DataFrame(self.trace)
+
+    def run(self, initial_solution):
+        """
+        Return tuple (obj_function, solution_df) of the local optimum reached from initial_solution
+        (or of the last improvement, at the deadline or on KeyboardInterrupt)
+        """
+        sequence = np.asarray(initial_solution, dtype=np.int64).copy()
+        current_obj, _ = self.problem_evaluator.load_solution(sequence)
+        initial_obj = current_obj
+        moves = {neighborhood: self.get_moves(neighborhood, len(sequence)) for neighborhood in self.neighborhoods}
+
+        iteration = 0
+        neighborhood_idx = 0
+        try:
+            while (neighborhood_idx < len(self.neighborhoods)) and ((self.max_iterations is None) or (iteration < self.max_iterations)):
+                if deadline_reached(self.deadline):
+                    instrumentation.emit('vnd_stop', iteration=iteration, reason='time_budget', obj=current_obj)
+                    break
+                neighborhood = self.neighborhoods[neighborhood_idx]
+                _, move, moves_evaluated = self.search_neighborhood(neighborhood, moves[neighborhood], current_obj)
+
+                if move is None:
+                    neighborhood_idx += 1
+                else:
+                    sequence = self.apply_move(sequence, neighborhood, move)
+                    current_obj, _ = self.problem_evaluator.load_solution(sequence)
+                    neighborhood_idx = 0
+                    iteration += 1
+
+                self.trace['ITERATION'].append(iteration)
+                self.trace['NEIGHBORHOOD'].append(neighborhood)
+                self.trace['OBJ'].append(current_obj)
+                self.trace['MOVES_EVALUATED'].append(moves_evaluated)
+        except KeyboardInterrupt:
+            # sequence is only replaced by fully moved copies, its objective is recomputed
+            self.interrupted = True
+            current_obj, _ = self.problem_evaluator.load_solution(sequence)
+            instrumentation.emit('vnd_stop', iteration=iteration, reason='interrupt', obj=current_obj)
+
+        instrumentation.emit('vnd_summary', initial_obj=initial_obj, obj=current_obj, moves=iteration)
+        return current_obj, self.get_solution_df(sequence)
+
+    def get_moves(self, neighborhood, n):
+        """
+        Return the arrays of moves of the neighborhood: position pairs for swaps, and
+        (begin, split, end) rotations for insertions and block moves (see
+        IncrementalEvaluator.evaluate_rotations)
+        """
+        if neighborhood == 'swap':
+            return np.triu_indices(n, 1)
+
+        block_lengths = [1] if neighborhood == 'insertion' else range(2, self.max_block_length + 1)
+        positions = np.arange(n)
+        begins, splits, ends = [], [], []
+        for block_length in block_lengths:
+            begin, end = np.nonzero(positions[None, :] - positions[:, None] >= block_length)
+            # Block begin..begin + block_length - 1 moved after end
+            begins.append(begin)
+            splits.append(begin + block_length)
+            ends.append(end)
+            # Block end - block_length + 1..end moved before begin (same move if the range holds two blocks)
+            backward = end - begin + 1 != 2 * block_length
+            begins.append(begin[backward])
+            splits.append(end[backward] - block_length + 1)
+            ends.append(end[backward])
+        return np.concatenate(begins), np.concatenate(splits), np.concatenate(ends)
+
+    def search_neighborhood(self, neighborhood, moves, current_obj):
+        """
+        Return tuple (obj_function, move, moves_evaluated) of the improving move of the
+        neighborhood chosen by the improvement strategy, with move None if there is none
+        """
+        n_moves = len(moves[0])
+        best_obj, best_move = current_obj, None
+        moves_evaluated = 0
+        for chunk_begin in range(0, n_moves, self.chunk_size):
+            chunk = [positions[chunk_begin:chunk_begin + self.chunk_size] for positions in moves]
+            if neighborhood == 'swap':
+                obj_function, _ = self.problem_evaluator.evaluate_swaps(*chunk)
+            else:
+                obj_function, _ = self.problem_evaluator.evaluate_rotations(*chunk)
+            moves_evaluated += len(obj_function)
+
+            best_idx = int(np.argmin(obj_function))
+            if obj_function[best_idx] < best_obj - 1e-9:
+                best_obj = float(obj_function[best_idx])
+                best_move = tuple(int(positions[best_idx]) for positions in chunk)
+                if self.improvement == 'first':
+                    break
+        return best_obj, best_move, moves_evaluated
+
+    @staticmethod
+    def apply_move(sequence, neighborhood, move):
+        sequence = sequence.copy()
+        if neighborhood == 'swap':
+            position_1, position_2 = move
+            sequence[position_1], sequence[position_2] = sequence[position_2], sequence[position_1]
+        else:
+            begin, split, end = move
+            sequence[begin:end + 1] = np.concatenate([sequence[split:end + 1], sequence[begin:split]])
+        return sequence
+
+    def get_solution_df(self, sequence):
+        _, offset, _ = self.problem_evaluator.solve_offset(sequence)
+        solution_df = pd.DataFrame({'task_id': sequence}).merge(self.task_df[['task_id', 'p', 'alpha', 'beta']], on='task_id')
+        solution_df['task_end'] = solution_df['p'].cumsum() + offset
+        return solution_df[['task_id', 'p', 'task_end', 'alpha', 'beta']]